@@ -0,0 +1,574 @@
+import math
+import pygame
+
+
+# -------------------------------------------------------------------------------------------------------------------
+# This file contains the 'broadphase' stage of the collision library. A broadphase keeps track of roughly where every
+# shape is in the world so that, given a shape, it can quickly hand back the handful of other shapes that might be
+# touching it. The CollisionGrid then runs the exact (and much more expensive) collision functions on just those.
+#
+# There are two implementations:
+#     - GridBroadphase, a sparse uniform grid of squares. Only squares with shapes in them exist, so it costs memory in
+#       proportion to what is in the world rather than the size of the world, and has no edges.
+#     - SweepAndPruneBroadphase, which keeps the shapes' AABB extents sorted along one axis and only re-sorts what
+#       moved each frame. Good for worlds that are mostly long corridors with small clusters of moving things.
+# -------------------------------------------------------------------------------------------------------------------
+
+
+class BaseBroadphase:
+    """
+    Interface the CollisionGrid uses to find candidate shapes. The shape stores themselves are owned by the
+    CollisionGrid and shared with the broadphase when it is attached.
+    """
+    def __init__(self):
+        self.dynamic_shapes = []
+        self.static_shapes = []
+        # can static shapes be of any size, or must they fit inside a single grid square
+        self.supports_large_static_shapes = False
+
+    def attach(self, dynamic_shapes, static_shapes):
+        self.dynamic_shapes = dynamic_shapes
+        self.static_shapes = static_shapes
+
+    def add_dynamic_shape(self, shape):
+        pass
+
+    def remove_dynamic_shape(self, shape):
+        pass
+
+    def add_static_shape(self, shape, static_shape_index):
+        pass
+
+    def remove_static_shape(self, shape):
+        pass
+
+    def update_shape_positions(self, moved_shapes):
+        """
+        Catch up with dynamic shapes that have moved since the last update.
+
+        :param moved_shapes: the dynamic shapes that have moved, each appearing once
+        """
+        pass
+
+    def update_shape_positions_from_store(self, shape_store, rows):
+        """
+        Same job as update_shape_positions(), for when the collision grid keeps a ShapeStore. Broadphases that can
+        make use of the store's arrays override this.
+
+        :param shape_store: the collision grid's ShapeStore, with the positions of the moved shapes up to date
+        :param rows: the store rows of the dynamic shapes that have moved
+        """
+        self.update_shape_positions([shape_store.shapes[row] for row in rows])
+
+    def get_nearby_shapes(self, shape):
+        """
+        Every other shape that might be colliding with this one. Each shape is returned at most once.
+
+        :param shape: the dynamic shape we are about to collision test
+        :return: an iterable of dynamic and static shapes
+        """
+        return []
+
+    def get_shapes_in_aabb(self, aabb_rect):
+        """
+        Every shape that might overlap a rectangle, for the collision grid's spatial queries. Each shape is returned
+        at most once. This checks every shape in turn, broadphases should override it with something quicker.
+
+        :param aabb_rect: a pygame.Rect in world space
+        :return: an iterable of dynamic and static shapes
+        """
+        return [shape for shape in self.dynamic_shapes + self.static_shapes
+                if shape is not None and shape.aabb_rect.colliderect(aabb_rect)]
+
+    def get_shapes_along_line(self, start, end):
+        """
+        Every shape that might touch a line segment, for raycasts. Yields (shapes, fraction) batches in the order
+        they are met going from start to end, where every shape that could touch the line before that fraction of
+        the way along it has been yielded by the end of the batch. A raycast that has already hit something closer
+        can stop there.
+
+        :param start: the start of the line
+        :param end: the end of the line
+        """
+        yield self.get_shapes_in_aabb(self.get_line_aabb_rect(start, end)), 1.0
+
+    @staticmethod
+    def get_line_aabb_rect(start, end):
+        left = int(math.floor(min(start[0], end[0])))
+        top = int(math.floor(min(start[1], end[1])))
+        # one pixel bigger than the line, so a line with no width or height still makes a rect that can overlap
+        return pygame.Rect(left, top, int(math.ceil(max(start[0], end[0]))) - left + 1,
+                           int(math.ceil(max(start[1], end[1]))) - top + 1)
+
+
+class GridSquare:
+    def __init__(self):
+        self.index_of_first_shape_in_square = -1
+        self.index_of_last_shape_in_square = -1
+        self.index_of_first_static_shape_in_square = -1
+
+        # used instead of the chains above when the grid is in multi cell insertion mode, as a shape can then
+        # belong to many squares at once. The dictionary is used as an insertion ordered set of shape indices.
+        self.dynamic_shape_indices = {}
+        self.static_shape_indices = []
+
+
+class GridBroadphase(BaseBroadphase):
+    def __init__(self, grid_pixel_size, multi_cell_insertion=False):
+        super().__init__()
+        self.grid_square_pixel_size = grid_pixel_size
+        # spatial hash of grid squares keyed by their (x, y) grid position. Squares are created when the first shape
+        # arrives in them and thrown away again when the last one leaves.
+        self.grid = {}
+
+        # In multi cell insertion mode shapes are registered in every grid square their AABB overlaps and only
+        # test against the squares they are in. Otherwise shapes live in the square containing their centre and
+        # search a neighbourhood of squares big enough to cover their size.
+        self.multi_cell_insertion = multi_cell_insertion
+        self.supports_large_static_shapes = multi_cell_insertion
+        # stamped onto shapes as they are found, so a pair sharing several squares is only returned once
+        self.collision_test_stamp = 0
+        # the most squares any dynamic shape added so far searches around its own. Queries in single cell mode have
+        # to look this far past the squares they cover to find every shape reaching into them.
+        self.largest_search_radius = 1
+
+    def get_or_create_square(self, grid_x, grid_y):
+        square = self.grid.get((grid_x, grid_y))
+        if square is None:
+            square = GridSquare()
+            self.grid[(grid_x, grid_y)] = square
+        return square
+
+    def drop_square_if_empty(self, grid_x, grid_y, square):
+        if (square.index_of_first_shape_in_square == -1 and square.index_of_first_static_shape_in_square == -1 and
+                len(square.dynamic_shape_indices) == 0 and len(square.static_shape_indices) == 0):
+            del self.grid[(grid_x, grid_y)]
+
+    def get_nearby_shapes(self, shape):
+        if self.multi_cell_insertion:
+            return self.get_shapes_in_occupied_squares(shape)
+
+        nearby_shapes = []
+        for grid_x in range(shape.nearby_grid_range_x[0], shape.nearby_grid_range_x[1] + 1):
+            for grid_y in range(shape.nearby_grid_range_y[0], shape.nearby_grid_range_y[1] + 1):
+                square = self.grid.get((grid_x, grid_y))
+                if square is None:
+                    continue
+
+                # dynamic shapes
+                shape_index_in_square = square.index_of_first_shape_in_square
+                while shape_index_in_square != -1:
+                    shape_to_test = self.dynamic_shapes[shape_index_in_square]
+                    nearby_shapes.append(shape_to_test)
+                    shape_index_in_square = shape_to_test.next_shape_in_grid_square_index
+
+                # static shapes
+                static_shape_index_in_square = square.index_of_first_static_shape_in_square
+                while static_shape_index_in_square != -1:
+                    shape_to_test = self.static_shapes[static_shape_index_in_square]
+                    nearby_shapes.append(shape_to_test)
+                    static_shape_index_in_square = shape_to_test.next_shape_in_grid_square_index
+        return nearby_shapes
+
+    def get_shapes_in_occupied_squares(self, shape):
+        self.collision_test_stamp += 1
+        stamp = self.collision_test_stamp
+        shape.collision_test_stamp = stamp
+        nearby_shapes = []
+        for grid_x in range(shape.nearby_grid_range_x[0], shape.nearby_grid_range_x[1] + 1):
+            for grid_y in range(shape.nearby_grid_range_y[0], shape.nearby_grid_range_y[1] + 1):
+                square = self.grid.get((grid_x, grid_y))
+                if square is None:
+                    continue
+
+                # dynamic shapes
+                for shape_index_in_square in square.dynamic_shape_indices:
+                    shape_to_test = self.dynamic_shapes[shape_index_in_square]
+                    if shape_to_test.collision_test_stamp != stamp:
+                        shape_to_test.collision_test_stamp = stamp
+                        nearby_shapes.append(shape_to_test)
+
+                # static shapes
+                for static_shape_index_in_square in square.static_shape_indices:
+                    shape_to_test = self.static_shapes[static_shape_index_in_square]
+                    if shape_to_test.collision_test_stamp != stamp:
+                        shape_to_test.collision_test_stamp = stamp
+                        nearby_shapes.append(shape_to_test)
+        return nearby_shapes
+
+    def get_query_padding(self):
+        # in single cell mode shapes are filed under the square containing their centre, so a query also has to
+        # look in the squares around the ones it covers for shapes that reach into them
+        if self.multi_cell_insertion:
+            return 0
+        return self.largest_search_radius
+
+    def gather_shapes_in_square(self, square, stamp, found_shapes):
+        shape_index_in_square = square.index_of_first_shape_in_square
+        while shape_index_in_square != -1:
+            shape = self.dynamic_shapes[shape_index_in_square]
+            if shape.collision_test_stamp != stamp:
+                shape.collision_test_stamp = stamp
+                found_shapes.append(shape)
+            shape_index_in_square = shape.next_shape_in_grid_square_index
+
+        static_shape_index_in_square = square.index_of_first_static_shape_in_square
+        while static_shape_index_in_square != -1:
+            shape = self.static_shapes[static_shape_index_in_square]
+            if shape.collision_test_stamp != stamp:
+                shape.collision_test_stamp = stamp
+                found_shapes.append(shape)
+            static_shape_index_in_square = shape.next_shape_in_grid_square_index
+
+        for shape_index_in_square in square.dynamic_shape_indices:
+            shape = self.dynamic_shapes[shape_index_in_square]
+            if shape.collision_test_stamp != stamp:
+                shape.collision_test_stamp = stamp
+                found_shapes.append(shape)
+
+        for static_shape_index_in_square in square.static_shape_indices:
+            shape = self.static_shapes[static_shape_index_in_square]
+            if shape.collision_test_stamp != stamp:
+                shape.collision_test_stamp = stamp
+                found_shapes.append(shape)
+
+    def gather_shapes_in_square_range(self, grid_range_x, grid_range_y, stamp, found_shapes):
+        num_squares_in_range = (grid_range_x[1] - grid_range_x[0] + 1) * (grid_range_y[1] - grid_range_y[0] + 1)
+        if num_squares_in_range > len(self.grid):
+            # the grid is sparse, so for big ranges it is quicker to go through the squares that actually exist
+            for (grid_x, grid_y), square in self.grid.items():
+                if grid_range_x[0] <= grid_x <= grid_range_x[1] and grid_range_y[0] <= grid_y <= grid_range_y[1]:
+                    self.gather_shapes_in_square(square, stamp, found_shapes)
+            return
+
+        for grid_x in range(grid_range_x[0], grid_range_x[1] + 1):
+            for grid_y in range(grid_range_y[0], grid_range_y[1] + 1):
+                square = self.grid.get((grid_x, grid_y))
+                if square is not None:
+                    self.gather_shapes_in_square(square, stamp, found_shapes)
+
+    def get_shapes_in_aabb(self, aabb_rect):
+        grid_range_x, grid_range_y = self.get_aabb_grid_range(aabb_rect)
+        padding = self.get_query_padding()
+        self.collision_test_stamp += 1
+        found_shapes = []
+        self.gather_shapes_in_square_range([grid_range_x[0] - padding, grid_range_x[1] + padding],
+                                           [grid_range_y[0] - padding, grid_range_y[1] + padding],
+                                           self.collision_test_stamp, found_shapes)
+        return found_shapes
+
+    def get_shapes_along_line(self, start, end):
+        # Walk the grid squares the line passes through in order (a DDA, as in Amanatides & Woo's 'A Fast Voxel
+        # Traversal Algorithm'), stepping across whichever square edge, vertical or horizontal, the line reaches
+        # first. Each square's shapes are handed out along with the fraction of the line at which it leaves it.
+        direction = [end[0] - start[0], end[1] - start[1]]
+        grid_pos = self.get_grid_pos(start[0], start[1])
+        end_grid_pos = self.get_grid_pos(end[0], end[1])
+        steps = [0, 0]
+        next_edge_fractions = [math.inf, math.inf]
+        fractions_per_square = [math.inf, math.inf]
+        for axis in (0, 1):
+            if direction[axis] > 0.0:
+                steps[axis] = 1
+                next_edge_fractions[axis] = (((grid_pos[axis] + 1) * self.grid_square_pixel_size) - start[axis]) / \
+                    direction[axis]
+                fractions_per_square[axis] = self.grid_square_pixel_size / direction[axis]
+            elif direction[axis] < 0.0:
+                steps[axis] = -1
+                next_edge_fractions[axis] = ((grid_pos[axis] * self.grid_square_pixel_size) - start[axis]) / \
+                    direction[axis]
+                fractions_per_square[axis] = -self.grid_square_pixel_size / direction[axis]
+
+        padding = self.get_query_padding()
+        self.collision_test_stamp += 1
+        stamp = self.collision_test_stamp
+        while True:
+            exit_fraction = min(next_edge_fractions[0], next_edge_fractions[1], 1.0)
+            found_shapes = []
+            self.gather_shapes_in_square_range([grid_pos[0] - padding, grid_pos[0] + padding],
+                                               [grid_pos[1] - padding, grid_pos[1] + padding],
+                                               stamp, found_shapes)
+            yield found_shapes, exit_fraction
+            if exit_fraction >= 1.0 or grid_pos == end_grid_pos:
+                return
+            axis = 0 if next_edge_fractions[0] < next_edge_fractions[1] else 1
+            grid_pos[axis] += steps[axis]
+            next_edge_fractions[axis] += fractions_per_square[axis]
+
+    def get_grid_pos(self, x, y):
+        return [int(x // self.grid_square_pixel_size), int(y // self.grid_square_pixel_size)]
+
+    def update_shape_positions(self, moved_shapes):
+        for shape in moved_shapes:
+            if self.multi_cell_insertion:
+                self.update_shape_grid_range(shape)
+                continue
+            new_grid_pos = self.get_grid_pos(shape.x, shape.y)
+            if shape.current_grid_pos[0] == new_grid_pos[0] and shape.current_grid_pos[1] == new_grid_pos[1]:
+                pass
+            else:
+                self.remove_shape_from_old_grid_pos_by_index(shape.grid_slot_index, shape.current_grid_pos)
+                self.add_shape_to_new_grid_pos_by_index(shape.grid_slot_index, new_grid_pos)
+                shape.set_new_grid_pos(new_grid_pos)
+
+    def update_shape_positions_from_store(self, shape_store, rows):
+        # the store works out the new grid squares for every shape at once, so we only visit the shapes that moved
+        if self.multi_cell_insertion:
+            for shape, grid_range_x, grid_range_y in shape_store.find_shapes_changing_grid_range(
+                    rows, self.grid_square_pixel_size):
+                self.remove_shape_from_grid_range_by_index(shape.grid_slot_index,
+                                                           shape.nearby_grid_range_x, shape.nearby_grid_range_y)
+                self.add_shape_to_grid_range_by_index(shape.grid_slot_index, grid_range_x, grid_range_y)
+                self.set_shape_grid_range(shape, grid_range_x, grid_range_y)
+            return
+
+        for shape, new_grid_pos in shape_store.find_shapes_changing_grid_square(rows, self.grid_square_pixel_size):
+            self.remove_shape_from_old_grid_pos_by_index(shape.grid_slot_index, shape.current_grid_pos)
+            self.add_shape_to_new_grid_pos_by_index(shape.grid_slot_index, new_grid_pos)
+            shape.set_new_grid_pos(new_grid_pos)
+
+    def update_shape_grid_range(self, shape):
+        grid_range_x, grid_range_y = self.get_aabb_grid_range(shape.aabb_rect)
+        if grid_range_x != shape.nearby_grid_range_x or grid_range_y != shape.nearby_grid_range_y:
+            self.remove_shape_from_grid_range_by_index(shape.grid_slot_index,
+                                                       shape.nearby_grid_range_x, shape.nearby_grid_range_y)
+            self.add_shape_to_grid_range_by_index(shape.grid_slot_index, grid_range_x, grid_range_y)
+            self.set_shape_grid_range(shape, grid_range_x, grid_range_y)
+
+    def get_aabb_grid_range(self, aabb_rect):
+        grid_range_x = [int(aabb_rect.left // self.grid_square_pixel_size),
+                        int((aabb_rect.right - 1) // self.grid_square_pixel_size)]
+        grid_range_y = [int(aabb_rect.top // self.grid_square_pixel_size),
+                        int((aabb_rect.bottom - 1) // self.grid_square_pixel_size)]
+        return grid_range_x, grid_range_y
+
+    def set_shape_grid_range(self, shape, grid_range_x, grid_range_y):
+        # in multi cell mode the 'nearby' squares a shape searches are exactly the squares it occupies
+        shape.current_grid_pos = self.get_grid_pos(shape.x, shape.y)
+        shape.nearby_grid_range_x = grid_range_x
+        shape.nearby_grid_range_y = grid_range_y
+
+    def add_shape_to_grid_range_by_index(self, shape_index, grid_range_x, grid_range_y):
+        for grid_x in range(grid_range_x[0], grid_range_x[1] + 1):
+            for grid_y in range(grid_range_y[0], grid_range_y[1] + 1):
+                self.get_or_create_square(grid_x, grid_y).dynamic_shape_indices[shape_index] = None
+
+    def remove_shape_from_grid_range_by_index(self, shape_index, grid_range_x, grid_range_y):
+        for grid_x in range(grid_range_x[0], grid_range_x[1] + 1):
+            for grid_y in range(grid_range_y[0], grid_range_y[1] + 1):
+                square = self.grid[(grid_x, grid_y)]
+                del square.dynamic_shape_indices[shape_index]
+                self.drop_square_if_empty(grid_x, grid_y, square)
+
+    # shape must fit entirely inside single grid square, unless we are in multi cell insertion mode
+    def add_static_shape(self, shape, static_shape_index):
+        if self.multi_cell_insertion:
+            grid_range_x, grid_range_y = self.get_aabb_grid_range(shape.aabb_rect)
+            self.set_shape_grid_range(shape, grid_range_x, grid_range_y)
+            for grid_x in range(grid_range_x[0], grid_range_x[1] + 1):
+                for grid_y in range(grid_range_y[0], grid_range_y[1] + 1):
+                    self.get_or_create_square(grid_x, grid_y).static_shape_indices.append(static_shape_index)
+            return
+
+        new_grid_pos = self.get_grid_pos(shape.x, shape.y)
+        shape.set_new_grid_pos(new_grid_pos)
+        self.add_static_shape_to_new_grid_pos_by_index(static_shape_index, new_grid_pos)
+
+    def remove_static_shape(self, shape):
+        static_shape_index = shape.grid_slot_index
+        if self.multi_cell_insertion:
+            for grid_x in range(shape.nearby_grid_range_x[0], shape.nearby_grid_range_x[1] + 1):
+                for grid_y in range(shape.nearby_grid_range_y[0], shape.nearby_grid_range_y[1] + 1):
+                    square = self.grid[(grid_x, grid_y)]
+                    square.static_shape_indices.remove(static_shape_index)
+                    self.drop_square_if_empty(grid_x, grid_y, square)
+            return
+
+        # static chains are only linked one way, so walk along to find the shape before ours
+        square = self.grid[(shape.current_grid_pos[0], shape.current_grid_pos[1])]
+        if square.index_of_first_static_shape_in_square == static_shape_index:
+            square.index_of_first_static_shape_in_square = shape.next_shape_in_grid_square_index
+        else:
+            current_index = square.index_of_first_static_shape_in_square
+            while self.static_shapes[current_index].next_shape_in_grid_square_index != static_shape_index:
+                current_index = self.static_shapes[current_index].next_shape_in_grid_square_index
+            self.static_shapes[current_index].next_shape_in_grid_square_index = shape.next_shape_in_grid_square_index
+        shape.next_shape_in_grid_square_index = -1
+        self.drop_square_if_empty(shape.current_grid_pos[0], shape.current_grid_pos[1], square)
+
+    def add_static_shape_to_new_grid_pos_by_index(self, shape_index, grid_pos):
+        # check if grid square empty of shapes, if so add our shape
+        self.static_shapes[shape_index].next_shape_in_grid_square_index = -1
+        square = self.get_or_create_square(grid_pos[0], grid_pos[1])
+        if square.index_of_first_static_shape_in_square == -1:
+            square.index_of_first_static_shape_in_square = shape_index
+        else:
+            current_index = square.index_of_first_static_shape_in_square
+            next_index = self.static_shapes[current_index].next_shape_in_grid_square_index
+            # zip to the end of our list
+            while current_index != -1 and next_index != -1:
+                current_index = self.static_shapes[current_index].next_shape_in_grid_square_index
+                next_index = self.static_shapes[next_index].next_shape_in_grid_square_index
+
+            self.static_shapes[current_index].next_shape_in_grid_square_index = shape_index
+
+    def add_dynamic_shape(self, shape):
+        if self.multi_cell_insertion:
+            grid_range_x, grid_range_y = self.get_aabb_grid_range(shape.aabb_rect)
+            self.set_shape_grid_range(shape, grid_range_x, grid_range_y)
+            self.add_shape_to_grid_range_by_index(shape.grid_slot_index, grid_range_x, grid_range_y)
+            return
+
+        new_grid_pos = self.get_grid_pos(shape.x, shape.y)
+        shape.set_grid_search_radius(self.grid_square_pixel_size)
+        self.largest_search_radius = max(self.largest_search_radius, shape.num_squares_to_search_around_grid_pos)
+        shape.set_new_grid_pos(new_grid_pos)
+        self.add_shape_to_new_grid_pos_by_index(shape.grid_slot_index, new_grid_pos)
+
+    def remove_dynamic_shape(self, shape):
+        if self.multi_cell_insertion:
+            self.remove_shape_from_grid_range_by_index(shape.grid_slot_index,
+                                                       shape.nearby_grid_range_x, shape.nearby_grid_range_y)
+        else:
+            self.remove_shape_from_old_grid_pos_by_index(shape.grid_slot_index, shape.current_grid_pos)
+
+    def add_shape_to_new_grid_pos_by_index(self, shape_index, grid_pos):
+        # link our shape onto the end of the grid square's chain of shapes
+        square = self.get_or_create_square(grid_pos[0], grid_pos[1])
+        shape = self.dynamic_shapes[shape_index]
+        shape.next_shape_in_grid_square_index = -1
+        shape.prev_shape_in_grid_square_index = square.index_of_last_shape_in_square
+        if square.index_of_last_shape_in_square == -1:
+            square.index_of_first_shape_in_square = shape_index
+        else:
+            last_shape = self.dynamic_shapes[square.index_of_last_shape_in_square]
+            last_shape.next_shape_in_grid_square_index = shape_index
+        square.index_of_last_shape_in_square = shape_index
+
+    def remove_shape_from_old_grid_pos_by_index(self, shape_index, grid_pos):
+        # unlink our shape from the grid square's chain by joining up its neighbours
+        square = self.grid[(grid_pos[0], grid_pos[1])]
+        shape = self.dynamic_shapes[shape_index]
+        prev_index = shape.prev_shape_in_grid_square_index
+        next_index = shape.next_shape_in_grid_square_index
+        if prev_index == -1:
+            square.index_of_first_shape_in_square = next_index
+        else:
+            self.dynamic_shapes[prev_index].next_shape_in_grid_square_index = next_index
+        if next_index == -1:
+            square.index_of_last_shape_in_square = prev_index
+        else:
+            self.dynamic_shapes[next_index].prev_shape_in_grid_square_index = prev_index
+        shape.next_shape_in_grid_square_index = -1
+        shape.prev_shape_in_grid_square_index = -1
+        self.drop_square_if_empty(grid_pos[0], grid_pos[1], square)
+
+
+class SweepAndPruneEndPoint:
+    def __init__(self, shape, is_min, is_static):
+        self.shape = shape
+        self.is_min = is_min
+        self.is_static = is_static
+        self.value = math.inf
+
+
+class SweepAndPruneBroadphase(BaseBroadphase):
+    """
+    Incremental sweep and prune along a single axis. The min and max AABB extents of every shape are kept in one
+    sorted list; each frame the extents are refreshed and the list is put back in order with an insertion sort,
+    which is close to linear when little has moved. Whenever a min end point and a max end point swap places, the
+    pair of shapes they belong to have started or stopped overlapping on this axis, so we keep a running record of
+    overlapping pairs without ever doing a full search.
+    """
+    def __init__(self, axis=0):
+        super().__init__()
+        self.axis = axis
+        self.supports_large_static_shapes = True
+        self.end_points = []
+        self.end_points_by_shape = {}
+        # for each shape, an insertion ordered set of the shapes its extents overlap on our axis
+        self.overlapping_shapes = {}
+
+    def get_extents(self, shape):
+        if self.axis == 0:
+            return shape.aabb_rect.left, shape.aabb_rect.right
+        return shape.aabb_rect.top, shape.aabb_rect.bottom
+
+    def add_shape(self, shape, is_static):
+        shape_end_points = [SweepAndPruneEndPoint(shape, True, is_static),
+                            SweepAndPruneEndPoint(shape, False, is_static)]
+        self.end_points_by_shape[shape] = shape_end_points
+        self.overlapping_shapes[shape] = {}
+        # new end points start beyond the end of the list and are sorted into place, picking up their overlaps
+        self.end_points.extend(shape_end_points)
+        shape_end_points[0].value, shape_end_points[1].value = self.get_extents(shape)
+        self.sort_end_points(len(self.end_points) - 2)
+
+    def add_static_shape(self, shape, static_shape_index):
+        self.add_shape(shape, True)
+
+    def add_dynamic_shape(self, shape):
+        self.add_shape(shape, False)
+
+    def remove_dynamic_shape(self, shape):
+        self.remove_shape(shape)
+
+    def remove_static_shape(self, shape):
+        self.remove_shape(shape)
+
+    def remove_shape(self, shape):
+        for end_point in self.end_points_by_shape.pop(shape):
+            self.end_points.remove(end_point)
+        for other_shape in self.overlapping_shapes.pop(shape):
+            del self.overlapping_shapes[other_shape][shape]
+
+    def update_shape_positions(self, moved_shapes):
+        for shape in moved_shapes:
+            shape_end_points = self.end_points_by_shape[shape]
+            shape_end_points[0].value, shape_end_points[1].value = self.get_extents(shape)
+        self.sort_end_points(1)
+
+    def sort_end_points(self, start_index):
+        end_points = self.end_points
+        for i in range(max(1, start_index), len(end_points)):
+            moving = end_points[i]
+            j = i
+            while j > 0 and end_points[j - 1].value > moving.value:
+                passed = end_points[j - 1]
+                # pairs of static shapes can't collide, so we don't bother recording them
+                if moving.is_min != passed.is_min and not (moving.is_static and passed.is_static):
+                    if moving.is_min:
+                        # a min end point moved below another shape's max, they now overlap
+                        self.add_overlap(moving.shape, passed.shape)
+                    else:
+                        # a max end point moved below another shape's min, they no longer overlap
+                        self.remove_overlap(moving.shape, passed.shape)
+                end_points[j] = passed
+                j -= 1
+            end_points[j] = moving
+
+    def add_overlap(self, shape_a, shape_b):
+        self.overlapping_shapes[shape_a][shape_b] = None
+        self.overlapping_shapes[shape_b][shape_a] = None
+
+    def remove_overlap(self, shape_a, shape_b):
+        self.overlapping_shapes[shape_a].pop(shape_b, None)
+        self.overlapping_shapes[shape_b].pop(shape_a, None)
+
+    def get_nearby_shapes(self, shape):
+        return list(self.overlapping_shapes[shape])
+
+    def get_shapes_in_aabb(self, aabb_rect):
+        if self.axis == 0:
+            rect_min, rect_max = aabb_rect.left, aabb_rect.right
+        else:
+            rect_min, rect_max = aabb_rect.top, aabb_rect.bottom
+        # the end points are in order, so every shape overlapping the rect on our axis has its min end point before
+        # the rect's max and its max end point after the rect's min
+        found_shapes = []
+        for end_point in self.end_points:
+            if end_point.value >= rect_max:
+                break
+            if end_point.is_min and self.end_points_by_shape[end_point.shape][1].value > rect_min:
+                found_shapes.append(end_point.shape)
+        return found_shapes
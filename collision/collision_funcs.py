@@ -5,6 +5,9 @@ from collision.collision_shapes import *
 # They currently just return True, in the case of an overlap, or False, in the case of no overlap.
 # The polygon polygon function also stores a MTV (minimum translation vector) which should be the minimum
 # vector to translate either shape by to undo the collision.
+#
+# The overlap functions further down only answer whether two shapes overlap, without working out or
+# storing an MTV. They are used for sensor shapes.
 # -------------------------------------------------------------------------------------------------------
 # TODO: create better, MTV-like, calculations for other collision functions
 
@@ -40,6 +43,34 @@ def collide_circle_with_rotated_rectangle(circle, rect):
     rect_center_x = rect.x
     rect_center_y = rect.y
 
+    distance = get_distance_from_circle_to_rotated_rectangle(circle, rect)
+
+    if distance < circle.radius:
+        if distance > 0.0:
+            x_dist = circle.x - rect_center_x
+            y_dist = circle.y - rect_center_y
+            overlap_normal = [x_dist / distance, y_dist / distance]
+            overlap_dist = circle.radius - distance
+        else:
+            overlap_normal = [0.0, -1.0]
+            overlap_dist = 1.0
+
+        overlap_vector = [overlap_normal[0] * overlap_dist, overlap_normal[1] * overlap_dist]
+        if abs(overlap_vector[0]) > 0.0 or abs(overlap_vector[1]) > 0.0:
+            circle.set_loop_mtv_vector(rect, overlap_vector)
+            rect.set_loop_mtv_vector(circle, [-overlap_vector[0], -overlap_vector[1]])
+        return True
+
+    return False
+
+
+def get_distance_from_circle_to_rotated_rectangle(circle, rect):
+    """
+    The distance from the centre of a circle to the closest point on or in a rotated rectangle.
+    """
+    rect_center_x = rect.x
+    rect_center_y = rect.y
+
     rect_x = rect_center_x - rect.width / 2
     rect_y = rect_center_y - rect.height / 2
 
@@ -68,61 +99,40 @@ def collide_circle_with_rotated_rectangle(circle, rect):
     elif un_rotated_circle_y > rect_reference_y + rect.height:
         closest_y = rect_reference_y + rect.height
 
-    # Determine collision
-    distance = get_distance(un_rotated_circle_x, un_rotated_circle_y, closest_x, closest_y)
-
-    if distance < circle.radius:
-        if distance > 0.0:
-            x_dist = circle.x - rect_center_x
-            y_dist = circle.y - rect_center_y
-            overlap_normal = [x_dist / distance, y_dist / distance]
-            overlap_dist = circle.radius - distance
-        else:
-            overlap_normal = [0.0, -1.0]
-            overlap_dist = 1.0
-
-        overlap_vector = [overlap_normal[0] * overlap_dist, overlap_normal[1] * overlap_dist]
-        if abs(overlap_vector[0]) > 0.0 or abs(overlap_vector[1]) > 0.0:
-            circle.set_loop_mtv_vector(rect, overlap_vector)
-            rect.set_loop_mtv_vector(circle, [-overlap_vector[0], -overlap_vector[1]])
-        return True
-
-    return False
+    return get_distance(un_rotated_circle_x, un_rotated_circle_y, closest_x, closest_y)
 
 
 def collide_polygon_with_polygon(a, b):
-    polygons = [a, b]
+    if a.rotation == 0 and b.rotation == 0:
+        return collide_axis_aligned_rect_with_axis_aligned_rect(a, b)
+
+    a.update_bounds_if_needed()
+    b.update_bounds_if_needed()
     smallest_overlap = 1000000000.0
     overlap_vector = [0.0, 0.0]
 
-
-
-    for i in range(0, len(polygons)):
-        # for each polygon, look at each edge of the polygon, and determine if it separates
+    for polygon, other_polygon in ((a, b), (b, a)):
+        # for each polygon, look at the axis perpendicular to each of its edges, and determine if it separates
         # the two shapes
-        polygon = polygons[i]
-        for name, edge in polygon.edges.items():
-            # find the line perpendicular to this edge
-            normal = [edge.b.y - edge.a.y, edge.a.x - edge.b.x]
-
+        for axis_x, axis_y, should_skip in polygon.axis_table:
+            # for each vertex in the first shape, project it onto the axis and keep track of the min and max of
+            # these values. The axes are unit length so these are in pixels.
             min_a = None
             max_a = None
-            # for each vertex in the first shape, project it onto the line perpendicular to the edge
-            # and keep track of the min and max of these values
-            for j in range(0, len(a.verts)):
-                projected = (normal[0] * a.verts[j][0]) + (normal[1] * a.verts[j][1])
+            for vert in a.verts:
+                projected = (axis_x * vert[0]) + (axis_y * vert[1])
                 if (min_a is None) or (projected < min_a):
                     min_a = projected
 
                 if (max_a is None) or (projected > max_a):
                     max_a = projected
 
-            # for each vertex in the second shape, project it onto the line perpendicular to the edge
-            # and keep track of the min and max of these values
+            # for each vertex in the second shape, project it onto the axis and keep track of the min and max of
+            # these values
             min_b = None
             max_b = None
-            for j in range(0, len(b.verts)):
-                projected = (normal[0] * b.verts[j][0]) + (normal[1] * b.verts[j][1])
+            for vert in b.verts:
+                projected = (axis_x * vert[0]) + (axis_y * vert[1])
                 if (min_b is None) or (projected < min_b):
                     min_b = projected
 
@@ -133,32 +143,102 @@ def collide_polygon_with_polygon(a, b):
             # polygons, and we know there is no overlap
             if (max_a < min_b) or (max_b < min_a):
                 return False
+
+            # test if we need to ignore collision reactions along this axis, either because the polygon's own
+            # normal is skipped or the other polygon skips a normal pointing the same way
+            if should_skip or is_axis_skipped(other_polygon, axis_x, axis_y):
+                continue
+
+            if max_a > max_b:
+                overall_projection_length = max_a - min_b
+                direction = 1
             else:
-                normalised_normal = polygon.normals[name].value
-
-                if max_a > max_b:
-                    overall_projection_length = max_a - min_b
-                    direction = 1
-                else:
-                    overall_projection_length = max_b - min_a
-                    direction = -1
-
-                # test if we need to ignore collision reactions along this normal
-                skip_normal = False
-                for normal_test_polygon in polygons:
-                    for normal_to_test in normal_test_polygon.normals.values():
-                        if is_approx_equal(normalised_normal, normal_to_test.value):
-                            if normal_to_test.should_skip:
-                                skip_normal = True
-
-                if not skip_normal:
-                    combined_length_of_both_shapes = max_a - min_a + max_b - min_b
-                    overlap_depth = (combined_length_of_both_shapes - overall_projection_length) / edge.length
-                    if overlap_depth < smallest_overlap:
-                        smallest_overlap = overlap_depth
-                        overlap_vector[0] = direction * (normalised_normal[0] * overlap_depth)
-                        overlap_vector[1] = direction * (normalised_normal[1] * overlap_depth)
+                overall_projection_length = max_b - min_a
+                direction = -1
+
+            combined_length_of_both_shapes = max_a - min_a + max_b - min_b
+            overlap_depth = combined_length_of_both_shapes - overall_projection_length
+            if overlap_depth < smallest_overlap:
+                smallest_overlap = overlap_depth
+                overlap_vector[0] = direction * (axis_x * overlap_depth)
+                overlap_vector[1] = direction * (axis_y * overlap_depth)
+
+    print_polygon_collision_stages(a, b, overlap_vector)
+
+    if abs(overlap_vector[0]) > 0.0 or abs(overlap_vector[1]) > 0.0:
+        a.set_loop_mtv_vector(b, overlap_vector)
+        b.set_loop_mtv_vector(a, [-overlap_vector[0], -overlap_vector[1]])
+    return True
+
+
+def collide_axis_aligned_rect_with_axis_aligned_rect(a, b):
+    """
+    Fast path for the polygon test when neither rect is rotated, which is most of them. The only separating axes
+    are the world x and y axes so we can compare the rects' intervals directly, rather than projecting vertices.
+
+    Gives the same result as the general polygon test: touching edges count as an overlap, the axes are tried in
+    the order up, right, down, left, and an axis is ignored for the MTV if either rect skips the matching normal.
+
+    :param a: An unrotated CollisionRect.
+    :param b: Another unrotated CollisionRect.
+    :return: True if the rects overlap.
+    """
+    # worked out from the centre, rather than the verts, so we don't need to bring the rects' bounds up to date
+    a_half_width = a.width / 2
+    a_half_height = a.height / 2
+    b_half_width = b.width / 2
+    b_half_height = b.height / 2
+    a_left = a.x - a_half_width
+    a_right = a.x + a_half_width
+    a_top = a.y - a_half_height
+    a_bottom = a.y + a_half_height
+    b_left = b.x - b_half_width
+    b_right = b.x + b_half_width
+    b_top = b.y - b_half_height
+    b_bottom = b.y + b_half_height
+
+    if a_left > b_right or b_left > a_right or a_top > b_bottom or b_top > a_bottom:
+        return False
+
+    combined_width = (a_right - a_left) + (b_right - b_left)
+    combined_height = (a_bottom - a_top) + (b_bottom - b_top)
+    # on each axis the MTV pushes a away from whichever side of b it sticks out of the furthest
+    if a_top < b_top:
+        up_axis_overlap = [0.0, -(combined_height - (b_bottom - a_top))]
+    else:
+        up_axis_overlap = [0.0, combined_height - (a_bottom - b_top)]
+    if a_right > b_right:
+        right_axis_overlap = [combined_width - (a_right - b_left), 0.0]
+    else:
+        right_axis_overlap = [-(combined_width - (b_right - a_left)), 0.0]
+    if a_bottom > b_bottom:
+        down_axis_overlap = [0.0, combined_height - (a_bottom - b_top)]
+    else:
+        down_axis_overlap = [0.0, -(combined_height - (b_bottom - a_top))]
+    if a_left < b_left:
+        left_axis_overlap = [-(combined_width - (b_right - a_left)), 0.0]
+    else:
+        left_axis_overlap = [combined_width - (a_right - b_left), 0.0]
+
+    smallest_overlap = 1000000000.0
+    overlap_vector = [0.0, 0.0]
+    for name, axis_overlap in (("top", up_axis_overlap), ("right", right_axis_overlap),
+                               ("bottom", down_axis_overlap), ("left", left_axis_overlap)):
+        if not a.normals[name].should_skip and not b.normals[name].should_skip:
+            overlap_depth = abs(axis_overlap[0] + axis_overlap[1])
+            if overlap_depth < smallest_overlap:
+                smallest_overlap = overlap_depth
+                overlap_vector = axis_overlap
+
+    print_polygon_collision_stages(a, b, overlap_vector)
 
+    if abs(overlap_vector[0]) > 0.0 or abs(overlap_vector[1]) > 0.0:
+        a.set_loop_mtv_vector(b, overlap_vector)
+        b.set_loop_mtv_vector(a, [-overlap_vector[0], -overlap_vector[1]])
+    return True
+
+
+def print_polygon_collision_stages(a, b, overlap_vector):
     if a.print_collision_stages or b.print_collision_stages:
         print("Collision test")
         print("--------------")
@@ -166,12 +246,64 @@ def collide_polygon_with_polygon(a, b):
         print("Polygon B -", "x:", b.x, "y:", b.y, "owner:", b.owner.type)
         print("Overlap vector -", "x:", overlap_vector[0], "y:", overlap_vector[1])
 
-    if abs(overlap_vector[0]) > 0.0 or abs(overlap_vector[1]) > 0.0:
-        a.set_loop_mtv_vector(b, overlap_vector)
-        b.set_loop_mtv_vector(a, [-overlap_vector[0], -overlap_vector[1]])
+
+def overlap_shapes(a, b):
+    """
+    Whether two shapes of any type overlap, without working out an MTV.
+
+    :return: True if the shapes overlap.
+    """
+    if a.type == BaseCollisionShape.COMPOSITE:
+        return any(overlap_shapes(sub_shape, b) for sub_shape in a.get_sub_shapes_in_aabb(b.aabb_rect))
+    if b.type == BaseCollisionShape.COMPOSITE:
+        return any(overlap_shapes(a, sub_shape) for sub_shape in b.get_sub_shapes_in_aabb(a.aabb_rect))
+    if a.type == BaseCollisionShape.RECT and b.type == BaseCollisionShape.RECT:
+        return overlap_polygon_with_polygon(a, b)
+    if a.type == BaseCollisionShape.CIRCLE and b.type == BaseCollisionShape.CIRCLE:
+        return overlap_circle_with_circle(a, b)
+    if a.type == BaseCollisionShape.CIRCLE:
+        return overlap_circle_with_rotated_rectangle(a, b)
+    return overlap_circle_with_rotated_rectangle(b, a)
+
+
+def overlap_circle_with_circle(a, b):
+    x_dist = a.x - b.x
+    y_dist = a.y - b.y
+    return x_dist ** 2 + y_dist ** 2 <= (a.radius + b.radius) ** 2
+
+
+def overlap_circle_with_rotated_rectangle(circle, rect):
+    return get_distance_from_circle_to_rotated_rectangle(circle, rect) < circle.radius
+
+
+def overlap_polygon_with_polygon(a, b):
+    if a.rotation == 0 and b.rotation == 0:
+        a_half_width = a.width / 2
+        a_half_height = a.height / 2
+        b_half_width = b.width / 2
+        b_half_height = b.height / 2
+        return not (a.x - a_half_width > b.x + b_half_width or b.x - b_half_width > a.x + a_half_width or
+                    a.y - a_half_height > b.y + b_half_height or b.y - b_half_height > a.y + a_half_height)
+
+    a.update_bounds_if_needed()
+    b.update_bounds_if_needed()
+    for polygon in (a, b):
+        for axis_x, axis_y, should_skip in polygon.axis_table:
+            # if the projections of the two polygons onto any edge normal don't overlap, that edge separates them
+            projected_a = [(axis_x * vert[0]) + (axis_y * vert[1]) for vert in a.verts]
+            projected_b = [(axis_x * vert[0]) + (axis_y * vert[1]) for vert in b.verts]
+            if max(projected_a) < min(projected_b) or max(projected_b) < min(projected_a):
+                return False
     return True
 
 
+def is_axis_skipped(polygon, axis_x, axis_y):
+    for skipped_axis in polygon.skipped_axes:
+        if abs(skipped_axis[0] - axis_x) < 0.05 and abs(skipped_axis[1] - axis_y) < 0.05:
+            return True
+    return False
+
+
 def is_approx_equal(normal_1, normal_2):
     if abs(normal_1[0] - normal_2[0]) < 0.05:
         if abs(normal_1[1] - normal_2[1]) < 0.05:
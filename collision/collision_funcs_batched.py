@@ -0,0 +1,297 @@
+from collision.collision_funcs import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# -------------------------------------------------------------------------------------------------------
+# Batched versions of the collision functions in collision_funcs.py. Rather than testing one pair of shapes
+# at a time, all the candidate pairs found by the broadphase in a collision loop are gathered into NumPy
+# arrays and tested together. The maths is done in the same order as the single pair functions so the
+# MTVs that come out are exactly the same.
+#
+# Needs NumPy, use is_batching_available() to check before relying on it.
+# -------------------------------------------------------------------------------------------------------
+
+# groups of pairs smaller than this are cheaper to run through the single pair functions
+MIN_PAIRS_TO_BATCH = 16
+
+
+def is_batching_available():
+    return numpy is not None
+
+
+def collide_shape_pairs(pairs):
+    """
+    Test a list of shape pairs for collision, storing MTVs on the shapes just as the single pair collision
+    functions do.
+
+    :param pairs: a list of (shape, shape_to_test) tuples
+    :return: a list with True or False for each pair, or None where the pair is of shapes we can't batch
+             (composites) and should be tested one at a time instead.
+    """
+    results = [None] * len(pairs)
+    axis_aligned_rect_rect_indices = []
+    rect_rect_indices = []
+    circle_circle_indices = []
+    circle_rect_indices = []
+    for pair_index in range(0, len(pairs)):
+        shape, shape_to_test = pairs[pair_index]
+        if shape.print_collision_stages or shape_to_test.print_collision_stages:
+            continue
+        if shape.type == BaseCollisionShape.RECT and shape_to_test.type == BaseCollisionShape.RECT:
+            if shape.rotation == 0 and shape_to_test.rotation == 0:
+                axis_aligned_rect_rect_indices.append(pair_index)
+            else:
+                rect_rect_indices.append(pair_index)
+        elif shape.type == BaseCollisionShape.CIRCLE and shape_to_test.type == BaseCollisionShape.CIRCLE:
+            circle_circle_indices.append(pair_index)
+        elif ((shape.type == BaseCollisionShape.CIRCLE and shape_to_test.type == BaseCollisionShape.RECT) or
+              (shape.type == BaseCollisionShape.RECT and shape_to_test.type == BaseCollisionShape.CIRCLE)):
+            circle_rect_indices.append(pair_index)
+
+    if len(axis_aligned_rect_rect_indices) >= MIN_PAIRS_TO_BATCH:
+        collide_axis_aligned_rect_pairs(pairs, axis_aligned_rect_rect_indices, results)
+    if len(rect_rect_indices) >= MIN_PAIRS_TO_BATCH:
+        collide_polygon_pairs(pairs, rect_rect_indices, results)
+    if len(circle_circle_indices) >= MIN_PAIRS_TO_BATCH:
+        collide_circle_pairs(pairs, circle_circle_indices, results)
+    if len(circle_rect_indices) >= MIN_PAIRS_TO_BATCH:
+        collide_circle_rect_pairs(pairs, circle_rect_indices, results)
+    return results
+
+
+def set_pair_mtv_vectors(a, b, overlap_x, overlap_y):
+    overlap_x = float(overlap_x)
+    overlap_y = float(overlap_y)
+    if abs(overlap_x) > 0.0 or abs(overlap_y) > 0.0:
+        a.set_loop_mtv_vector(b, [overlap_x, overlap_y])
+        b.set_loop_mtv_vector(a, [-overlap_x, -overlap_y])
+
+
+def gather_rects(rects):
+    """
+    Pack the vertices and axis tables of some rects into arrays, one row per rect.
+    """
+    verts = numpy.empty((len(rects), 4, 2))
+    axis_tables = numpy.empty((len(rects), 4, 3))
+    for rect_index in range(0, len(rects)):
+        rect = rects[rect_index]
+        rect.update_bounds_if_needed()
+        verts[rect_index] = rect.verts
+        axis_tables[rect_index] = rect.axis_table
+    return verts, axis_tables[:, :, :2], axis_tables[:, :, 2] != 0.0
+
+
+def collide_polygon_pairs(pairs, pair_indices, results):
+    """
+    Batched collide_polygon_with_polygon(shape, shape_to_test) over the pairs at pair_indices.
+    """
+    a_verts, a_axes, a_skips = gather_rects([pairs[index][0] for index in pair_indices])
+    b_verts, b_axes, b_skips = gather_rects([pairs[index][1] for index in pair_indices])
+
+    # the separating axes to try are the edge normals of a followed by the edge normals of b
+    verts = numpy.concatenate((a_verts, b_verts), axis=1)
+    normalised_normals = numpy.concatenate((a_axes, b_axes), axis=1)
+    axis_x = normalised_normals[:, :, 0]
+    axis_y = normalised_normals[:, :, 1]
+    skip_flags = numpy.concatenate((a_skips, b_skips), axis=1)
+
+    # project every vertex of both shapes onto every axis, giving [pair, axis, vertex]
+    projected = (axis_x[:, :, None] * verts[:, None, :, 0]) + (axis_y[:, :, None] * verts[:, None, :, 1])
+    min_a = projected[:, :, :4].min(axis=2)
+    max_a = projected[:, :, :4].max(axis=2)
+    min_b = projected[:, :, 4:].min(axis=2)
+    max_b = projected[:, :, 4:].max(axis=2)
+
+    collided = ~((max_a < min_b) | (max_b < min_a)).any(axis=1)
+
+    a_is_further = max_a > max_b
+    overall_projection_length = numpy.where(a_is_further, max_a - min_b, max_b - min_a)
+    direction = numpy.where(a_is_further, 1.0, -1.0)
+
+    # an axis is skipped if it is approximately the same as any skipped normal on either shape
+    normal_differences = numpy.abs(normalised_normals[:, :, None, :] - normalised_normals[:, None, :, :])
+    is_approx_equal_normal = (normal_differences[:, :, :, 0] < 0.05) & (normal_differences[:, :, :, 1] < 0.05)
+    skip_axis = (is_approx_equal_normal & skip_flags[:, None, :]).any(axis=2)
+
+    combined_length_of_both_shapes = max_a - min_a + max_b - min_b
+    overlap_depth = combined_length_of_both_shapes - overall_projection_length
+    overlap_depth = numpy.where(skip_axis | ~(overlap_depth < 1000000000.0), numpy.inf, overlap_depth)
+
+    # first smallest overlap wins, just as in the single pair function
+    smallest_axis = overlap_depth.argmin(axis=1)
+    rows = numpy.arange(len(pair_indices))
+    smallest_overlap = overlap_depth[rows, smallest_axis]
+    has_overlap = smallest_overlap != numpy.inf
+    smallest_overlap = numpy.where(has_overlap, smallest_overlap, 0.0)
+    smallest_normal = normalised_normals[rows, smallest_axis]
+    smallest_direction = direction[rows, smallest_axis]
+    overlap_x = smallest_direction * (smallest_normal[:, 0] * smallest_overlap)
+    overlap_y = smallest_direction * (smallest_normal[:, 1] * smallest_overlap)
+
+    for row in range(0, len(pair_indices)):
+        pair_index = pair_indices[row]
+        if collided[row]:
+            results[pair_index] = True
+            if has_overlap[row]:
+                set_pair_mtv_vectors(pairs[pair_index][0], pairs[pair_index][1], overlap_x[row], overlap_y[row])
+        else:
+            results[pair_index] = False
+
+
+def collide_axis_aligned_rect_pairs(pairs, pair_indices, results):
+    """
+    Batched collide_axis_aligned_rect_with_axis_aligned_rect(shape, shape_to_test) over the pairs at pair_indices.
+    """
+    rects = numpy.array([[pairs[index][0].x, pairs[index][0].y, pairs[index][0].width, pairs[index][0].height,
+                          pairs[index][1].x, pairs[index][1].y, pairs[index][1].width, pairs[index][1].height]
+                         for index in pair_indices], dtype=float)
+    # top, right, bottom & left, in the order the axes are tried
+    skip_flags = numpy.array([[pairs[index][0].normals[name].should_skip or pairs[index][1].normals[name].should_skip
+                               for name in ("top", "right", "bottom", "left")] for index in pair_indices], dtype=bool)
+
+    a_half_width = rects[:, 2] / 2
+    a_half_height = rects[:, 3] / 2
+    b_half_width = rects[:, 6] / 2
+    b_half_height = rects[:, 7] / 2
+    a_left = rects[:, 0] - a_half_width
+    a_right = rects[:, 0] + a_half_width
+    a_top = rects[:, 1] - a_half_height
+    a_bottom = rects[:, 1] + a_half_height
+    b_left = rects[:, 4] - b_half_width
+    b_right = rects[:, 4] + b_half_width
+    b_top = rects[:, 5] - b_half_height
+    b_bottom = rects[:, 5] + b_half_height
+
+    collided = ~((a_left > b_right) | (b_left > a_right) | (a_top > b_bottom) | (b_top > a_bottom))
+
+    combined_width = (a_right - a_left) + (b_right - b_left)
+    combined_height = (a_bottom - a_top) + (b_bottom - b_top)
+    push_up = -(combined_height - (b_bottom - a_top))
+    push_down = combined_height - (a_bottom - b_top)
+    push_left = -(combined_width - (b_right - a_left))
+    push_right = combined_width - (a_right - b_left)
+    axis_overlaps = numpy.stack((numpy.where(a_top < b_top, push_up, push_down),
+                                 numpy.where(a_right > b_right, push_right, push_left),
+                                 numpy.where(a_bottom > b_bottom, push_down, push_up),
+                                 numpy.where(a_left < b_left, push_left, push_right)), axis=1)
+
+    overlap_depth = numpy.abs(axis_overlaps)
+    overlap_depth = numpy.where(skip_flags | ~(overlap_depth < 1000000000.0), numpy.inf, overlap_depth)
+
+    # first smallest overlap wins, just as in the single pair function
+    smallest_axis = overlap_depth.argmin(axis=1)
+    rows = numpy.arange(len(pair_indices))
+    has_overlap = overlap_depth[rows, smallest_axis] != numpy.inf
+    smallest_overlap = axis_overlaps[rows, smallest_axis]
+    is_vertical_axis = (smallest_axis % 2) == 0
+    overlap_x = numpy.where(has_overlap & ~is_vertical_axis, smallest_overlap, 0.0)
+    overlap_y = numpy.where(has_overlap & is_vertical_axis, smallest_overlap, 0.0)
+
+    for row in range(0, len(pair_indices)):
+        pair_index = pair_indices[row]
+        if collided[row]:
+            results[pair_index] = True
+            if has_overlap[row]:
+                set_pair_mtv_vectors(pairs[pair_index][0], pairs[pair_index][1], overlap_x[row], overlap_y[row])
+        else:
+            results[pair_index] = False
+
+
+def collide_circle_pairs(pairs, pair_indices, results):
+    """
+    Batched collide_circle_with_circle(shape, shape_to_test) over the pairs at pair_indices.
+    """
+    circles = numpy.array([[pairs[index][0].x, pairs[index][0].y, pairs[index][0].radius,
+                            pairs[index][1].x, pairs[index][1].y, pairs[index][1].radius] for index in pair_indices],
+                          dtype=float)
+    x_dist = circles[:, 0] - circles[:, 3]
+    y_dist = circles[:, 1] - circles[:, 4]
+    squared_dist = x_dist ** 2 + y_dist ** 2
+    radius_sum = circles[:, 2] + circles[:, 5]
+    collided = squared_dist <= radius_sum ** 2
+
+    dist = numpy.sqrt(squared_dist)
+    has_dist = dist > 0.0
+    safe_dist = numpy.where(has_dist, dist, 1.0)
+    overlap_normal_x = numpy.where(has_dist, x_dist / safe_dist, 0.0)
+    overlap_normal_y = numpy.where(has_dist, y_dist / safe_dist, 1.0)
+    overlap_dist = radius_sum - dist
+    overlap_x = overlap_normal_x * overlap_dist
+    overlap_y = overlap_normal_y * overlap_dist
+
+    for row in range(0, len(pair_indices)):
+        pair_index = pair_indices[row]
+        if collided[row]:
+            results[pair_index] = True
+            set_pair_mtv_vectors(pairs[pair_index][0], pairs[pair_index][1], overlap_x[row], overlap_y[row])
+        else:
+            results[pair_index] = False
+
+
+def collide_circle_rect_pairs(pairs, pair_indices, results):
+    """
+    Batched collide_circle_with_rotated_rectangle over the pairs at pair_indices, whichever way round the
+    circle and rect are in the pair.
+    """
+    circle_rects = []
+    rows = []
+    for index in pair_indices:
+        shape, shape_to_test = pairs[index]
+        if shape.type == BaseCollisionShape.CIRCLE:
+            circle, rect = shape, shape_to_test
+        else:
+            circle, rect = shape_to_test, shape
+        circle_rects.append((circle, rect))
+        # use the same sin & cos as the single pair function, NumPy's can differ in the last bit
+        rows.append([circle.x, circle.y, circle.radius, rect.x, rect.y, rect.width, rect.height,
+                     math.sin(rect.rotation), math.cos(rect.rotation)])
+    shapes = numpy.array(rows, dtype=float)
+    circle_x = shapes[:, 0]
+    circle_y = shapes[:, 1]
+    radius = shapes[:, 2]
+    rect_center_x = shapes[:, 3]
+    rect_center_y = shapes[:, 4]
+    rect_width = shapes[:, 5]
+    rect_height = shapes[:, 6]
+    sin_rot = shapes[:, 7]
+    cos_rot = shapes[:, 8]
+
+    rect_reference_x = rect_center_x - rect_width / 2
+    rect_reference_y = rect_center_y - rect_height / 2
+
+    # Rotate circle's center point back
+    un_rotated_circle_x = cos_rot * (circle_x - rect_center_x) - sin_rot * (circle_y - rect_center_y) + rect_center_x
+    un_rotated_circle_y = sin_rot * (circle_x - rect_center_x) + cos_rot * (circle_y - rect_center_y) + rect_center_y
+
+    # Closest point in the rectangle to the center of circle rotated backwards(un-rotated)
+    closest_x = numpy.where(un_rotated_circle_x < rect_reference_x, rect_reference_x,
+                            numpy.where(un_rotated_circle_x > rect_reference_x + rect_width,
+                                        rect_reference_x + rect_width, un_rotated_circle_x))
+    closest_y = numpy.where(un_rotated_circle_y < rect_reference_y, rect_reference_y,
+                            numpy.where(un_rotated_circle_y > rect_reference_y + rect_height,
+                                        rect_reference_y + rect_height, un_rotated_circle_y))
+
+    dx = un_rotated_circle_x - closest_x
+    dy = un_rotated_circle_y - closest_y
+    distance = numpy.sqrt((dx * dx) + (dy * dy))
+    collided = distance < radius
+
+    has_distance = distance > 0.0
+    safe_distance = numpy.where(has_distance, distance, 1.0)
+    overlap_normal_x = numpy.where(has_distance, (circle_x - rect_center_x) / safe_distance, 0.0)
+    overlap_normal_y = numpy.where(has_distance, (circle_y - rect_center_y) / safe_distance, -1.0)
+    overlap_dist = numpy.where(has_distance, radius - distance, 1.0)
+    overlap_x = overlap_normal_x * overlap_dist
+    overlap_y = overlap_normal_y * overlap_dist
+
+    for row in range(0, len(pair_indices)):
+        pair_index = pair_indices[row]
+        if collided[row]:
+            results[pair_index] = True
+            circle, rect = circle_rects[row]
+            set_pair_mtv_vectors(circle, rect, overlap_x[row], overlap_y[row])
+        else:
+            results[pair_index] = False
@@ -1,68 +1,226 @@
 import random
 from collision.collision_funcs import *
 from collision.collision_handling import CollisionNoHandler, CollisionRubHandler
+from collision.collision_broadphase import GridBroadphase
+from collision.collision_funcs_batched import collide_shape_pairs, is_batching_available
+from collision.collision_shape_store import ShapeStore, is_shape_store_available
+from collision.collision_queries import RaycastHit, raycast_shape, aabb_overlaps_sector, get_shape_half_extents
+from collision.collision_queries import sweep_box_against_shape
 
 
 # -------------------------------------------------------------------------------------------------------------------
 # This file contains an implementation of a 2D grid for detecting potential collisions in 2D space to speed up
 # collision detection in large game worlds. It is built using the collision shapes, detection functions and
-# handler functions implemented elsewhere in this collision library.
+# handler functions implemented elsewhere in this collision library. Finding which shapes are near to each other is
+# handed off to a broadphase (see collision_broadphase.py), a uniform grid unless told otherwise.
 # -------------------------------------------------------------------------------------------------------------------
 # TODO: optimisation pass to weed out any crufty old code tucked away in here.
 
 
-class GridSquare:
-    def __init__(self):
-        self.index_of_first_shape_in_square = -1
-        self.index_of_first_static_shape_in_square = -1
+class CollisionPair:
+    """
+    A record of two shapes being in contact, kept by the collision grid for as long as they keep touching.
+
+    The shapes are stored in order of their shape ids and the MTV is from shape_a's point of view.
+    """
+    # contact events
+    BEGIN = 0
+    STAY = 1
+    END = 2
+
+    def __init__(self, shape_a, shape_b):
+        self.shape_a = shape_a
+        self.shape_b = shape_b
+        self.mtv_vector = None
+        self.is_touching = False  # were they touching at the end of the last frame
+        self.frame_stamp = -1  # last frame these two collided
+        self.loop_stamp = -1  # last resolve loop these two collided and needed resolving
+
+    def get_mtv_vector(self, shape):
+        if self.mtv_vector is None or shape is self.shape_a:
+            return self.mtv_vector
+        return [-self.mtv_vector[0], -self.mtv_vector[1]]
+
+    def get_other_shape(self, shape):
+        if shape is self.shape_a:
+            return self.shape_b
+        return self.shape_a
+
+
+class ContactEvent:
+    """
+    A contact starting, carrying on or stopping, as handed to the listeners added with
+    CollisionGrid.add_contact_listener().
+
+    Seen from the point of view of the listening shape: the MTV is the last one that pushed it out of the other shape
+    and the normal is the direction of that push, either can be None when the shapes were only just touching.
+    """
+    __slots__ = ["event", "shape", "other_shape", "mtv_vector", "normal"]
+
+    def __init__(self, event, shape, other_shape, mtv_vector):
+        self.event = event
+        self.shape = shape
+        self.other_shape = other_shape
+        self.mtv_vector = mtv_vector
+        self.normal = None
+        if mtv_vector is not None:
+            mtv_length = math.sqrt(mtv_vector[0] ** 2 + mtv_vector[1] ** 2)
+            if mtv_length > 0.0:
+                self.normal = [mtv_vector[0] / mtv_length, mtv_vector[1] / mtv_length]
 
 
 class CollisionGrid:
+    # shape categories are bit flags, this is how many distinct bits the handler table has room for
+    MAX_CATEGORIES = 32
 
-    def __init__(self, grid_size, grid_pixel_size):
+    def __init__(self, grid_pixel_size, multi_cell_insertion=False, broadphase=None, batched_narrowphase=False,
+                 struct_of_arrays=False, accumulated_resolution=False, allow_sleeping=False):
         self.grid_square_pixel_size = grid_pixel_size
-        self.grid_size = grid_size
-        self.grid = []
-        self.all_dynamic_collision_shapes = []  # shapes that move around
+        # shapes that move around. Stored in stable slots so a shape's index never changes while it is in the grid,
+        # removed shapes leave an empty (None) slot behind that is handed out again from the free list.
+        self.all_dynamic_collision_shapes = []
+        self.free_dynamic_shape_slots = []
 
         # special case shapes that fit in a single grid square and stay there
         # no need to move these around grid or test them against
         # other shapes - moving shapes will test against them
         self.static_grid_aligned_collision_shapes = []
+        self.free_static_shape_slots = []
+        # bumped whenever the static shapes change, so anything worked out from them can tell when to work it out
+        # again. Changes the grid can't see, like edits to a static shape's normals, should bump it too.
+        self.static_geometry_version = 0
+        # an optional OccluderIndex of merged outlines of the static shapes that block line of sight, kept by whatever
+        # owns those shapes (e.g. the level) so view cones can test against a few long segments rather than every
+        # shape's edges.
+        self.static_occluders = None
+
+        # dynamic shapes add themselves to these when they move, so idle shapes cost us nothing each frame. One is of
+        # shapes to collision test again, the other of shapes to move around the broadphase. They are dictionaries
+        # with the shapes as keys (and None values), so a shape can be taken out of them as quickly as it was put in.
+        self.moved_shapes = {}
+        self.shapes_to_update_in_grid = {}
 
         self.shapes_collided_this_frame = []
         self.shapes_collided_this_loop = []
 
+        # every pair of shapes currently in contact, keyed by their two shape ids in ascending order. The stamps let
+        # us ask 'have these collided this frame/loop?' of a pair in one lookup.
+        self.collision_pairs = {}
+        self.frame_stamp = 0
+        self.loop_stamp = 0
+        # sensor shapes are only tested in the first collision loop of each frame
+        self.testing_sensors = False
+
+        # Instead of letting each shape handle one collision at a time and re-testing between each, work out one
+        # move per shape from all of its collisions together. See accumulated_resolve_collisions().
+        self.accumulated_resolution = accumulated_resolution
+        # the most times we will re-test moved shapes after resolving collisions, in a single frame
+        self.max_resolve_iterations = 15
+        # how many times we did last frame, and the most we have ever needed, to keep an eye on the worst case cost
+        self.resolve_iterations = 0
+        self.most_resolve_iterations = 0
+
+        # Shapes that stay within sleep_motion_threshold pixels of where they came to rest for frames_until_sleep
+        # frames, along with everything they touch (their island), are put to sleep. Sleeping shapes keep their
+        # contacts but aren't tested or moved around the broadphase until they move again or are woken up.
+        self.allow_sleeping = allow_sleeping
+        self.frames_until_sleep = 30
+        self.sleep_motion_threshold = 0.5
+        # the dynamic shapes that were collision tested this frame
+        self.active_shapes = []
+
+        # begin, stay and end events for each pair in contact, rebuilt at the end of every check_collisions
+        self.contact_events = []
+        # shapes holding contact events for their listeners, see add_contact_listener()
+        self.shapes_with_pending_contact_events = []
+
         self.rub_handler = CollisionRubHandler()
         self.no_handler = CollisionNoHandler()
 
-        # fill empty grid
-        for x_axis in range(0, self.grid_size[0]):
-            column = []
-            for y_axis in range(0, self.grid_size[1]):
-                column.append(GridSquare())
-            self.grid.append(column)
+        # handler to use for each pair of shape categories, filled in from the shapes' handler dictionaries as they
+        # are added. Indexed by [shape category index * table width + colliding shape category index].
+        self.handler_table_width = CollisionGrid.MAX_CATEGORIES + 1
+        self.handlers_by_category_pair = [self.no_handler] * (self.handler_table_width * self.handler_table_width)
+
+        # the broadphase finds the shapes near to each moving shape, by default a sparse uniform grid
+        if broadphase is None:
+            broadphase = GridBroadphase(grid_pixel_size, multi_cell_insertion)
+        self.broadphase = broadphase
+        self.broadphase.attach(self.all_dynamic_collision_shapes, self.static_grid_aligned_collision_shapes)
+
+        # gather up all the candidate pairs in a collision loop and test them together with NumPy, if we have it
+        self.batched_narrowphase = batched_narrowphase and is_batching_available()
+
+        # optionally keep a struct of arrays copy of the shapes' positions, AABBs and grid squares so that moving
+        # shapes between grid squares, and culling candidate pairs when batching, can be done with NumPy
+        self.shape_store = None
+        if struct_of_arrays and is_shape_store_available():
+            self.shape_store = ShapeStore()
+
+        # stands in for the area being searched by query_circle(), it is never added to the grid
+        self.query_circle_shape = CollisionCircle(0, 0, 1)
+
+    def set_broadphase(self, broadphase):
+        """
+        Swap to a different broadphase, moving every shape already in the collision grid across to it.
+
+        :param broadphase: a freshly created broadphase with no shapes in it yet
+        """
+        self.broadphase = broadphase
+        self.broadphase.attach(self.all_dynamic_collision_shapes, self.static_grid_aligned_collision_shapes)
+        for static_shape_index in range(0, len(self.static_grid_aligned_collision_shapes)):
+            if self.static_grid_aligned_collision_shapes[static_shape_index] is not None:
+                self.broadphase.add_static_shape(self.static_grid_aligned_collision_shapes[static_shape_index],
+                                                 static_shape_index)
+        for shape in self.all_dynamic_collision_shapes:
+            if shape is not None:
+                self.broadphase.add_dynamic_shape(shape)
+        if self.shape_store is not None:
+            for shape in self.shape_store.shapes:
+                if shape is not None:
+                    self.shape_store.write_shape(shape)
 
     def check_collisions(self):
         for shape in self.shapes_collided_this_frame:
             shape.clear_frame_collided_shapes()
         self.shapes_collided_this_frame[:] = []
+        self.frame_stamp += 1
 
         for shape in self.shapes_collided_this_loop:
             shape.clear_loop_collided_shapes()
         self.shapes_collided_this_loop[:] = []
+        self.loop_stamp += 1
+
+        if self.allow_sleeping:
+            self.keep_sleeping_contacts()
 
         collided_shapes_for_handler = []
-        for shape in self.all_dynamic_collision_shapes:
-            if shape.moved_since_last_collision_test:
-                self.shape_collision_test(shape, collided_shapes_for_handler)
+        self.testing_sensors = True
+        self.moved_shapes_collision_test(collided_shapes_for_handler)
+        self.testing_sensors = False
 
         # handle detected collisions
-
-        # This is the amount of times per frame we will attempt to resolve collisions/handle shapes to clear collisions
-        max_handling_per_frame = 15
+        if self.accumulated_resolution:
+            self.resolve_iterations = self.accumulated_resolve_collisions(collided_shapes_for_handler)
+        else:
+            self.resolve_iterations = self.iterative_resolve_collisions(collided_shapes_for_handler)
+        self.most_resolve_iterations = max(self.most_resolve_iterations, self.resolve_iterations)
+
+        if self.allow_sleeping:
+            self.update_sleeping_islands()
+        self.update_contact_events()
+
+    def iterative_resolve_collisions(self, collided_shapes_for_handler):
+        """
+        Let each collided shape's handler deal with one of its collisions, then re-test everything that moved and go
+        round again until there are no collisions left to handle, or we run out of goes.
+
+        :return: the number of times we re-tested the moved shapes.
+        """
+        # This is the amount of times this frame we have attempted to resolve collisions/handle shapes to clear
+        # collisions, up to max_resolve_iterations
         handling_this_frame = 0
-        while len(collided_shapes_for_handler) > 0 and handling_this_frame < max_handling_per_frame:
+        while len(collided_shapes_for_handler) > 0 and handling_this_frame < self.max_resolve_iterations:
             # sort collided shapes so the ones with the least amount of collisions are first. The idea being that this
             # will make it easier to resolve messy multi-object collisions by moving the shapes on the outside edge of
             # pile-ups first, thereby giving room for the ones in the centre. This principle should be the same on any
@@ -71,7 +229,7 @@ class CollisionGrid:
             # collision occurs in cases where both shapes in a collision could move.
 
             random.shuffle(collided_shapes_for_handler)
-            sorted(collided_shapes_for_handler, key=lambda x: len(x.collided_shapes_this_loop))
+            collided_shapes_for_handler.sort(key=lambda x: len(x.collided_shapes_this_loop))
 
             # Back to trying to resolve all collisions every frame as long as neither shape in a collision has moved
             # ready since the last test. Should make unhandled collisions resolve quickly and still deal with complex
@@ -87,221 +245,719 @@ class CollisionGrid:
                         else:
                             # only allow each shape to move once in a resolve loop
                             # in case move solves multiple collisions
-                            shape.get_handler(colliding_shape.game_type).handle(shape, colliding_shape)
-
-            # this just makes sure we don't double compare collided shapes in the inner collision test
-            for shape in self.shapes_collided_this_loop:
-                shape.clear_loop_collided_shapes()
-            self.shapes_collided_this_loop[:] = []
-
-            collided_shapes_for_handler[:] = []
-            for shape in self.all_dynamic_collision_shapes:
-                if shape.moved_since_last_collision_test:
-                    self.shape_collision_test(shape, collided_shapes_for_handler)
+                            self.get_pair_handler(shape, colliding_shape).handle(shape, colliding_shape)
 
+            self.retest_moved_shapes(collided_shapes_for_handler)
             handling_this_frame += 1
+        return handling_this_frame
+
+    def accumulated_resolve_collisions(self, collided_shapes_for_handler):
+        """
+        Work out a single move for each collided shape from all of its collisions at once and make them all
+        together, then re-test only the shapes that moved. Usually a shape is clear of everything after one go,
+        where handling its collisions one at a time can take a re-test of every moved shape per collision.
+
+        :return: the number of times we re-tested the moved shapes.
+        """
+        iterations = 0
+        while len(collided_shapes_for_handler) > 0 and iterations < self.max_resolve_iterations:
+            # a shape appears once per collision needing handling, we only want it once
+            shapes_to_resolve = {}
+            for shape in collided_shapes_for_handler:
+                shapes_to_resolve[shape] = None
+
+            # work out every correction before making any, so they are all based on the same collision test
+            corrections = []
+            for shape in shapes_to_resolve:
+                correction = self.get_accumulated_correction(shape, shapes_to_resolve)
+                if correction is not None:
+                    corrections.append((shape, correction))
+            for shape, correction in corrections:
+                shape.set_position([shape.x + correction[0], shape.y + correction[1]])
+
+            self.retest_moved_shapes(collided_shapes_for_handler)
+            iterations += 1
+        return iterations
+
+    def get_accumulated_correction(self, shape, shapes_to_resolve):
+        """
+        Combine the corrections from all of a shape's collisions this loop into one. Pushes in the same direction
+        overlap rather than add up - two floor tiles under a shape both push it up by the same amount, and it only
+        needs to go up once - so on each axis we just take the largest push. When pushes on an axis disagree, say a
+        shape sunk into the seam between two tiles, going with the largest lets it slip off one of them.
+
+        :param shape: a shape with collisions to handle
+        :param shapes_to_resolve: every shape being moved this loop
+        :return: an [x, y] vector, or None if none of the shape's handlers move it
+        """
+        accumulated_correction = None
+        for colliding_shape in shape.collided_shapes_this_loop:
+            correction = self.get_pair_handler(shape, colliding_shape).get_correction(shape, colliding_shape)
+            if correction is None:
+                continue
+            share = 1.0
+            if (colliding_shape in shapes_to_resolve and
+                    self.get_pair_handler(colliding_shape, shape).get_correction(colliding_shape, shape) is not None):
+                share = 0.5  # the other shape is being pushed out of us too, so we each go half way
+            if accumulated_correction is None:
+                accumulated_correction = [0.0, 0.0]
+            for axis in (0, 1):
+                if abs(correction[axis] * share) > abs(accumulated_correction[axis]):
+                    accumulated_correction[axis] = correction[axis] * share
+        return accumulated_correction
+
+    def retest_moved_shapes(self, collided_shapes_for_handler):
+        # start a fresh loop, so pairs that collided in the last one are tested again
+        for shape in self.shapes_collided_this_loop:
+            shape.clear_loop_collided_shapes()
+        self.shapes_collided_this_loop[:] = []
+        self.loop_stamp += 1
+
+        collided_shapes_for_handler[:] = []
+        self.moved_shapes_collision_test(collided_shapes_for_handler)
+
+    def moved_shapes_collision_test(self, collided_shapes_for_handler):
+        if self.batched_narrowphase:
+            self.batched_moved_shapes_collision_test(collided_shapes_for_handler)
+            return
+        for shape in self.take_moved_shapes():
+            self.shape_collision_test(shape, collided_shapes_for_handler)
+
+    def take_moved_shapes(self):
+        """
+        Empty the list of shapes that have moved since they were last collision tested.
+
+        :return: the moved shapes, in slot order.
+        """
+        # sorted into slot order, so the order we test shapes in, and so the order collisions get resolved in,
+        # doesn't depend on the order they moved in. Only the shapes moved since the last loop are sorted.
+        moved_shapes = sorted(self.moved_shapes, key=lambda shape: shape.grid_slot_index)
+        self.moved_shapes.clear()
+        if self.allow_sleeping:
+            awake_shapes = self.drop_sleeping_shapes(moved_shapes)
+            if len(awake_shapes) != len(moved_shapes):
+                for shape in moved_shapes:
+                    if shape.is_sleeping:
+                        shape.moved_since_last_collision_test = False
+            self.active_shapes.extend(awake_shapes)
+            return awake_shapes
+        return moved_shapes
+
+    def batched_moved_shapes_collision_test(self, collided_shapes_for_handler):
+        # First gather every candidate pair, in the order the one-at-a-time tests would see them, along with the list
+        # of distinct pairs to actually run through the collision functions.
+        candidates = []
+        pairs_to_test = []
+        pair_test_indices = {}
+        for shape, shape_to_test in self.get_culled_candidate_pairs():
+            if shape.is_sensor or shape_to_test.is_sensor:
+                candidates.append((shape, shape_to_test, None))
+                continue
+            pair_key = self.get_pair_key(shape, shape_to_test)
+            pair_test_index = pair_test_indices.get(pair_key)
+            if pair_test_index is None:
+                pair_test_index = len(pairs_to_test)
+                pair_test_indices[pair_key] = pair_test_index
+                pairs_to_test.append((shape, shape_to_test))
+            candidates.append((shape, shape_to_test, pair_test_index))
+
+        results = collide_shape_pairs(pairs_to_test)
+
+        # Then record the results in order. A pair met for the second time in reverse gets the result of the first
+        # test, or the 'already collided' treatment, just as if it had been tested again.
+        for shape, shape_to_test, pair_test_index in candidates:
+            if pair_test_index is None:
+                self.sensor_collision_test(shape, shape_to_test)
+            elif self.check_already_collided_this_loop(shape, shape_to_test):
+                if shape.get_mtv_vector(shape_to_test) is not None:
+                    self.get_pair_handler(shape, shape_to_test).record_shape_for_handling(
+                        collided_shapes_for_handler, shape, shape_to_test)
+            else:
+                collided = results[pair_test_index]
+                if collided is None:
+                    collided = self.narrowphase_collision_test(shape, shape_to_test)
+                    results[pair_test_index] = collided
+                if collided:
+                    needs_resolving = shape.get_mtv_vector(shape_to_test) is not None
+                    self.record_colliding_shapes(shape, shape_to_test, needs_resolving)
+                    if needs_resolving:
+                        self.get_pair_handler(shape, shape_to_test).record_shape_for_handling(
+                            collided_shapes_for_handler, shape, shape_to_test)
+
+    def get_culled_candidate_pairs(self):
+        """
+        Every pair of a moved shape and a nearby shape that passes the quick category and AABB tests, in the order
+        the one-at-a-time collision tests would meet them. Clears the moved flags of the moved shapes.
+        """
+        moved_shapes = self.take_moved_shapes()
+        if self.shape_store is None:
+            culled_pairs = []
+            for shape in moved_shapes:
+                shape.moved_since_last_collision_test = False
+                for shape_to_test in self.broadphase.get_nearby_shapes(shape):
+                    if (shape_to_test is not shape and shape.collision_mask & shape_to_test.category and
+                            shape.aabb_rect.colliderect(shape_to_test.aabb_rect)):
+                        culled_pairs.append((shape, shape_to_test))
+            return culled_pairs
+
+        # with a shape store we gather up all the candidates first and then cull them together
+        self.shape_store.refresh_shape_positions(moved_shapes)
+        candidate_shapes = []
+        candidate_shapes_to_test = []
+        for shape in moved_shapes:
+            shape.moved_since_last_collision_test = False
+            nearby_shapes = self.broadphase.get_nearby_shapes(shape)
+            candidate_shapes.extend([shape] * len(nearby_shapes))
+            candidate_shapes_to_test.extend(nearby_shapes)
+        rows_a = [shape.store_index for shape in candidate_shapes]
+        rows_b = [shape_to_test.store_index for shape_to_test in candidate_shapes_to_test]
+        passed_indices = self.shape_store.cull_candidate_pairs(rows_a, rows_b).nonzero()[0].tolist()
+        return [(candidate_shapes[index], candidate_shapes_to_test[index]) for index in passed_indices]
 
     def shape_collision_test(self, shape, collided_shapes_for_handler):
         shape.moved_since_last_collision_test = False
-        for grid_x in range(shape.nearby_grid_range_x[0], shape.nearby_grid_range_x[1] + 1):
-            for grid_y in range(shape.nearby_grid_range_y[0], shape.nearby_grid_range_y[1] + 1):
-
-                # dynamic shapes collision
-                shape_index_in_square = self.grid[grid_x][grid_y].index_of_first_shape_in_square
-                while shape_index_in_square != -1:
-                    shape_to_test = self.all_dynamic_collision_shapes[shape_index_in_square]
-                    self.inner_collision_test(shape, shape_to_test, collided_shapes_for_handler)
-                    shape_index_in_square = shape_to_test.next_shape_in_grid_square_index
-
-                # static shapes collision
-                static_shape_index_in_square = self.grid[grid_x][grid_y].index_of_first_static_shape_in_square
-                while static_shape_index_in_square != -1:
-                    shape_to_test = self.static_grid_aligned_collision_shapes[static_shape_index_in_square]
-                    self.inner_collision_test(shape, shape_to_test, collided_shapes_for_handler)
-                    static_shape_index_in_square = shape_to_test.next_shape_in_grid_square_index
+        for shape_to_test in self.broadphase.get_nearby_shapes(shape):
+            self.inner_collision_test(shape, shape_to_test, collided_shapes_for_handler)
 
     def inner_collision_test(self, shape, shape_to_test, collided_shapes_for_handler):
         # Do some quick tests to see if we should collide these two shapes
-        should_collide_from_game_type = self.check_should_collide_from_game_type(shape, shape_to_test)
-        if should_collide_from_game_type:
+        if shape.collision_mask & shape_to_test.category:
             if shape.aabb_rect.colliderect(shape_to_test.aabb_rect):  # aabb test
+                if shape.is_sensor or shape_to_test.is_sensor:
+                    self.sensor_collision_test(shape, shape_to_test)
+                    return
                 already_collided = self.check_already_collided_this_loop(shape, shape_to_test)
                 if already_collided:
                     if shape.get_mtv_vector(shape_to_test) is not None:
-                        shape.get_handler(shape_to_test.game_type).record_shape_for_handling(
+                        self.get_pair_handler(shape, shape_to_test).record_shape_for_handling(
                             collided_shapes_for_handler, shape, shape_to_test)
                 else:
                     # Check they are not the same shape
                     if shape_to_test != shape:
-                        collided = False
-                        if shape_to_test.type == BaseCollisionShape.CIRCLE and shape.type == BaseCollisionShape.RECT:
-                            if collide_circle_with_rotated_rectangle(shape_to_test, shape):
-                                collided = True
-                        elif shape_to_test.type == BaseCollisionShape.RECT and shape.type == BaseCollisionShape.CIRCLE:
-                            if collide_circle_with_rotated_rectangle(shape, shape_to_test):
-                                collided = True
-                        elif shape_to_test.type == BaseCollisionShape.RECT and shape.type == BaseCollisionShape.RECT:
-                            if collide_polygon_with_polygon(shape, shape_to_test):
-                                collided = True
-                        elif shape_to_test.type == BaseCollisionShape.CIRCLE and \
-                                shape.type == BaseCollisionShape.CIRCLE:
-                            if collide_circle_with_circle(shape, shape_to_test):
-                                collided = True
-                        elif shape_to_test.type == BaseCollisionShape.COMPOSITE:
-                            if self.composite_single_shape_collision_test(shape, shape_to_test):
-                                collided = True
-                        elif shape.type == BaseCollisionShape.COMPOSITE:
-                            if self.composite_single_shape_collision_test(shape_to_test, shape):
-                                collided = True
-
+                        collided = self.narrowphase_collision_test(shape, shape_to_test)
                         if collided:
                             needs_resolving = shape.get_mtv_vector(shape_to_test) is not None
                             self.record_colliding_shapes(shape, shape_to_test, needs_resolving)
                             if needs_resolving:
-                                shape.get_handler(shape_to_test.game_type).record_shape_for_handling(
+                                self.get_pair_handler(shape, shape_to_test).record_shape_for_handling(
                                     collided_shapes_for_handler, shape, shape_to_test)
 
+    def sensor_collision_test(self, shape, shape_to_test):
+        # Sensors just need to know what they overlap, once a frame. So there are no MTVs, nothing to handle, and
+        # a pair already found overlapping this frame doesn't need testing again.
+        if not self.testing_sensors or shape_to_test is shape:
+            return
+        pair = self.collision_pairs.get(self.get_pair_key(shape, shape_to_test))
+        if pair is not None and pair.frame_stamp == self.frame_stamp:
+            return
+        if overlap_shapes(shape, shape_to_test):
+            self.record_colliding_shapes(shape, shape_to_test, needs_resolving=False)
+
+    def narrowphase_collision_test(self, shape, shape_to_test):
+        collided = False
+        if shape_to_test.type == BaseCollisionShape.CIRCLE and shape.type == BaseCollisionShape.RECT:
+            if collide_circle_with_rotated_rectangle(shape_to_test, shape):
+                collided = True
+        elif shape_to_test.type == BaseCollisionShape.RECT and shape.type == BaseCollisionShape.CIRCLE:
+            if collide_circle_with_rotated_rectangle(shape, shape_to_test):
+                collided = True
+        elif shape_to_test.type == BaseCollisionShape.RECT and shape.type == BaseCollisionShape.RECT:
+            if collide_polygon_with_polygon(shape, shape_to_test):
+                collided = True
+        elif shape_to_test.type == BaseCollisionShape.CIRCLE and \
+                shape.type == BaseCollisionShape.CIRCLE:
+            if collide_circle_with_circle(shape, shape_to_test):
+                collided = True
+        elif shape_to_test.type == BaseCollisionShape.COMPOSITE:
+            if self.composite_single_shape_collision_test(shape, shape_to_test):
+                collided = True
+        elif shape.type == BaseCollisionShape.COMPOSITE:
+            if self.composite_single_shape_collision_test(shape_to_test, shape):
+                collided = True
+        return collided
+
     @staticmethod
     def composite_single_shape_collision_test(shape, composite_shape):
-        collided = False
-        for sub_shape in composite_shape.collision_shapes:
+        # the composite's AABB tree rules out the sub-shapes nowhere near the shape, and we stop at the first one
+        # that collides
+        for sub_shape in composite_shape.get_sub_shapes_in_aabb(shape.aabb_rect):
             if sub_shape.type == BaseCollisionShape.CIRCLE and shape.type == BaseCollisionShape.RECT:
                 if collide_circle_with_rotated_rectangle(sub_shape, shape):
-                    collided = True
+                    return True
             elif sub_shape.type == BaseCollisionShape.RECT and shape.type == BaseCollisionShape.CIRCLE:
                 if collide_circle_with_rotated_rectangle(shape, sub_shape):
-                    collided = True
+                    return True
             elif sub_shape.type == BaseCollisionShape.RECT and shape.type == BaseCollisionShape.RECT:
                 if collide_polygon_with_polygon(shape, sub_shape):
-                    collided = True
+                    return True
             elif sub_shape.type == BaseCollisionShape.CIRCLE and shape.type == BaseCollisionShape.CIRCLE:
                 if collide_circle_with_circle(shape, sub_shape):
-                    collided = True
-        return collided
-
-    @staticmethod
-    def check_already_collided_this_loop(shape_a, shape_b):
-        for collision in shape_a.collided_shapes_this_loop:
-            if collision == shape_b:
-                return True
+                    return True
         return False
 
     @staticmethod
-    def check_should_collide_from_game_type(shape_a, shape_b):
-        for game_type in shape_a.game_types_to_collide:
-            if game_type == shape_b.game_type:
-                return True
-        return False
+    def get_pair_key(shape_a, shape_b):
+        if shape_a.shape_id < shape_b.shape_id:
+            return shape_a.shape_id, shape_b.shape_id
+        return shape_b.shape_id, shape_a.shape_id
+
+    def get_pair(self, shape_a, shape_b):
+        """
+        The contact record for two shapes, if they collided this frame or are still touching from the last one.
+
+        :param shape_a: a shape in the collision grid
+        :param shape_b: another shape in the collision grid
+        :return: a CollisionPair or None
+        """
+        return self.collision_pairs.get(self.get_pair_key(shape_a, shape_b))
+
+    def check_already_collided_this_loop(self, shape_a, shape_b):
+        pair = self.collision_pairs.get(self.get_pair_key(shape_a, shape_b))
+        return pair is not None and pair.loop_stamp == self.loop_stamp
+
+    def get_pair_handler(self, shape, colliding_shape):
+        return self.handlers_by_category_pair[shape.category_index * self.handler_table_width +
+                                              colliding_shape.category_index]
+
+    def register_shape_handlers(self, shape):
+        for game_type, handler in shape.handlers_by_colliding_game_type.items():
+            if game_type is not None:
+                self.handlers_by_category_pair[shape.category_index * self.handler_table_width +
+                                               game_type.bit_length()] = handler
 
     def record_colliding_shapes(self, shape_a, shape_b, needs_resolving=True):
-        shape_a.add_frame_collided_shape(shape_b)
-        shape_b.add_frame_collided_shape(shape_a)
-        self.shapes_collided_this_frame.append(shape_a)
-        self.shapes_collided_this_frame.append(shape_b)
-
-        if needs_resolving:
-            shape_a.add_loop_collided_shape(shape_b)
-            shape_b.add_loop_collided_shape(shape_a)
+        pair_key = self.get_pair_key(shape_a, shape_b)
+        pair = self.collision_pairs.get(pair_key)
+        if pair is None:
+            if shape_a.shape_id < shape_b.shape_id:
+                pair = CollisionPair(shape_a, shape_b)
+            else:
+                pair = CollisionPair(shape_b, shape_a)
+            self.collision_pairs[pair_key] = pair
+
+        # the pair stamps stand in for searching the shapes' collided lists to avoid adding the same shape twice
+        if pair.frame_stamp != self.frame_stamp:
+            pair.frame_stamp = self.frame_stamp
+            shape_a.collided_shapes_this_frame.append(shape_b)
+            shape_b.collided_shapes_this_frame.append(shape_a)
+            self.shapes_collided_this_frame.append(shape_a)
+            self.shapes_collided_this_frame.append(shape_b)
+        pair.mtv_vector = pair.shape_a.get_frame_mtv_vector(pair.shape_b)
+
+        if needs_resolving and pair.loop_stamp != self.loop_stamp:
+            pair.loop_stamp = self.loop_stamp
+            shape_a.collided_shapes_this_loop.append(shape_b)
+            shape_b.collided_shapes_this_loop.append(shape_a)
             self.shapes_collided_this_loop.append(shape_a)
             self.shapes_collided_this_loop.append(shape_b)
 
-    def update_shape_grid_positions(self):
-        index = 0
-
-        for shape in self.all_dynamic_collision_shapes:
-            new_grid_pos = [max(0, min(self.grid_size[0] - 1,
-                                       int(shape.x / self.grid_square_pixel_size))),
-                            max(0, min(self.grid_size[1] - 1,
-                                       int(shape.y / self.grid_square_pixel_size)))]
-            if shape.current_grid_pos[0] == new_grid_pos[0] and shape.current_grid_pos[1] == new_grid_pos[1]:
-                pass
+    def update_contact_events(self):
+        for shape in self.shapes_with_pending_contact_events:
+            shape.pending_contact_events[:] = []
+        self.shapes_with_pending_contact_events[:] = []
+        self.contact_events[:] = []
+
+        ended_pair_keys = []
+        for pair_key, pair in self.collision_pairs.items():
+            if pair.frame_stamp == self.frame_stamp:
+                if pair.is_touching:
+                    contact_event = CollisionPair.STAY
+                else:
+                    contact_event = CollisionPair.BEGIN
+                    pair.is_touching = True
             else:
-                self.remove_shape_from_old_grid_pos_by_index(index, shape.current_grid_pos)
-                self.add_shape_to_new_grid_pos_by_index(index, new_grid_pos)
-                shape.set_new_grid_pos(new_grid_pos, self.grid_size)
+                contact_event = CollisionPair.END
+                pair.is_touching = False
+                ended_pair_keys.append(pair_key)
+
+            self.contact_events.append((contact_event, pair))
+            if pair.shape_a.contact_listeners is not None:
+                self.queue_contact_event(contact_event, pair.shape_a, pair.shape_b, pair)
+            if pair.shape_b.contact_listeners is not None:
+                self.queue_contact_event(contact_event, pair.shape_b, pair.shape_a, pair)
+
+        for pair_key in ended_pair_keys:
+            del self.collision_pairs[pair_key]
+
+    def queue_contact_event(self, contact_event, shape, other_shape, pair):
+        listeners = shape.contact_listeners[other_shape.category_index]
+        if listeners is None:
+            return
+        for listened_events, callback in listeners:
+            if contact_event in listened_events:
+                if len(shape.pending_contact_events) == 0:
+                    self.shapes_with_pending_contact_events.append(shape)
+                shape.pending_contact_events.append(
+                    (callback, ContactEvent(contact_event, shape, other_shape, pair.get_mtv_vector(shape))))
+
+    def add_contact_listener(self, shape, game_types, callback,
+                             contact_events=(CollisionPair.BEGIN, CollisionPair.STAY)):
+        """
+        Have a function called about a shape's contacts with some game types, rather than looking through the
+        shape's collided shapes for them each frame. Contacts with any other game type never reach the callback.
+
+        The events are gathered up during check_collisions() and the callbacks are run when the shape's owner calls
+        dispatch_contact_events(), so it can react to them at the right point in its own update.
+
+        :param shape: the shape to listen to, it doesn't need to be in the grid yet.
+        :param game_types: the game types of the shapes to listen for contacts with, OR'd together.
+        :param callback: called with a ContactEvent for each contact.
+        :param contact_events: which of CollisionPair.BEGIN, STAY and END to listen for.
+        """
+        if shape.contact_listeners is None:
+            shape.contact_listeners = [None] * self.handler_table_width
+        # a table indexed by category, the same as the handler table, so a contact is a single lookup
+        for category_index in range(1, self.handler_table_width):
+            if game_types & (1 << (category_index - 1)):
+                if shape.contact_listeners[category_index] is None:
+                    shape.contact_listeners[category_index] = []
+                shape.contact_listeners[category_index].append((contact_events, callback))
+
+    def dispatch_contact_events(self, shape):
+        """
+        Run the shape's contact listeners for the contacts found in the last check_collisions().
+
+        :param shape: a shape with contact listeners.
+        """
+        pending_contact_events = shape.pending_contact_events
+        shape.pending_contact_events = []
+        for callback, contact_event in pending_contact_events:
+            callback(contact_event)
 
-            index += 1
+    def update_shape_grid_positions(self):
+        shapes_to_update = list(self.shapes_to_update_in_grid)
+        self.shapes_to_update_in_grid.clear()
+        for shape in shapes_to_update:
+            shape.needs_grid_update = False
+        if self.allow_sleeping:
+            shapes_to_update = self.drop_sleeping_shapes(shapes_to_update)
+        if self.shape_store is not None:
+            rows = self.shape_store.refresh_shape_positions(shapes_to_update)
+            self.broadphase.update_shape_positions_from_store(self.shape_store, rows)
+        else:
+            self.broadphase.update_shape_positions(shapes_to_update)
+
+    # -----------------------------------------------------------------------------------------------------------
+    # Sleeping. Shapes are grouped into islands of dynamic shapes touching each other, static shapes don't join
+    # islands together. An island goes to sleep when all of the shapes in it have been at rest long enough, and the
+    # whole island wakes up again as soon as any shape in it moves or touches an awake shape.
+    # -----------------------------------------------------------------------------------------------------------
+    def drop_sleeping_shapes(self, shapes):
+        # Sleeping shapes that are only nudged, like actors standing still or pushing against a wall, stay asleep
+        # and are left out. They stay exactly where they fell asleep, so nudges can't add up and let them creep into
+        # other shapes. Moving one any further wakes it up, along with its island.
+        awake_shapes = []
+        for shape in shapes:
+            if shape.is_sleeping:
+                if (abs(shape.x - shape.rest_x) <= self.sleep_motion_threshold and
+                        abs(shape.y - shape.rest_y) <= self.sleep_motion_threshold):
+                    if shape.x != shape.rest_x or shape.y != shape.rest_y:
+                        shape.set_position([shape.rest_x, shape.rest_y])
+                    continue
+                self.wake_shape(shape)
+            awake_shapes.append(shape)
+        return awake_shapes
+
+    def wake_shape(self, shape):
+        """
+        Wake up a sleeping shape, and every other shape in its island, so they are collision tested again.
+
+        :param shape: a dynamic shape in the collision grid
+        """
+        shapes_to_wake = [shape]
+        while len(shapes_to_wake) > 0:
+            shape_to_wake = shapes_to_wake.pop()
+            if not shape_to_wake.is_sleeping:
+                continue
+            shape_to_wake.is_sleeping = False
+            shape_to_wake.frames_at_rest = 0
+            shape_to_wake.mark_moved()
+            shapes_to_wake.extend(shape_to_wake.collided_shapes_this_frame)
+
+    def wake_shapes_touching(self, shape):
+        for touching_shape in shape.collided_shapes_this_frame:
+            self.wake_shape(touching_shape)
+
+    def keep_sleeping_contacts(self):
+        # Contacts between sleeping shapes, or sleeping and static shapes, aren't tested again. So carry them over
+        # into this frame as they were, and the shapes involved carry on seeing each other.
+        for pair in self.collision_pairs.values():
+            if not pair.is_touching:
+                continue
+            shape_a = pair.shape_a
+            shape_b = pair.shape_b
+            if not (shape_a.is_sleeping or shape_b.is_sleeping):
+                continue
+            if not (shape_a.is_sleeping or shape_a.is_static) or not (shape_b.is_sleeping or shape_b.is_static):
+                continue
+            pair.frame_stamp = self.frame_stamp
+            shape_a.collided_shapes_this_frame.append(shape_b)
+            shape_b.collided_shapes_this_frame.append(shape_a)
+            if pair.mtv_vector is not None:
+                shape_a.frame_mtv_vectors_by_shape[shape_b] = pair.mtv_vector
+                shape_b.frame_mtv_vectors_by_shape[shape_a] = [-pair.mtv_vector[0], -pair.mtv_vector[1]]
+            self.shapes_collided_this_frame.append(shape_a)
+            self.shapes_collided_this_frame.append(shape_b)
+
+    def update_sleeping_islands(self):
+        active_shapes = {}
+        for shape in self.active_shapes:
+            active_shapes[shape] = None
+        self.active_shapes[:] = []
+
+        for shape in active_shapes:
+            if (abs(shape.x - shape.rest_x) > self.sleep_motion_threshold or
+                    abs(shape.y - shape.rest_y) > self.sleep_motion_threshold):
+                shape.frames_at_rest = 0
+                shape.rest_x = shape.x
+                shape.rest_y = shape.y
+            else:
+                shape.frames_at_rest += 1
+
+        # gather the island of each active shape by following its contacts, and see if the whole island can sleep
+        shapes_in_islands = {}
+        for shape in active_shapes:
+            if shape in shapes_in_islands or shape.grid_slot_index == -1:
+                continue
+            shapes_in_islands[shape] = None
+            island = []
+            shapes_to_visit = [shape]
+            while len(shapes_to_visit) > 0:
+                island_shape = shapes_to_visit.pop()
+                island.append(island_shape)
+                for touching_shape in island_shape.collided_shapes_this_frame:
+                    if not touching_shape.is_static and touching_shape not in shapes_in_islands:
+                        shapes_in_islands[touching_shape] = None
+                        shapes_to_visit.append(touching_shape)
+
+            # shapes that weren't tested this frame haven't moved, so they are as good as at rest
+            can_sleep = all(island_shape.is_sleeping or island_shape.frames_at_rest >= self.frames_until_sleep or
+                            island_shape not in active_shapes for island_shape in island)
+            for island_shape in island:
+                if can_sleep:
+                    if not island_shape.is_sleeping:
+                        island_shape.is_sleeping = True
+                        island_shape.rest_x = island_shape.x
+                        island_shape.rest_y = island_shape.y
+                elif island_shape.is_sleeping:
+                    self.wake_shape(island_shape)
+
+    # -----------------------------------------------------------------------------------------------------------
+    # Spatial queries. These let the game ask what is in an area, or along a line, whenever it likes without
+    # having to keep a shape in the grid to find out. Each takes an optional category mask, the game types to look
+    # for OR'd together; shapes of any type are found if it is None.
+    # -----------------------------------------------------------------------------------------------------------
+    def update_broadphase_for_query(self):
+        # shapes that have moved since update_shape_grid_positions() was last called are caught up first, so a query
+        # made part way through a frame finds every shape where it is now
+        if len(self.shapes_to_update_in_grid) > 0:
+            self.update_shape_grid_positions()
 
-    # shape must fit entirely inside single grid square
+    @staticmethod
+    def is_in_categories(shape, category_mask):
+        return category_mask is None or shape.category & category_mask
+
+    def query_aabb(self, aabb_rect, category_mask=None):
+        """
+        Every shape whose AABB overlaps a rectangle.
+
+        :param aabb_rect: a pygame.Rect in world space
+        :param category_mask: game types to look for, OR'd together
+        :return: a list of shapes
+        """
+        self.update_broadphase_for_query()
+        return [shape for shape in self.broadphase.get_shapes_in_aabb(aabb_rect)
+                if self.is_in_categories(shape, category_mask) and shape.aabb_rect.colliderect(aabb_rect)]
+
+    def query_point(self, point, category_mask=None):
+        """
+        Every shape containing a point.
+
+        :param point: an [x, y] position in world space
+        :param category_mask: game types to look for, OR'd together
+        :return: a list of shapes
+        """
+        self.update_broadphase_for_query()
+        point_rect = pygame.Rect(int(math.floor(point[0])), int(math.floor(point[1])), 1, 1)
+        return [shape for shape in self.broadphase.get_shapes_in_aabb(point_rect)
+                if self.is_in_categories(shape, category_mask) and shape.is_inside(point)]
+
+    def query_circle(self, centre, radius, category_mask=None):
+        """
+        Every shape overlapping a circle.
+
+        :param centre: the [x, y] centre of the circle in world space
+        :param radius: the radius of the circle
+        :param category_mask: game types to look for, OR'd together
+        :return: a list of shapes
+        """
+        self.update_broadphase_for_query()
+        circle = self.query_circle_shape
+        circle.set_radius(radius)
+        circle.set_position(centre)
+        return [shape for shape in self.broadphase.get_shapes_in_aabb(circle.aabb_rect)
+                if self.is_in_categories(shape, category_mask) and shape.aabb_rect.colliderect(circle.aabb_rect) and
+                overlap_shapes(circle, shape)]
+
+    def query_sector(self, centre, facing, field_of_view, radius, category_mask=None):
+        """
+        Every shape overlapping a circle whose AABB also reaches into a sector of it, e.g. what is in a view cone.
+
+        :param centre: the [x, y] point of the sector in world space
+        :param facing: a unit vector pointing down the middle of the sector
+        :param field_of_view: the angle of the sector in radians
+        :param radius: the radius of the sector
+        :param category_mask: game types to look for, OR'd together
+        :return: a list of shapes
+        """
+        return [shape for shape in self.query_circle(centre, radius, category_mask)
+                if aabb_overlaps_sector(shape.aabb_rect, centre, facing, field_of_view, radius)]
+
+    def raycast(self, start, end, category_mask=None):
+        """
+        Find the first shape a line segment touches going from start to end. The broadphase hands us the shapes
+        along the line nearest first, so we can stop looking as soon as nothing further along could be closer.
+
+        :param start: the [x, y] start of the line in world space
+        :param end: the [x, y] end of the line in world space
+        :param category_mask: game types to look for, OR'd together
+        :return: a RaycastHit, or None if the line doesn't touch anything
+        """
+        self.update_broadphase_for_query()
+        direction = [end[0] - start[0], end[1] - start[1]]
+        closest_hit = None
+        for shapes, searched_fraction in self.broadphase.get_shapes_along_line(start, end):
+            for shape in shapes:
+                if not self.is_in_categories(shape, category_mask):
+                    continue
+                result = raycast_shape(shape, start, direction)
+                if result is not None and (closest_hit is None or result[0] < closest_hit.fraction):
+                    fraction, normal = result
+                    closest_hit = RaycastHit(shape, fraction, [start[0] + direction[0] * fraction,
+                                                               start[1] + direction[1] * fraction], normal)
+            if closest_hit is not None and closest_hit.fraction <= searched_fraction:
+                break
+        return closest_hit
+
+    def sweep_shape(self, shape, end_position, category_mask=None):
+        """
+        Slide the box around a shape in a straight line from where it is now to end_position, and find the first
+        shape it would touch on the way. Shapes it already overlaps are left to the usual collision tests.
+
+        :param shape: the moving shape, it isn't moved
+        :param end_position: the [x, y] position the shape is moving to
+        :param category_mask: game types that can stop the shape, OR'd together. Defaults to the shape's
+                              collision mask.
+        :return: a RaycastHit, where the fraction is the time of impact and the point is the position of the moving
+                 shape at that time, or None if it can make the whole move
+        """
+        if category_mask is None:
+            category_mask = shape.collision_mask
+        self.update_broadphase_for_query()
+        start = [shape.x, shape.y]
+        direction = [end_position[0] - shape.x, end_position[1] - shape.y]
+        half_extents = get_shape_half_extents(shape)
+        swept_rect = shape.aabb_rect.union(shape.aabb_rect.move(int(direction[0]), int(direction[1])))
+        closest_hit = None
+        for shape_to_test in self.broadphase.get_shapes_in_aabb(swept_rect.inflate(2, 2)):
+            if shape_to_test is shape or shape_to_test.is_sensor or not shape_to_test.category & category_mask:
+                continue
+            result = sweep_box_against_shape(start, direction, half_extents, shape_to_test)
+            if result is None or result[1] is None:
+                continue
+            if closest_hit is None or result[0] < closest_hit.fraction:
+                fraction, normal = result
+                closest_hit = RaycastHit(shape_to_test, fraction, [start[0] + direction[0] * fraction,
+                                                                   start[1] + direction[1] * fraction], normal)
+        return closest_hit
+
+    def move_shape(self, shape, position):
+        """
+        Move a shape to a new position. If the shape is fast it is swept there and, should it hit something on the
+        way, stopped just inside it so the collision is picked up by the next check_collisions().
+
+        :param shape: a shape in the collision grid
+        :param position: the [x, y] position to move it to
+        :return: a RaycastHit for what the shape hit, see sweep_shape(), or None if it made the whole move
+        """
+        hit = None
+        if shape.is_fast:
+            hit = self.sweep_shape(shape, position)
+        if hit is None:
+            shape.set_position(position)
+            return None
+
+        # go a little past the time of impact, no further than it is safe to push the shape into another
+        move_length = math.sqrt((position[0] - shape.x) ** 2 + (position[1] - shape.y) ** 2)
+        fraction = min(1.0, hit.fraction + (shape.shortest_centre_to_edge / move_length))
+        shape.set_position([shape.x + (position[0] - shape.x) * fraction, shape.y + (position[1] - shape.y) * fraction])
+        return hit
+
+    # shape must fit entirely inside single grid square, unless broadphase.supports_large_static_shapes is True
     def add_static_grid_aligned_shape_to_grid(self, shape):
-        new_static_shape_index = len(self.static_grid_aligned_collision_shapes)
-        self.static_grid_aligned_collision_shapes.append(shape)
-        new_grid_pos = [max(0, min(self.grid_size[0] - 1,
-                                   int(shape.x / self.grid_square_pixel_size))),
-                        max(0, min(self.grid_size[1] - 1,
-                                   int(shape.y / self.grid_square_pixel_size)))]
-        shape.set_new_grid_pos(new_grid_pos, self.grid_size)
-        self.add_static_shape_to_new_grid_pos_by_index(new_static_shape_index, new_grid_pos)
-        shape.moved_since_last_collision_test = False  # static shapes never move so we default this to false
-
-    def add_static_shape_to_new_grid_pos_by_index(self, shape_index, grid_pos):
-        # check if grid square empty of shapes, if so add our shape
-        self.static_grid_aligned_collision_shapes[shape_index].next_shape_in_grid_square_index = -1
-        if self.grid[grid_pos[0]][grid_pos[1]].index_of_first_static_shape_in_square == -1:
-            self.grid[grid_pos[0]][grid_pos[1]].index_of_first_static_shape_in_square = shape_index
+        if len(self.free_static_shape_slots) > 0:
+            new_static_shape_index = self.free_static_shape_slots.pop()
+            self.static_grid_aligned_collision_shapes[new_static_shape_index] = shape
         else:
-            current_index = self.grid[grid_pos[0]][grid_pos[1]].index_of_first_static_shape_in_square
-            next_index = self.static_grid_aligned_collision_shapes[current_index].next_shape_in_grid_square_index
-            # zip to the end of our list
-            while current_index != -1 and next_index != -1:
-                current_index = self.static_grid_aligned_collision_shapes[current_index].next_shape_in_grid_square_index
-                next_index = self.static_grid_aligned_collision_shapes[next_index].next_shape_in_grid_square_index
-
-            self.static_grid_aligned_collision_shapes[current_index].next_shape_in_grid_square_index = shape_index
+            new_static_shape_index = len(self.static_grid_aligned_collision_shapes)
+            self.static_grid_aligned_collision_shapes.append(shape)
+        shape.grid_slot_index = new_static_shape_index
+        shape.moved_since_last_collision_test = False  # static shapes never move so we default this to false
+        shape.is_static = True
+        self.static_geometry_version += 1
+        self.register_shape_handlers(shape)
+        self.broadphase.add_static_shape(shape, new_static_shape_index)
+        if self.shape_store is not None:
+            self.shape_store.add_shape(shape)
+
+    def remove_static_shape_from_grid(self, shape):
+        removal_index = shape.grid_slot_index
+        if removal_index == -1:
+            return  # not in the grid
+        self.broadphase.remove_static_shape(shape)
+        self.static_geometry_version += 1
+        if self.allow_sleeping:
+            self.wake_shapes_touching(shape)
+        if self.shape_store is not None:
+            self.shape_store.remove_shape(shape)
+        self.static_grid_aligned_collision_shapes[removal_index] = None
+        self.free_static_shape_slots.append(removal_index)
+        shape.grid_slot_index = -1
 
     def add_new_shape_to_grid(self, shape):
-        new_shape_index = len(self.all_dynamic_collision_shapes)
-        self.all_dynamic_collision_shapes.append(shape)
-        new_grid_pos = [max(0, min(self.grid_size[0] - 1,
-                                   int(shape.x / self.grid_square_pixel_size))),
-                        max(0, min(self.grid_size[1] - 1,
-                                   int(shape.y / self.grid_square_pixel_size)))]
-        shape.set_grid_search_radius(self.grid_square_pixel_size)
-        shape.set_new_grid_pos(new_grid_pos, self.grid_size)
-        self.add_shape_to_new_grid_pos_by_index(new_shape_index, new_grid_pos)
-
-    def remove_shape_from_grid(self, shape):
-        removal_index = self.all_dynamic_collision_shapes.index(shape)
-        self.remove_shape_from_old_grid_pos_by_index(removal_index, shape.current_grid_pos)
-        self.all_dynamic_collision_shapes.remove(shape)
-
-        for shape in self.all_dynamic_collision_shapes:
-            if shape.next_shape_in_grid_square_index > removal_index:
-                shape.next_shape_in_grid_square_index -= 1
-
-        for col in self.grid:
-            for square in col:
-                if square.index_of_first_shape_in_square > removal_index:
-                    square.index_of_first_shape_in_square -= 1
-
-    def add_shape_to_new_grid_pos_by_index(self, shape_index, grid_pos):
-        # check if grid square empty of shapes, if so add our shape
-        self.all_dynamic_collision_shapes[shape_index].next_shape_in_grid_square_index = -1
-        if self.grid[grid_pos[0]][grid_pos[1]].index_of_first_shape_in_square == -1:
-            self.grid[grid_pos[0]][grid_pos[1]].index_of_first_shape_in_square = shape_index
-        else:
-            current_index = self.grid[grid_pos[0]][grid_pos[1]].index_of_first_shape_in_square
-            next_index = self.all_dynamic_collision_shapes[current_index].next_shape_in_grid_square_index
-            # zip to the end of our list
-            while current_index != -1 and next_index != -1:
-                current_index = self.all_dynamic_collision_shapes[current_index].next_shape_in_grid_square_index
-                next_index = self.all_dynamic_collision_shapes[next_index].next_shape_in_grid_square_index
-
-            self.all_dynamic_collision_shapes[current_index].next_shape_in_grid_square_index = shape_index
-
-    def remove_shape_from_old_grid_pos_by_index(self, shape_index, grid_pos):
-        start_index = self.grid[grid_pos[0]][grid_pos[1]].index_of_first_shape_in_square
-        if start_index == shape_index:
-            self.grid[grid_pos[0]][grid_pos[1]].index_of_first_shape_in_square = \
-                self.all_dynamic_collision_shapes[start_index].next_shape_in_grid_square_index
+        if len(self.free_dynamic_shape_slots) > 0:
+            new_shape_index = self.free_dynamic_shape_slots.pop()
+            self.all_dynamic_collision_shapes[new_shape_index] = shape
         else:
-            # need to find shape in list
-            current_index = self.grid[grid_pos[0]][grid_pos[1]].index_of_first_shape_in_square
-            while current_index != -1:
-                next_index = self.all_dynamic_collision_shapes[current_index].next_shape_in_grid_square_index
+            new_shape_index = len(self.all_dynamic_collision_shapes)
+            self.all_dynamic_collision_shapes.append(shape)
+        shape.grid_slot_index = new_shape_index
+        self.register_shape_handlers(shape)
+        self.broadphase.add_dynamic_shape(shape)
+        if self.shape_store is not None:
+            self.shape_store.add_shape(shape)
+
+        shape.grid_moved_shapes = self.moved_shapes
+        shape.grid_shapes_to_update = self.shapes_to_update_in_grid
+        shape.needs_grid_update = False  # the broadphase has just put it in the right place
+        if shape.moved_since_last_collision_test:
+            self.moved_shapes[shape] = None
 
-                if (next_index != -1) and next_index == shape_index:
-                    self.all_dynamic_collision_shapes[current_index].next_shape_in_grid_square_index = \
-                        self.all_dynamic_collision_shapes[next_index].next_shape_in_grid_square_index
-
-                current_index = next_index
+    def remove_shape_from_grid(self, shape):
+        removal_index = shape.grid_slot_index
+        if removal_index == -1:
+            return  # not in the grid
+        self.broadphase.remove_dynamic_shape(shape)
+        if self.allow_sleeping:
+            # anything it was touching needs to notice it has gone
+            self.wake_shape(shape)
+            self.wake_shapes_touching(shape)
+        if self.shape_store is not None:
+            self.shape_store.remove_shape(shape)
+        self.moved_shapes.pop(shape, None)
+        self.shapes_to_update_in_grid.pop(shape, None)
+        shape.grid_moved_shapes = None
+        shape.grid_shapes_to_update = None
+        self.all_dynamic_collision_shapes[removal_index] = None
+        self.free_dynamic_shape_slots.append(removal_index)
+        shape.grid_slot_index = -1
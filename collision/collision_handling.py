@@ -17,6 +17,15 @@ class BaseCollisionHandler:
     def record_shape_for_handling(self, shape_list, shape, shape_to_test):
         pass
 
+    def get_correction(self, shape_to_handle, collision_shape):
+        """
+        The move this handler would make to shape_to_handle, for collision grids that add up the moves from all of a
+        shape's collisions before making any of them.
+
+        :return: an [x, y] vector, or None if the handler doesn't move shapes.
+        """
+        return None
+
 
 class CollisionRubHandler(BaseCollisionHandler):
     def __init__(self):
@@ -34,6 +43,9 @@ class CollisionRubHandler(BaseCollisionHandler):
         may_need_further_handling = True
         return may_need_further_handling
 
+    def get_correction(self, shape_to_handle, collision_shape):
+        return shape_to_handle.get_mtv_vector(collision_shape)
+
 
 class CollisionNoHandler(BaseCollisionHandler):
     def __init__(self):
@@ -0,0 +1,125 @@
+import math
+
+
+# -------------------------------------------------------------------------------------------------------------------
+# A spatial index of static line segments that block line of sight, e.g. the outlines of a level's walls. Segments
+# are Edges (see collision_shapes.py) so anything that already tests lines of sight against the edges of shapes, like
+# view cones, can use them as they are.
+# -------------------------------------------------------------------------------------------------------------------
+
+
+class OccluderIndex:
+    """
+    Buckets segments into a sparse grid of squares, so finding the segments near a point only looks at the few
+    squares around it. A segment is put in every square its bounding box touches.
+
+    Segments are expected to wind clockwise around the solid areas they outline, so the segment that follows one
+    around an outline is the one that starts where it ends. Those are kept track of too, as view cones need to know
+    which way the outline turns at each corner.
+
+    :param bucket_pixel_size: the width and height of the squares, a tile or collision grid square is a good size.
+    """
+    def __init__(self, bucket_pixel_size):
+        self.bucket_pixel_size = bucket_pixel_size
+        self.segments_by_bucket = {}
+        self.buckets_by_segment = {}
+        self.segments_by_start_point = {}
+        self.segments_by_end_point = {}
+
+    @staticmethod
+    def get_point_key(point):
+        return round(point.x, 3), round(point.y, 3)
+
+    def get_bucket_range(self, segment):
+        return [int(math.floor(min(segment.a.x, segment.b.x) / self.bucket_pixel_size)),
+                int(math.floor(max(segment.a.x, segment.b.x) / self.bucket_pixel_size)),
+                int(math.floor(min(segment.a.y, segment.b.y) / self.bucket_pixel_size)),
+                int(math.floor(max(segment.a.y, segment.b.y) / self.bucket_pixel_size))]
+
+    def add_segment(self, segment):
+        buckets = []
+        min_x, max_x, min_y, max_y = self.get_bucket_range(segment)
+        for bucket_x in range(min_x, max_x + 1):
+            for bucket_y in range(min_y, max_y + 1):
+                bucket = (bucket_x, bucket_y)
+                if bucket not in self.segments_by_bucket:
+                    self.segments_by_bucket[bucket] = []
+                self.segments_by_bucket[bucket].append(segment)
+                buckets.append(bucket)
+        self.buckets_by_segment[segment] = buckets
+
+        for segments_by_point, point in ((self.segments_by_start_point, segment.a),
+                                         (self.segments_by_end_point, segment.b)):
+            point_key = self.get_point_key(point)
+            if point_key not in segments_by_point:
+                segments_by_point[point_key] = []
+            segments_by_point[point_key].append(segment)
+
+    def remove_segment(self, segment):
+        if segment not in self.buckets_by_segment:
+            return
+        for bucket in self.buckets_by_segment.pop(segment):
+            bucket_segments = self.segments_by_bucket[bucket]
+            bucket_segments.remove(segment)
+            if len(bucket_segments) == 0:
+                del self.segments_by_bucket[bucket]
+
+        for segments_by_point, point in ((self.segments_by_start_point, segment.a),
+                                         (self.segments_by_end_point, segment.b)):
+            point_key = self.get_point_key(point)
+            point_segments = segments_by_point[point_key]
+            point_segments.remove(segment)
+            if len(point_segments) == 0:
+                del segments_by_point[point_key]
+
+    def clear(self):
+        self.segments_by_bucket = {}
+        self.buckets_by_segment = {}
+        self.segments_by_start_point = {}
+        self.segments_by_end_point = {}
+
+    def get_previous_segment(self, segment):
+        """
+        The segment before this one going clockwise around its outline, or None if the outline is open here.
+        """
+        point_segments = self.segments_by_end_point.get(self.get_point_key(segment.a))
+        if point_segments is None:
+            return None
+        return point_segments[0]
+
+    def get_next_segment(self, segment):
+        """
+        The segment after this one going clockwise around its outline, or None if the outline is open here.
+        """
+        point_segments = self.segments_by_start_point.get(self.get_point_key(segment.b))
+        if point_segments is None:
+            return None
+        return point_segments[0]
+
+    def get_segments_in_aabb(self, aabb_rect):
+        """
+        Every segment in a square touched by a rectangle. Some may be just outside of the rectangle itself.
+
+        :param aabb_rect: a pygame.Rect in world space.
+        :return: a list of segments, each one only once.
+        """
+        min_x = int(math.floor(aabb_rect.left / self.bucket_pixel_size))
+        max_x = int(math.floor(aabb_rect.right / self.bucket_pixel_size))
+        min_y = int(math.floor(aabb_rect.top / self.bucket_pixel_size))
+        max_y = int(math.floor(aabb_rect.bottom / self.bucket_pixel_size))
+        # a dictionary, rather than a set, so the segments come out in the same order every time
+        found_segments = {}
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > len(self.segments_by_bucket):
+            # bigger than the index, so it's quicker to go through the buckets we have
+            for bucket, bucket_segments in self.segments_by_bucket.items():
+                if min_x <= bucket[0] <= max_x and min_y <= bucket[1] <= max_y:
+                    for segment in bucket_segments:
+                        found_segments[segment] = None
+        else:
+            for bucket_x in range(min_x, max_x + 1):
+                for bucket_y in range(min_y, max_y + 1):
+                    bucket_segments = self.segments_by_bucket.get((bucket_x, bucket_y))
+                    if bucket_segments is not None:
+                        for segment in bucket_segments:
+                            found_segments[segment] = None
+        return list(found_segments)
@@ -0,0 +1,197 @@
+import math
+
+from collision.collision_shapes import BaseCollisionShape
+
+
+# -------------------------------------------------------------------------------------------------------------------
+# Geometry for the collision grid's spatial queries. Where the collision functions answer 'are these two shapes
+# touching?' for shapes that live in the grid, these answer questions about lines and areas that don't: where does a
+# ray first touch a shape, how far can a box slide before it touches another, and does a shape's AABB reach into a
+# sector (a slice of a circle).
+# -------------------------------------------------------------------------------------------------------------------
+
+
+class RaycastHit:
+    """
+    Where a ray first touched a shape.
+
+    The fraction is how far along the ray the hit is, from 0.0 at the start to 1.0 at the end. The normal is the
+    surface normal of the shape at the hit point, or None when the ray started inside the shape.
+    """
+    __slots__ = ["shape", "fraction", "point", "normal"]
+
+    def __init__(self, shape, fraction, point, normal):
+        self.shape = shape
+        self.fraction = fraction
+        self.point = point
+        self.normal = normal
+
+
+def raycast_shape(shape, start, direction):
+    """
+    Find the first point along the line start + (direction * fraction), for fractions between 0.0 and 1.0, that
+    touches a shape.
+
+    :param shape: a collision shape of any type.
+    :param start: the start of the ray.
+    :param direction: the vector from the start of the ray to its end.
+    :return: (fraction, normal) or None if the ray misses.
+    """
+    if shape.type == BaseCollisionShape.CIRCLE:
+        return raycast_circle(shape, start, direction)
+    if shape.type == BaseCollisionShape.RECT:
+        return raycast_rotated_rectangle(shape, start, direction)
+    if shape.type == BaseCollisionShape.COMPOSITE:
+        closest_result = None
+        for sub_shape in shape.collision_shapes:
+            result = raycast_shape(sub_shape, start, direction)
+            if result is not None and (closest_result is None or result[0] < closest_result[0]):
+                closest_result = result
+        return closest_result
+    return None
+
+
+def raycast_circle(circle, start, direction):
+    offset_x = start[0] - circle.x
+    offset_y = start[1] - circle.y
+    # solving |offset + direction * t| = radius for t
+    a = direction[0] ** 2 + direction[1] ** 2
+    b = 2.0 * (offset_x * direction[0] + offset_y * direction[1])
+    c = offset_x ** 2 + offset_y ** 2 - circle.radius ** 2
+    if c <= 0.0:
+        return 0.0, None  # started inside
+    if a == 0.0:
+        return None
+    discriminant = b ** 2 - 4.0 * a * c
+    if discriminant < 0.0:
+        return None
+    fraction = (-b - math.sqrt(discriminant)) / (2.0 * a)
+    if fraction < 0.0 or fraction > 1.0:
+        return None
+    normal = [(offset_x + direction[0] * fraction) / circle.radius,
+              (offset_y + direction[1] * fraction) / circle.radius]
+    return fraction, normal
+
+
+def raycast_rotated_rectangle(rect, start, direction):
+    # turn the ray into the rectangle's own frame, where it is a box centred on the origin, so we can use the
+    # slab test and then turn the normal back out again
+    cos_rotation = math.cos(-rect.rotation)
+    sin_rotation = math.sin(-rect.rotation)
+    offset_x = start[0] - rect.x
+    offset_y = start[1] - rect.y
+    local_start = [(offset_x * cos_rotation) + (offset_y * sin_rotation),
+                   (offset_y * cos_rotation) - (offset_x * sin_rotation)]
+    local_direction = [(direction[0] * cos_rotation) + (direction[1] * sin_rotation),
+                       (direction[1] * cos_rotation) - (direction[0] * sin_rotation)]
+    result = raycast_box(local_start, local_direction, rect.width / 2, rect.height / 2)
+    if result is None or result[1] is None:
+        return result
+    fraction, local_normal = result
+    return fraction, [(local_normal[0] * cos_rotation) - (local_normal[1] * sin_rotation),
+                      (local_normal[0] * sin_rotation) + (local_normal[1] * cos_rotation)]
+
+
+def raycast_box(start, direction, half_width, half_height):
+    """
+    Slab test of a ray against a box centred on the origin. The ray is clipped against the pair of lines bounding
+    the box on each axis in turn, and hits if there is anything left of it at the end.
+
+    :return: (fraction, normal) or None if the ray misses.
+    """
+    entry_fraction = -math.inf
+    exit_fraction = math.inf
+    entry_normal = None
+    for axis, half_size in ((0, half_width), (1, half_height)):
+        if direction[axis] == 0.0:
+            # parallel to this pair of lines, so either always between them or never
+            if start[axis] < -half_size or start[axis] > half_size:
+                return None
+            continue
+        near_fraction = (-half_size - start[axis]) / direction[axis]
+        far_fraction = (half_size - start[axis]) / direction[axis]
+        normal_sign = -1.0
+        if near_fraction > far_fraction:
+            near_fraction, far_fraction = far_fraction, near_fraction
+            normal_sign = 1.0
+        if near_fraction > entry_fraction:
+            entry_fraction = near_fraction
+            entry_normal = [normal_sign, 0.0] if axis == 0 else [0.0, normal_sign]
+        exit_fraction = min(exit_fraction, far_fraction)
+
+    if entry_fraction > exit_fraction or exit_fraction < 0.0 or entry_fraction > 1.0:
+        return None
+    if entry_fraction <= 0.0:
+        return 0.0, None  # started inside
+    return entry_fraction, entry_normal
+
+
+def get_shape_half_extents(shape):
+    """
+    Half the width and height of the smallest axis aligned box around a shape as it is now. This can be a lot
+    smaller than the shape's aabb_rect, which is made big enough to hold a rect at any rotation.
+
+    :return: [half width, half height]
+    """
+    if shape.type == BaseCollisionShape.CIRCLE:
+        return [shape.radius, shape.radius]
+    if shape.type == BaseCollisionShape.RECT:
+        cos_rotation = abs(math.cos(shape.rotation))
+        sin_rotation = abs(math.sin(shape.rotation))
+        return [(shape.width / 2 * cos_rotation) + (shape.height / 2 * sin_rotation),
+                (shape.width / 2 * sin_rotation) + (shape.height / 2 * cos_rotation)]
+    return [shape.aabb_rect.width / 2, shape.aabb_rect.height / 2]
+
+
+def sweep_box_against_shape(start, direction, half_extents, shape):
+    """
+    Swept AABB test. Sliding a box along a line until it touches the box around a shape is the same as casting a
+    ray from the centre of the sliding box at the shape's box grown by the sliding box's half size on every side.
+
+    :param start: the centre of the sliding box at the start of its move.
+    :param direction: the vector the box moves along.
+    :param half_extents: half the width and height of the sliding box.
+    :param shape: the shape to test against, using the box from get_shape_half_extents().
+    :return: (time of impact as a fraction of the move, normal) or None if they don't touch. The normal is None if
+             the boxes overlap before the move.
+    """
+    shape_half_extents = get_shape_half_extents(shape)
+    return raycast_box([start[0] - shape.x, start[1] - shape.y], direction,
+                       shape_half_extents[0] + half_extents[0], shape_half_extents[1] + half_extents[1])
+
+
+def aabb_overlaps_sector(aabb_rect, centre, facing, field_of_view, radius):
+    """
+    Does an AABB reach into a sector. Only the angle of the sector is checked here, the queries that use this have
+    already made sure the shape is within the sector's radius.
+
+    :param aabb_rect: the pygame.Rect to test.
+    :param centre: the point of the sector.
+    :param facing: a unit vector pointing down the middle of the sector.
+    :param field_of_view: the angle of the sector in radians.
+    :param radius: the length of the sector's straight edges.
+    :return: True if they overlap.
+    """
+    if aabb_rect.collidepoint(centre[0], centre[1]):
+        return True
+
+    # any corner inside the sector's angle
+    half_fov_cos = math.cos(field_of_view / 2)
+    for corner in (aabb_rect.topleft, aabb_rect.topright, aabb_rect.bottomleft, aabb_rect.bottomright):
+        to_corner_x = corner[0] - centre[0]
+        to_corner_y = corner[1] - centre[1]
+        corner_distance = math.sqrt(to_corner_x ** 2 + to_corner_y ** 2)
+        if (facing[0] * to_corner_x) + (facing[1] * to_corner_y) >= corner_distance * half_fov_cos:
+            return True
+
+    # or, when the sector is narrower than the AABB, one of the sector's straight edges crossing it
+    half_width = aabb_rect.width / 2
+    half_height = aabb_rect.height / 2
+    local_centre = [centre[0] - (aabb_rect.x + half_width), centre[1] - (aabb_rect.y + half_height)]
+    half_fov_sin = math.sin(field_of_view / 2)
+    for edge_sin in (half_fov_sin, -half_fov_sin):
+        edge_direction = [((facing[0] * half_fov_cos) - (facing[1] * edge_sin)) * radius,
+                          ((facing[0] * edge_sin) + (facing[1] * half_fov_cos)) * radius]
+        if raycast_box(local_centre, edge_direction, half_width, half_height) is not None:
+            return True
+    return False
@@ -0,0 +1,182 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# -------------------------------------------------------------------------------------------------------------------
+# A struct of arrays copy of the state the collision grid's broadphase and culling stages read from each shape:
+# positions, AABBs, grid squares and category bits, each held in its own contiguous NumPy array with one row per
+# shape. With everything lined up like this the per frame jobs of working out which grid squares every shape is in,
+# and which candidate pairs have overlapping AABBs, can be done for all shapes at once instead of one at a time.
+#
+# The shape objects stay the owners of their own state, as the narrowphase and the game read it constantly. The
+# store is brought up to date from them in bulk when the collision grid needs it.
+#
+# Needs NumPy, use is_shape_store_available() to check before relying on it.
+# -------------------------------------------------------------------------------------------------------------------
+
+
+def is_shape_store_available():
+    return numpy is not None
+
+
+class ShapeStore:
+    # the arrays making up the store, and the type of each
+    COLUMNS = {"x": "float64", "y": "float64",
+               "aabb_left": "int64", "aabb_top": "int64", "aabb_right": "int64", "aabb_bottom": "int64",
+               "category": "int64", "collision_mask": "int64",
+               "grid_x": "int64", "grid_y": "int64",
+               "grid_range_min_x": "int64", "grid_range_max_x": "int64",
+               "grid_range_min_y": "int64", "grid_range_max_y": "int64"}
+
+    def __init__(self, initial_capacity=256):
+        self.capacity = initial_capacity
+        self.columns = {}
+        for name, column_type in ShapeStore.COLUMNS.items():
+            self.columns[name] = numpy.zeros(self.capacity, dtype=column_type)
+        # the shape in each row, rows of removed shapes are set to None and handed out again from the free list
+        self.shapes = []
+        self.free_rows = []
+
+    def grow(self):
+        self.capacity *= 2
+        for name, column in self.columns.items():
+            new_column = numpy.zeros(self.capacity, dtype=column.dtype)
+            new_column[:len(column)] = column
+            self.columns[name] = new_column
+
+    def add_shape(self, shape):
+        if len(self.free_rows) > 0:
+            row = self.free_rows.pop()
+            self.shapes[row] = shape
+        else:
+            row = len(self.shapes)
+            if row == self.capacity:
+                self.grow()
+            self.shapes.append(shape)
+        shape.store_index = row
+        self.write_shape(shape)
+
+    def remove_shape(self, shape):
+        if shape.store_index == -1:
+            return
+        self.shapes[shape.store_index] = None
+        self.free_rows.append(shape.store_index)
+        shape.store_index = -1
+
+    def write_shape(self, shape):
+        """
+        Copy everything we keep about a shape into its row, including the grid squares the broadphase has put it in.
+        """
+        row = shape.store_index
+        columns = self.columns
+        columns["x"][row] = shape.x
+        columns["y"][row] = shape.y
+        columns["aabb_left"][row] = shape.aabb_rect.left
+        columns["aabb_top"][row] = shape.aabb_rect.top
+        columns["aabb_right"][row] = shape.aabb_rect.right
+        columns["aabb_bottom"][row] = shape.aabb_rect.bottom
+        columns["category"][row] = shape.category
+        columns["collision_mask"][row] = shape.collision_mask
+        columns["grid_x"][row] = shape.current_grid_pos[0]
+        columns["grid_y"][row] = shape.current_grid_pos[1]
+        columns["grid_range_min_x"][row] = shape.nearby_grid_range_x[0]
+        columns["grid_range_max_x"][row] = shape.nearby_grid_range_x[1]
+        columns["grid_range_min_y"][row] = shape.nearby_grid_range_y[0]
+        columns["grid_range_max_y"][row] = shape.nearby_grid_range_y[1]
+
+    def refresh_shape_positions(self, shapes):
+        """
+        Copy the current positions and AABBs of a list of shapes into their rows in one go.
+
+        :param shapes: a list of shapes in the store, may contain None entries which are skipped.
+        :return: an array of the rows of the shapes that were refreshed, in order.
+        """
+        live_shapes = [shape for shape in shapes if shape is not None]
+        rows = numpy.fromiter([shape.store_index for shape in live_shapes], dtype=numpy.intp, count=len(live_shapes))
+        if len(live_shapes) == 0:
+            return rows
+        columns = self.columns
+        columns["x"][rows] = [shape.x for shape in live_shapes]
+        columns["y"][rows] = [shape.y for shape in live_shapes]
+        aabb_rects = [shape.aabb_rect for shape in live_shapes]
+        columns["aabb_left"][rows] = [aabb_rect.left for aabb_rect in aabb_rects]
+        columns["aabb_top"][rows] = [aabb_rect.top for aabb_rect in aabb_rects]
+        columns["aabb_right"][rows] = [aabb_rect.right for aabb_rect in aabb_rects]
+        columns["aabb_bottom"][rows] = [aabb_rect.bottom for aabb_rect in aabb_rects]
+        return rows
+
+    def find_shapes_changing_grid_square(self, rows, grid_square_pixel_size):
+        """
+        Work out the grid square containing the centre of each shape in rows and pick out the ones that have
+        changed square. Their new squares are recorded in the store straight away, the caller is expected to move
+        the shapes to them.
+
+        :return: a list of (shape, [new grid x, new grid y]) for each shape that has changed square.
+        """
+        columns = self.columns
+        new_grid_x = numpy.floor_divide(columns["x"][rows], grid_square_pixel_size).astype(numpy.int64)
+        new_grid_y = numpy.floor_divide(columns["y"][rows], grid_square_pixel_size).astype(numpy.int64)
+        has_changed = (new_grid_x != columns["grid_x"][rows]) | (new_grid_y != columns["grid_y"][rows])
+
+        changed_indices = numpy.flatnonzero(has_changed)
+        changed_rows = rows[changed_indices]
+        columns["grid_x"][changed_rows] = new_grid_x[changed_indices]
+        columns["grid_y"][changed_rows] = new_grid_y[changed_indices]
+        return [(self.shapes[row], [grid_x, grid_y]) for row, grid_x, grid_y in
+                zip(changed_rows.tolist(), new_grid_x[changed_indices].tolist(),
+                    new_grid_y[changed_indices].tolist())]
+
+    def find_shapes_changing_grid_range(self, rows, grid_square_pixel_size):
+        """
+        Work out the range of grid squares overlapped by the AABB of each shape in rows and pick out the ones
+        whose range has changed. Their new ranges are recorded in the store straight away, the caller is expected
+        to move the shapes to them.
+
+        :return: a list of (shape, grid range x, grid range y) for each shape that has changed range.
+        """
+        columns = self.columns
+        new_ranges = [numpy.floor_divide(columns["aabb_left"][rows], grid_square_pixel_size),
+                      numpy.floor_divide(columns["aabb_right"][rows] - 1, grid_square_pixel_size),
+                      numpy.floor_divide(columns["aabb_top"][rows], grid_square_pixel_size),
+                      numpy.floor_divide(columns["aabb_bottom"][rows] - 1, grid_square_pixel_size)]
+        range_columns = [columns["grid_range_min_x"], columns["grid_range_max_x"],
+                         columns["grid_range_min_y"], columns["grid_range_max_y"]]
+        has_changed = numpy.zeros(len(rows), dtype=bool)
+        for new_range, range_column in zip(new_ranges, range_columns):
+            has_changed |= new_range != range_column[rows]
+
+        changed_indices = numpy.flatnonzero(has_changed)
+        changed_rows = rows[changed_indices]
+        changed_ranges = []
+        for new_range, range_column in zip(new_ranges, range_columns):
+            range_column[changed_rows] = new_range[changed_indices]
+            changed_ranges.append(new_range[changed_indices].tolist())
+        return [(self.shapes[row], [min_x, max_x], [min_y, max_y]) for row, min_x, max_x, min_y, max_y in
+                zip(changed_rows.tolist(), *changed_ranges)]
+
+    def cull_candidate_pairs(self, rows_a, rows_b):
+        """
+        The quick tests we do before running a candidate pair through the collision functions, for many pairs at
+        once: the shapes are different, a's collision mask includes b's category and their AABBs overlap (in the
+        same way as pygame.Rect.colliderect, where touching edges and empty rects don't count).
+
+        :param rows_a: the store rows of the first shape in each pair.
+        :param rows_b: the store rows of the second shape in each pair.
+        :return: a boolean array, True for the pairs that pass.
+        """
+        rows_a = numpy.asarray(rows_a, dtype=numpy.intp)
+        rows_b = numpy.asarray(rows_b, dtype=numpy.intp)
+        columns = self.columns
+        left_a = columns["aabb_left"][rows_a]
+        top_a = columns["aabb_top"][rows_a]
+        right_a = columns["aabb_right"][rows_a]
+        bottom_a = columns["aabb_bottom"][rows_a]
+        left_b = columns["aabb_left"][rows_b]
+        top_b = columns["aabb_top"][rows_b]
+        right_b = columns["aabb_right"][rows_b]
+        bottom_b = columns["aabb_bottom"][rows_b]
+        return ((rows_a != rows_b) &
+                ((columns["collision_mask"][rows_a] & columns["category"][rows_b]) != 0) &
+                (left_a < right_a) & (top_a < bottom_a) & (left_b < right_b) & (top_b < bottom_b) &
+                (left_a < right_b) & (left_b < right_a) & (top_a < bottom_b) & (top_b < bottom_a))
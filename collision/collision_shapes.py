@@ -13,6 +13,8 @@ from collision.collision_handling import CollisionNoHandler
 
 
 class Normal:
+    __slots__ = ["name", "value", "should_skip"]
+
     def __init__(self, name, value, should_skip=False):
         self.name = name
         self.value = value
@@ -20,6 +22,8 @@ class Normal:
 
 
 class Edge:
+    __slots__ = ["name", "a", "b", "vec", "length", "length_squared"]
+
     def __init__(self, name, a_end, b_end):
         self.name = name
         self.a = a_end
@@ -28,6 +32,22 @@ class Edge:
         self.length = self.vec.length()
         self.length_squared = self.vec.length_squared()
 
+    def set_ends(self, a_end, b_end):
+        """
+        Move this edge's end points in place, rather than allocating a new edge.
+
+        :param a_end: The new position of the a end, as an [x, y] pair.
+        :param b_end: The new position of the b end, as an [x, y] pair.
+        """
+        self.a.x = a_end[0]
+        self.a.y = a_end[1]
+        self.b.x = b_end[0]
+        self.b.y = b_end[1]
+        self.vec.x = self.b.x - self.a.x
+        self.vec.y = self.b.y - self.a.y
+        self.length = self.vec.length()
+        self.length_squared = self.vec.length_squared()
+
 
 class BaseCollisionShape:
     CIRCLE = 0
@@ -35,13 +55,37 @@ class BaseCollisionShape:
     AABB_RECT = 2
     COMPOSITE = 3
 
+    next_shape_id = 0
+
+    # lots of these get moved around every frame, so keep them small and quick to access
+    __slots__ = ["shape_id", "grid_slot_index", "store_index", "next_shape_in_grid_square_index",
+                 "prev_shape_in_grid_square_index", "collision_test_stamp", "text_id", "x", "y", "type",
+                 "current_grid_pos", "nearby_grid_range_x", "nearby_grid_range_y", "collided_shapes_this_frame",
+                 "collided_shapes_this_loop", "loop_mtv_vectors_by_shape", "frame_mtv_vectors_by_shape",
+                 "contact_listeners", "pending_contact_events", "owner", "game_types_to_collide", "game_type",
+                 "category", "category_index", "collision_mask", "handlers_by_colliding_game_type",
+                 "num_squares_to_search_around_grid_pos", "aabb_rect", "longest_aab_square_dimension",
+                 "shortest_centre_to_edge", "moved_since_last_collision_test", "needs_grid_update", "grid_moved_shapes",
+                 "grid_shapes_to_update", "is_sensor", "is_fast", "is_static", "is_sleeping", "frames_at_rest",
+                 "rest_x", "rest_y", "print_collision_stages"]
+
     def __init__(self, x, y, shape_type, aabb_rect, handlers_by_colliding_game_type=None,
                  game_type=None, game_types_to_collide=None):
         if game_types_to_collide is None:
             game_types_to_collide = []
         if handlers_by_colliding_game_type is None:
             handlers_by_colliding_game_type = {None: CollisionNoHandler()}
+        # unique for the lifetime of the game, used to key pairs of shapes in contact
+        self.shape_id = BaseCollisionShape.next_shape_id
+        BaseCollisionShape.next_shape_id += 1
+        # handle of this shape in the collision grid's shape store, stays stable until the shape is removed
+        self.grid_slot_index = -1
+        # row of this shape in the collision grid's struct of arrays shape store, if it has one
+        self.store_index = -1
+        # doubly linked chain of shapes sharing a grid square
         self.next_shape_in_grid_square_index = -1
+        self.prev_shape_in_grid_square_index = -1
+        self.collision_test_stamp = -1
 
         self.text_id = ""
         self.x = float(x)
@@ -56,11 +100,24 @@ class BaseCollisionShape:
         self.collided_shapes_this_loop = []  # Used by collision handlers to check if they should to keep iterating
         self.loop_mtv_vectors_by_shape = {}
         self.frame_mtv_vectors_by_shape = {}
+        # callbacks for contacts with each category of shape, and the contact events waiting for them. See
+        # CollisionGrid.add_contact_listener()
+        self.contact_listeners = None
+        self.pending_contact_events = []
 
         self.owner = None
         self.game_types_to_collide = game_types_to_collide
         self.game_type = game_type
 
+        # game types are bit flags. Our category is our own game type's bit and our collision mask is every game
+        # type we collide with OR'd together, so filtering a pair is a single AND. The category index is the
+        # position of our bit (plus one, zero being no category) and is used to look up handlers in the grid.
+        self.category = game_type if game_type is not None else 0
+        self.category_index = self.category.bit_length()
+        self.collision_mask = 0
+        for game_type_to_collide in game_types_to_collide:
+            self.collision_mask |= game_type_to_collide
+
         self.handlers_by_colliding_game_type = handlers_by_colliding_game_type
 
         self.num_squares_to_search_around_grid_pos = 1
@@ -76,6 +133,28 @@ class BaseCollisionShape:
         self.shortest_centre_to_edge = 0
 
         self.moved_since_last_collision_test = True
+        self.needs_grid_update = True
+        # Set by the collision grid while we are in it. When we move we add ourselves to these lists, once, so the
+        # grid only has to look at the shapes that have actually moved. See mark_moved().
+        self.grid_moved_shapes = None
+        self.grid_shapes_to_update = None
+
+        # Sensors only want to know what they overlap, e.g. trigger volumes and view cones. They are tested once a
+        # frame with the cheaper overlap functions, never get MTVs and are never handed to collision handlers.
+        self.is_sensor = False
+
+        # Fast shapes, like projectiles, can move further than the size of a tile in one step at low frame rates.
+        # When moved with CollisionGrid.move_shape() they are swept along their path so they can't pass through things.
+        self.is_fast = False
+
+        # Set by the collision grid. Static shapes never move. Dynamic shapes that have stayed within a small
+        # distance of where they came to rest, along with everything they are touching, can be put to sleep and skip
+        # collision testing until they move again.
+        self.is_static = False
+        self.is_sleeping = False
+        self.frames_at_rest = 0
+        self.rest_x = self.x
+        self.rest_y = self.y
 
         self.print_collision_stages = False
 
@@ -87,6 +166,7 @@ class BaseCollisionShape:
     def set_owner(self, owner):
         self.owner = owner
 
+    # handlers are copied into the collision grid's handler table when the shape is added to the grid
     def set_handler(self, handler, game_type):
         self.handlers_by_colliding_game_type[game_type] = handler
 
@@ -97,20 +177,32 @@ class BaseCollisionShape:
         self.num_squares_to_search_around_grid_pos = int(math.ceil(self.longest_aab_square_dimension /
                                                                    grid_square_pixel_size))
 
-    def set_new_grid_pos(self, new_grid_pos, grid_size):
+    def set_new_grid_pos(self, new_grid_pos):
         self.current_grid_pos = new_grid_pos
 
-        start_x_grid_pos = max(0, self.current_grid_pos[0] - self.num_squares_to_search_around_grid_pos)
-        end_x_grid_pos = min(grid_size[0] - 1, self.current_grid_pos[0] + self.num_squares_to_search_around_grid_pos)
-        self.nearby_grid_range_x = [start_x_grid_pos, end_x_grid_pos]
-
-        start_y_grid_pos = max(0, self.current_grid_pos[1] - self.num_squares_to_search_around_grid_pos)
-        end_y_grid_pos = min(grid_size[1] - 1, self.current_grid_pos[1] + self.num_squares_to_search_around_grid_pos)
-        self.nearby_grid_range_y = [start_y_grid_pos, end_y_grid_pos]
+        # the grid is sparse and unbounded, so there is no edge to clamp our search range to
+        self.nearby_grid_range_x = [self.current_grid_pos[0] - self.num_squares_to_search_around_grid_pos,
+                                    self.current_grid_pos[0] + self.num_squares_to_search_around_grid_pos]
+        self.nearby_grid_range_y = [self.current_grid_pos[1] - self.num_squares_to_search_around_grid_pos,
+                                    self.current_grid_pos[1] + self.num_squares_to_search_around_grid_pos]
 
     def set_position(self, pos):
         pass
 
+    def mark_moved(self):
+        """
+        Call whenever the shape's position, size or rotation changes, so it is collision tested again and moved
+        around the collision grid's broadphase.
+        """
+        if not self.moved_since_last_collision_test:
+            self.moved_since_last_collision_test = True
+            if self.grid_moved_shapes is not None:
+                self.grid_moved_shapes[self] = None
+        if not self.needs_grid_update:
+            self.needs_grid_update = True
+            if self.grid_shapes_to_update is not None:
+                self.grid_shapes_to_update[self] = None
+
     def get_closest_active_collision_normal(self, collision_shape):
         pass
 
@@ -131,8 +223,8 @@ class BaseCollisionShape:
             self.collided_shapes_this_loop.append(shape)
 
     def set_loop_mtv_vector(self, shape, vector):
-        if shape not in self.collided_shapes_this_loop:
-            self.loop_mtv_vectors_by_shape[shape] = vector
+        # the grid never re-tests a pair that has already collided this loop, so no need to check for that here
+        self.loop_mtv_vectors_by_shape[shape] = vector
 
         if shape in self.frame_mtv_vectors_by_shape:
             old_vec = self.frame_mtv_vectors_by_shape[shape]
@@ -163,6 +255,8 @@ class BaseCollisionShape:
 
 
 class CollisionCircle(BaseCollisionShape):
+    __slots__ = ["radius", "collision_normal"]
+
     def __init__(self, x, y, radius, handlers_by_colliding_game_type=None, game_type=None, game_types_to_collide=None):
         if game_types_to_collide is None:
             game_types_to_collide = []
@@ -182,7 +276,7 @@ class CollisionCircle(BaseCollisionShape):
         self.x = float(pos[0])
         self.y = float(pos[1])
         self.aabb_rect.center = [int(self.x), int(self.y)]
-        self.moved_since_last_collision_test = True
+        self.mark_moved()
 
     def is_inside(self, point):
         is_inside = False
@@ -200,6 +294,7 @@ class CollisionCircle(BaseCollisionShape):
         self.shortest_centre_to_edge = self.radius
         self.aabb_rect = pygame.Rect(self.x - radius, self.y - radius,
                                      radius * 2, radius * 2)
+        self.mark_moved()
 
     def get_closest_active_collision_normal(self, collision_shape):
         x_dist = collision_shape.x - self.x
@@ -216,6 +311,9 @@ class CollisionCircle(BaseCollisionShape):
 # as it's width and height
 # -----------------------------------------
 class CollisionRect(BaseCollisionShape):
+    __slots__ = ["py_rect", "width", "height", "rotation", "edges", "normals", "verts", "bounds_need_updating",
+                 "axis_table", "axis_table_rotation", "skipped_axes"]
+
     def __init__(self, py_rect, rotation, handlers_by_colliding_game_type=None,
                  game_type=None, game_types_to_collide=None):
         if game_types_to_collide is None:
@@ -241,36 +339,56 @@ class CollisionRect(BaseCollisionShape):
 
         self.shortest_centre_to_edge = min(self.height / 2, self.width / 2)
 
-        self.edges = {}
-        self.normals = {"top": Normal("top", [0.0]),
-                        "right": Normal("right", [0.0]),
-                        "bottom": Normal("bottom", [0.0]),
-                        "left": Normal("left", [0.0])
+        # The verts, edges and normals are allocated once here and then updated in place. Moving or rotating the rect
+        # only marks them as out of date; anything that reads them should call update_bounds_if_needed() first.
+        self.verts = [[0.0, 0.0], [0.0, 0.0], [0.0, 0.0], [0.0, 0.0]]
+        # order of edges is important. Currently laid out in a clockwise order.
+        self.edges = {"top": Edge("top", pygame.math.Vector2(), pygame.math.Vector2()),
+                      "right": Edge("right", pygame.math.Vector2(), pygame.math.Vector2()),
+                      "bottom": Edge("bottom", pygame.math.Vector2(), pygame.math.Vector2()),
+                      "left": Edge("left", pygame.math.Vector2(), pygame.math.Vector2())
+                      }
+        self.normals = {"top": Normal("top", [0.0, 0.0]),
+                        "right": Normal("right", [0.0, 0.0]),
+                        "bottom": Normal("bottom", [0.0, 0.0]),
+                        "left": Normal("left", [0.0, 0.0])
                         }
-        self.verts = []
+        # The separating axes the polygon collision test tries, one [axis x, axis y, should skip] row per edge in the
+        # same order as the edges. The axes are unit length and only depend on the rotation, so the table is only
+        # worked out again when that changes. Skipped axes are also kept in their own, usually empty, list so the
+        # collision test can check another shape's skips without looking through all of its normals.
+        self.axis_table = [[0.0, -1.0, False], [1.0, 0.0, False], [0.0, 1.0, False], [-1.0, 0.0, False]]
+        self.axis_table_rotation = None
+        self.skipped_axes = []
+        self.bounds_need_updating = True
         self.update_real_bounds()
 
     def rotate(self, rotation):
         self.rotation += rotation
-        self.update_real_bounds()
-        self.moved_since_last_collision_test = True
+        self.bounds_need_updating = True
+        self.mark_moved()
 
     def set_rotation(self, rotation):
         self.rotation = rotation
-        self.update_real_bounds()
-        self.moved_since_last_collision_test = True
+        self.bounds_need_updating = True
+        self.mark_moved()
 
     def set_position(self, pos):
         self.x = pos[0]
         self.y = pos[1]
         self.py_rect.centerx = pos[0]
         self.py_rect.centery = pos[1]
-        self.update_real_bounds()
+        self.bounds_need_updating = True
         self.aabb_rect.center = [int(self.x), int(self.y)]
-        self.moved_since_last_collision_test = True
+        self.mark_moved()
         if self.print_collision_stages:
             print("setting position to:", pos)
 
+    def fit_aabb_to_rect(self):
+        # The AABB is normally big enough to hold the rect at any rotation. For rects that will never be rotated,
+        # like large pieces of level geometry, we can shrink it down to just the rect.
+        self.aabb_rect = pygame.Rect(self.py_rect)
+
     def set_dimensions(self, width, height):
         self.width = width
         self.height = height
@@ -283,8 +401,8 @@ class CollisionRect(BaseCollisionShape):
                                      aabb_dimension)
         self.longest_aab_square_dimension = aabb_dimension
         self.shortest_centre_to_edge = min(self.height / 2, self.width / 2)
-        self.update_real_bounds()
-        self.moved_since_last_collision_test = True
+        self.bounds_need_updating = True
+        self.mark_moved()
 
     def is_inside(self, point):
         is_inside = False
@@ -293,68 +411,71 @@ class CollisionRect(BaseCollisionShape):
                 is_inside = True
         return is_inside
 
+    def update_bounds_if_needed(self):
+        if self.bounds_need_updating:
+            self.update_real_bounds()
+
     def update_real_bounds(self):
         cos_rotation = math.cos(-self.rotation)
         sin_rotation = math.sin(-self.rotation)
         half_width = self.width / 2
         half_height = self.height / 2
 
-        top_left = [0.0, 0.0]
+        top_left = self.verts[0]
         top_left[0] = self.x + ((-half_width * cos_rotation) - (-half_height * sin_rotation))
         top_left[1] = self.y + ((-half_width * sin_rotation) + (-half_height * cos_rotation))
 
-        top_right = [0.0, 0.0]
+        top_right = self.verts[1]
         top_right[0] = self.x + ((half_width * cos_rotation) - (-half_height * sin_rotation))
         top_right[1] = self.y + ((half_width * sin_rotation) + (-half_height * cos_rotation))
 
-        bottom_left = [0.0, 0.0]
+        bottom_left = self.verts[2]
         bottom_left[0] = self.x + ((-half_width * cos_rotation) - (half_height * sin_rotation))
         bottom_left[1] = self.y + ((-half_width * sin_rotation) + (half_height * cos_rotation))
 
-        bottom_right = [0.0, 0.0]
+        bottom_right = self.verts[3]
         bottom_right[0] = self.x + ((half_width * cos_rotation) - (half_height * sin_rotation))
         bottom_right[1] = self.y + ((half_width * sin_rotation) + (half_height * cos_rotation))
 
-        self.verts[:] = []
-        self.verts.append(top_left)
-        self.verts.append(top_right)
-        self.verts.append(bottom_left)
-        self.verts.append(bottom_right)
-
         # the edge ids will only be 'accurate' when the collision shape is not rotated
-        # order of edges is important. Currently laid out in a clockwise order.
-        self.edges = {"top": Edge("top", pygame.math.Vector2(top_left),
-                                  pygame.math.Vector2(top_right)),
-                      "right": Edge("right", pygame.math.Vector2(top_right),
-                                    pygame.math.Vector2(bottom_right)),
-                      "bottom": Edge("bottom", pygame.math.Vector2(bottom_right),
-                                     pygame.math.Vector2(bottom_left)),
-                      "left": Edge("left", pygame.math.Vector2(bottom_left),
-                                   pygame.math.Vector2(top_left))
-
-                      }
-
-        old_normals = self.normals.copy()
-
-        top_normal = [(self.edges["top"].b.y - self.edges["top"].a.y) / self.height,
-                      (self.edges["top"].a.x - self.edges["top"].b.x) / self.width]
-
-        left_normal = [(self.edges["left"].b.y - self.edges["left"].a.y) / self.height,
-                       (self.edges["left"].a.x - self.edges["left"].b.x) / self.width]
-
-        bottom_normal = [(self.edges["bottom"].b.y - self.edges["bottom"].a.y) / self.height,
-                         (self.edges["bottom"].a.x - self.edges["bottom"].b.x) / self.width]
+        self.edges["top"].set_ends(top_left, top_right)
+        self.edges["right"].set_ends(top_right, bottom_right)
+        self.edges["bottom"].set_ends(bottom_right, bottom_left)
+        self.edges["left"].set_ends(bottom_left, top_left)
 
-        right_normal = [(self.edges["right"].b.y - self.edges["right"].a.y) / self.height,
-                        (self.edges["right"].a.x - self.edges["right"].b.x) / self.width]
+        self.update_axis_table_if_needed()
+        self.bounds_need_updating = False
 
-        self.normals = {"top": Normal("top", top_normal, old_normals["top"].should_skip),
-                        "right": Normal("right", right_normal, old_normals["right"].should_skip),
-                        "bottom": Normal("bottom", bottom_normal, old_normals["bottom"].should_skip),
-                        "left": Normal("left", left_normal, old_normals["left"].should_skip)
-                        }
+    def update_axis_table_if_needed(self):
+        if self.axis_table_rotation == self.rotation:
+            return
+        cos_rotation = math.cos(-self.rotation)
+        sin_rotation = math.sin(-self.rotation)
+        # the outward unit normals of the top, right, bottom & left edges turned by the rotation
+        axes = [[sin_rotation, -cos_rotation], [cos_rotation, sin_rotation],
+                [-sin_rotation, cos_rotation], [-cos_rotation, -sin_rotation]]
+        for axis, axis_row, normal in zip(axes, self.axis_table, self.normals.values()):
+            axis_row[0] = axis[0]
+            axis_row[1] = axis[1]
+            normal.value[0] = axis[0]
+            normal.value[1] = axis[1]
+        self.axis_table_rotation = self.rotation
+
+    def set_normal_should_skip(self, name, should_skip):
+        """
+        Turn collision reactions along one of the rect's edge normals on or off, e.g. for the edges between tiles
+        that are next to each other. Use this rather than setting the normal's should_skip directly so the axis table
+        used by the collision tests stays in step.
+
+        :param name: 'top', 'right', 'bottom' or 'left'.
+        :param should_skip: True to ignore collisions along this normal.
+        """
+        self.normals[name].should_skip = should_skip
+        self.axis_table[list(self.normals).index(name)][2] = should_skip
+        self.skipped_axes = [axis_row for axis_row in self.axis_table if axis_row[2]]
 
     def get_closest_active_collision_normal(self, collision_shape):
+        self.update_bounds_if_needed()
         closest_edge_id = None
         closest_distance = 1000000000.0
         for name, normal in self.normals.items():
@@ -370,7 +491,8 @@ class CollisionRect(BaseCollisionShape):
                     closest_edge_id = name
         closest_edge_normal = [0.0, -1.0]
         if closest_edge_id is not None:
-            closest_edge_normal = self.normals[closest_edge_id].value
+            # copied, as the normal's own value is updated in place when we rotate
+            closest_edge_normal = list(self.normals[closest_edge_id].value)
         return closest_edge_normal
 
     @staticmethod
@@ -401,7 +523,52 @@ class CollisionRect(BaseCollisionShape):
         return math.sqrt(dx * dx + dy * dy)
 
 
+class AABBTreeNode:
+    """
+    A node in the small AABB tree a composite shape keeps over its sub-shapes. Leaves hold a single sub-shape and
+    use its own AABB, branches hold two child nodes and an AABB around both of them.
+    """
+    __slots__ = ["aabb_rect", "shape", "children"]
+
+    def __init__(self, shape=None, children=None):
+        self.shape = shape
+        self.children = children
+        self.aabb_rect = None
+        self.refit()
+
+    @staticmethod
+    def build(shapes):
+        """
+        Build a tree over some shapes, top down, by splitting them in half along the longer side of their bounds
+        until each one is in its own leaf.
+
+        :param shapes: a list of at least one collision shape.
+        :return: the root node.
+        """
+        if len(shapes) == 1:
+            return AABBTreeNode(shape=shapes[0])
+        bounds = shapes[0].aabb_rect.unionall([shape.aabb_rect for shape in shapes[1:]])
+        if bounds.width >= bounds.height:
+            sorted_shapes = sorted(shapes, key=lambda shape: shape.x)
+        else:
+            sorted_shapes = sorted(shapes, key=lambda shape: shape.y)
+        half = len(sorted_shapes) // 2
+        return AABBTreeNode(children=[AABBTreeNode.build(sorted_shapes[:half]),
+                                      AABBTreeNode.build(sorted_shapes[half:])])
+
+    def refit(self):
+        # sub-shapes keep their places relative to each other, so moving the composite only needs the branch AABBs
+        # bringing up to date and never a rebuild
+        if self.shape is not None:
+            self.aabb_rect = self.shape.aabb_rect
+        else:
+            self.children[0].refit()
+            self.children[1].refit()
+            self.aabb_rect = self.children[0].aabb_rect.union(self.children[1].aabb_rect)
+
+
 class CompositeCollisionShape(BaseCollisionShape):
+    __slots__ = ["collision_shapes", "collision_shape_pos_offsets", "aabb_tree"]
 
     def __init__(self, x, y, dimensions, handlers_by_colliding_game_type=None,
                  game_type=None, game_types_to_collide=None):
@@ -409,6 +576,7 @@ class CompositeCollisionShape(BaseCollisionShape):
             game_types_to_collide = []
         self.collision_shapes = []
         self.collision_shape_pos_offsets = []
+        self.aabb_tree = None
 
         aabb_rect = pygame.Rect([x - (dimensions[0] / 2), y - (dimensions[1] / 2)], dimensions)
         super(CompositeCollisionShape, self).__init__(x,
@@ -437,19 +605,45 @@ class CompositeCollisionShape(BaseCollisionShape):
         self.collision_shapes.append(shape)
         self.collision_shape_pos_offsets.append(pos_offset)
         self.update_sub_shape_positions()
+        self.aabb_tree = AABBTreeNode.build(self.collision_shapes)
 
     def set_position(self, pos):
         self.x = pos[0]
         self.y = pos[1]
         self.update_sub_shape_positions()
         self.aabb_rect.center = [int(self.x), int(self.y)]
-        self.moved_since_last_collision_test = True
+        self.mark_moved()
 
     def update_sub_shape_positions(self):
         for i in range(0, len(self.collision_shapes)):
             shape = self.collision_shapes[i]
             offset = self.collision_shape_pos_offsets[i]
             shape.set_position([self.x + offset[0], self.y + offset[1]])
+        if self.aabb_tree is not None:
+            self.aabb_tree.refit()
+
+    def get_sub_shapes_in_aabb(self, aabb_rect):
+        """
+        The sub-shapes whose AABBs overlap an AABB, skipping whole branches of the composite's AABB tree that
+        don't. Yields them one at a time so callers can stop as soon as they have found what they need.
+
+        :param aabb_rect: a pygame.Rect in world space.
+        """
+        if self.aabb_tree is None:
+            return
+        # AABBs are rounded to whole pixels, so allow a pixel either way to keep shapes that only just touch
+        search_rect = aabb_rect.inflate(2, 2)
+        nodes_to_visit = [self.aabb_tree]
+        while nodes_to_visit:
+            node = nodes_to_visit.pop()
+            if not node.aabb_rect.colliderect(search_rect):
+                continue
+            if node.shape is not None:
+                yield node.shape
+            else:
+                # pushed second child first so the sub-shapes come out in the order the tree was built
+                nodes_to_visit.append(node.children[1])
+                nodes_to_visit.append(node.children[0])
 
     def is_inside(self, point):
         is_inside = False
@@ -302,6 +302,7 @@ class DrawableCollisionRect:
 
     def draw_normals(self, surface, view_top_left_position):
         length_of_normals = 5.0
+        self.collision_rect.update_bounds_if_needed()
         for edge_id in self.collision_rect.edges:
             edge = self.collision_rect.edges[edge_id]
             normal = self.collision_rect.normals[edge_id]
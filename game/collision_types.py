@@ -4,19 +4,21 @@ class CollisionType:
     """
     Types of collidable stuff in the game world. A way of identifying what sort of thing we just bumped into
     when colliding without getting too much more specific than that.
+
+    Each type is a single bit so a shape can describe everything it collides with as one mask of OR'd types.
     """
-    WORLD_SOLID = 0,
-    WORLD_JUMP_THROUGH = 1,
-    WORLD_PLATFORM_EDGE = 2,
-    WORLD_JUMP_THROUGH_EDGE = 3,
-    LADDERS = 4,
-    PLAYER = 5,
-    PLAYER_LADDER = 6,
-    PLAYER_ATTACKS = 7,
-    PLAYER_PROJECTILES = 8,
-    AI = 9,
-    AI_PROJECTILES = 10,
-    AI_ATTACKS = 11,
-    VIEW_CONE = 12,
-    DOOR = 13,
-    WATER = 14
+    WORLD_SOLID = 1 << 0
+    WORLD_JUMP_THROUGH = 1 << 1
+    WORLD_PLATFORM_EDGE = 1 << 2
+    WORLD_JUMP_THROUGH_EDGE = 1 << 3
+    LADDERS = 1 << 4
+    PLAYER = 1 << 5
+    PLAYER_LADDER = 1 << 6
+    PLAYER_ATTACKS = 1 << 7
+    PLAYER_PROJECTILES = 1 << 8
+    AI = 1 << 9
+    AI_PROJECTILES = 1 << 10
+    AI_ATTACKS = 1 << 11
+    VIEW_CONE = 1 << 12
+    DOOR = 1 << 13
+    WATER = 1 << 14
@@ -71,6 +71,26 @@ class EnemyArcher(pygame.sprite.Sprite):
         self.collision_grid.add_new_shape_to_grid(self.collision_shape)
         self.collision_shape.owner = self
 
+        # the collision grid only passes on the contacts we react to, see the on_..._contact methods. Platform edges
+        # are world geometry too, so they reach both of the last two.
+        self.collision_grid.add_contact_listener(self.collision_shape, CollisionType.PLAYER_PROJECTILES,
+                                                 self.on_projectile_contact)
+        self.collision_grid.add_contact_listener(self.collision_shape, CollisionType.PLAYER_ATTACKS,
+                                                 self.on_attack_contact)
+        self.collision_grid.add_contact_listener(self.collision_shape,
+                                                 CollisionType.WORLD_PLATFORM_EDGE |
+                                                 CollisionType.WORLD_JUMP_THROUGH_EDGE,
+                                                 self.on_platform_edge_contact)
+        self.collision_grid.add_contact_listener(self.collision_shape,
+                                                 CollisionType.WORLD_SOLID | CollisionType.WORLD_PLATFORM_EDGE |
+                                                 CollisionType.WORLD_JUMP_THROUGH |
+                                                 CollisionType.WORLD_JUMP_THROUGH_EDGE,
+                                                 self.on_world_contact)
+        # what our contacts did to us this frame
+        self.floor_collided_this_frame = False
+        self.hit_wall_this_frame = False
+        self.knockback_velocity_this_frame = None
+
         self.base_health = 100
         self.current_health = self.base_health
 
@@ -97,8 +117,7 @@ class EnemyArcher(pygame.sprite.Sprite):
             facing_vec = [1.0, 0.0]
         else:
             facing_vec = [-1.0, 0.0]
-        self.view_cone = ViewCone(self.world_position, facing_vec, fov=30.0, length=400.0)
-        self.collision_grid.add_new_shape_to_grid(self.view_cone.collision_circle)
+        self.view_cone = ViewCone(self.world_position, facing_vec, self.collision_grid, fov=30.0, length=400.0)
         self.visible_enemies = None
         self.closest_visible_enemy = None
 
@@ -146,7 +165,6 @@ class EnemyArcher(pygame.sprite.Sprite):
             self.kill()
             self.health_ui.kill()
             self.collision_grid.remove_shape_from_grid(self.collision_shape)
-            self.collision_grid.remove_shape_from_grid(self.view_cone.collision_circle)
             self.drawable_collision_rectangle = None
             self.alive = False
 
@@ -245,15 +263,17 @@ class EnemyArcher(pygame.sprite.Sprite):
         if self.time_since_last_saw_enemy > self.enemy_spotted_timeout:
             self.closest_visible_enemy = None
 
-        enemies = [sprite for sprite in self.moving_sprites_group.sprites()
-                   if sprite.type == "player" and self.in_range_and_in_front(sprite)]
+        if self.x_facing_direction == "right":
+            facing_vec = [1.0, 0.0]
+        else:
+            facing_vec = [-1.0, 0.0]
+        enemies = self.get_shape_owners(self.collision_grid.query_sector(self.world_position, facing_vec,
+                                                                         self.view_cone.field_of_view,
+                                                                         self.view_cone.length, CollisionType.PLAYER))
+        enemies = [sprite for sprite in enemies if sprite.type == "player" and self.in_range_and_in_front(sprite)]
 
         if len(enemies) > 0 and self.has_moved:
             self.view_cone.set_position(pygame.math.Vector2(self.world_position))
-            if self.x_facing_direction == "right":
-                facing_vec = [1.0, 0.0]
-            else:
-                facing_vec = [-1.0, 0.0]
             self.view_cone.set_facing_direction(pygame.math.Vector2(facing_vec))
             self.view_cone.update()
             self.visible_enemies = [sprite for sprite in enemies if
@@ -265,6 +285,15 @@ class EnemyArcher(pygame.sprite.Sprite):
         else:
             self.view_cone.clear()
 
+    @staticmethod
+    def get_shape_owners(shapes):
+        # an owner may have more than one shape, but we only want it once
+        owners = {}
+        for shape in shapes:
+            if shape.owner is not None:
+                owners[shape.owner] = None
+        return list(owners)
+
     def find_closest(self, sprites):
         closest_distance = 9999999999999999.0
         closest_sprite = None
@@ -277,84 +306,73 @@ class EnemyArcher(pygame.sprite.Sprite):
                 closest_sprite = sprite
         return closest_sprite
 
-    def update(self, time_delta, gravity, camera):
+    def on_projectile_contact(self, contact):
+        if not self.should_flash_sprite:  # invincible for flash time secs (0.5) after taking damage
+            self.take_damage(15)
+            # turn to face damage source
+            self.last_impact_direction_vec = pygame.math.Vector2(contact.other_shape.owner.velocity[0],
+                                                                 contact.other_shape.owner.velocity[1])
+            self.last_impact_direction_vec.normalize_ip()
+            self.knockback_velocity_this_frame = self.apply_knockback(contact.other_shape)
+
+    def on_attack_contact(self, contact):
+        if not self.should_flash_sprite:  # invincible for flash time secs (0.5) after taking damage
+            self.take_damage(15)
+            # turn to face damage source
+            attacker = contact.other_shape.owner
+            self.last_impact_direction_vec = pygame.math.Vector2(self.world_position[0] - attacker.world_position[0],
+                                                                 self.world_position[1] - attacker.world_position[1])
+            if self.last_impact_direction_vec.length_squared() > 0:
+                self.last_impact_direction_vec.normalize_ip()
+            self.knockback_velocity_this_frame = self.apply_knockback(contact.other_shape)
+
+    def on_platform_edge_contact(self, contact):
+        # slightly tricksy bit of code here to detect when are at a left or right platform edge
+        # relies on the edges being tagged up using a special tile type and some poking at the normals
+        # to figure out if it is a left or right platform edge. This method won't work on single block
+        # platforms but that's probably OK, AI can just fall off those.
+        shape = contact.other_shape
+        if not self.changed_direction_recently and self.motion_state == "walk":
+            if shape.y > self.collision_shape.aabb_rect.bottom:  # test we are walking on top of this edge
+                if self.x_facing_direction == "left":
+                    if self.collision_shape.x < shape.x and not shape.normals['left'].should_skip:
+                        self.collision_shape.set_position([shape.x, self.collision_shape.y])
+                        self.changed_direction_recently = True
+                        self.x_facing_direction = "right"
+                elif self.x_facing_direction == "right":
+                    if self.collision_shape.x > shape.x and not shape.normals['right'].should_skip:
+                        self.collision_shape.set_position([shape.x, self.collision_shape.y])
+                        self.changed_direction_recently = True
+                        self.x_facing_direction = "left"
+
+    def on_world_contact(self, contact):
+        # see if we have an upwards facing mtv vector
+        mtv_vector = contact.mtv_vector
+        if mtv_vector is not None:
+            if abs(mtv_vector[1]) > abs(mtv_vector[0]) and mtv_vector[1] < 0:
+                self.floor_collided_this_frame = True
+                self.velocity[1] = 0.0
+                self.frames_falling = 0
+                self.touching_ground = True
+            # see if we have a sideways facing mtv vector
+            if abs(mtv_vector[0]) > abs(mtv_vector[1]):
+                self.hit_wall_this_frame = True
+                self.velocity[0] = 0.0
+                # makes AI change direction if they hit a wall.
+                if not self.changed_direction_recently:
+                    self.changed_direction_recently = True
+                    if self.x_facing_direction == "left" and mtv_vector[0] > 0:
+                        self.x_facing_direction = "right"
+                    elif self.x_facing_direction == "right" and mtv_vector[0] < 0:
+                        self.x_facing_direction = "left"
 
-        floor_collided_this_frame = False
-        impact_velocity = None
-        hit_wall = False
-        mtv_vector = None
+    def update(self, time_delta, gravity, camera):
+        self.floor_collided_this_frame = False
+        self.hit_wall_this_frame = False
+        self.knockback_velocity_this_frame = None
+        self.collision_grid.dispatch_contact_events(self.collision_shape)
 
-        if len(self.collision_shape.collided_shapes_this_frame) > 0:
-            for shape in self.collision_shape.collided_shapes_this_frame:
-                if shape.game_type == CollisionType.PLAYER_PROJECTILES:
-                    if not self.should_flash_sprite:  # invincible for flash time secs (0.5) after taking damage
-                        self.take_damage(15)
-                        # turn to face damage source
-                        self.last_impact_direction_vec = pygame.math.Vector2(shape.owner.velocity[0],
-                                                                             shape.owner.velocity[1])
-                        self.last_impact_direction_vec.normalize_ip()
-                        impact_velocity = self.apply_knockback(shape)
-
-                if shape.game_type == CollisionType.PLAYER_ATTACKS:
-                    if not self.should_flash_sprite:  # invincible for flash time secs (0.5) after taking damage
-                        self.take_damage(15)
-                        # turn to face damage source
-                        self.last_impact_direction_vec = pygame.math.Vector2(self.world_position[0] - shape.owner.world_position[0],
-                                                                             self.world_position[1] - shape.owner.world_position[1])
-                        if self.last_impact_direction_vec.length_squared() > 0:
-                            self.last_impact_direction_vec.normalize_ip()
-                        impact_velocity = self.apply_knockback(shape)
-
-                if shape.game_type == CollisionType.WORLD_PLATFORM_EDGE or shape.game_type == CollisionType.WORLD_JUMP_THROUGH_EDGE:
-                    # slightly tricksy bit of code here to detect when are at a left or right platform edge
-                    # relies on the edges being tagged up using a special tile type and some poking at the normals
-                    # to figure out if it is a left or right platform edge. This method won't work on single block
-                    # platforms but that's probably OK, AI can just fall off those.
-                    if not self.changed_direction_recently and self.motion_state == "walk":
-                        if shape.y > self.collision_shape.aabb_rect.bottom:  # test we are walking on top of this edge
-                            if self.x_facing_direction == "left":
-                                if self.collision_shape.x < shape.x and not shape.normals['left'].should_skip:
-                                    self.collision_shape.set_position([shape.x, self.collision_shape.y])
-                                    self.changed_direction_recently = True
-                                    self.x_facing_direction = "right"
-                            elif self.x_facing_direction == "right":
-                                if self.collision_shape.x > shape.x and not shape.normals['right'].should_skip:
-                                    self.collision_shape.set_position([shape.x, self.collision_shape.y])
-                                    self.changed_direction_recently = True
-                                    self.x_facing_direction = "left"
-
-                if shape.game_type == CollisionType.WORLD_SOLID or \
-                        shape.game_type == CollisionType.WORLD_PLATFORM_EDGE or \
-                        shape.game_type == CollisionType.WORLD_JUMP_THROUGH or \
-                        shape.game_type == CollisionType.WORLD_JUMP_THROUGH_EDGE:
-                    # see if we have an upwards facing mtv vector
-                    mtv_vector = self.collision_shape.get_frame_mtv_vector(shape)
-                    if mtv_vector is not None:
-                        if abs(mtv_vector[1]) > abs(mtv_vector[0]) and mtv_vector[1] < 0:
-                            floor_collided_this_frame = True
-                            self.velocity[1] = 0.0
-                            self.frames_falling = 0
-                            self.touching_ground = True
-                        # see if we have a sideways facing mtv vector
-                        if abs(mtv_vector[0]) > abs(mtv_vector[1]):
-                            hit_wall = True
-                            self.velocity[0] = 0.0
-                            # makes AI change direction if they hit a wall.
-                            if not self.changed_direction_recently:
-                                self.changed_direction_recently = True
-                                if self.x_facing_direction == "left" and mtv_vector[0] > 0:
-                                    self.x_facing_direction = "right"
-                                elif self.x_facing_direction == "right" and mtv_vector[0] < 0:
-                                    self.x_facing_direction = "left"
-
-                    #if not self.touching_ground:
-                    #    print("mid air collision")
-                    #    self.velocity[0] = 0.0
-                    #    self.velocity[1] = 0.0
-                    #    self.collision_shape.x = self.world_position[0]
-                    #    self.collision_shape.y = self.world_position[1]
-
-        if not floor_collided_this_frame:
+        if not self.floor_collided_this_frame:
             if self.touching_ground and self.frames_falling > 10:
                 self.frames_falling = 0
                 self.touching_ground = False
@@ -364,10 +382,10 @@ class EnemyArcher(pygame.sprite.Sprite):
             self.world_position[0] = self.collision_shape.x - self.collision_shape_offset[0]
             self.world_position[1] = self.collision_shape.y - self.collision_shape_offset[1]
 
-        if not floor_collided_this_frame:
+        if not self.floor_collided_this_frame:
             self.velocity[1] += gravity * time_delta
 
-        self.update_impact_reactions(hit_wall, impact_velocity, time_delta)
+        self.update_impact_reactions(self.hit_wall_this_frame, self.knockback_velocity_this_frame, time_delta)
 
         velocity_delta_vec = pygame.math.Vector2(self.velocity[0] * time_delta,
                                                  self.velocity[1] * time_delta)
@@ -7,6 +7,7 @@ from game.animation import AnimSet
 from game.projectile import ThrowingKnife
 from game.collision_types import CollisionType
 from collision.collision_shapes import CollisionRect
+from collision.collision_grid import CollisionPair
 from collision.drawable_collision_shapes import DrawableCollisionRect
 from game.view_cone import ViewCone
 from game.exit_door_hint import ExitDoorHint
@@ -106,8 +107,25 @@ class Player(pygame.sprite.Sprite):
                                                        CollisionType.WATER: collision_grid.no_handler},
                                                       CollisionType.PLAYER_LADDER,
                                                       [CollisionType.LADDERS, CollisionType.DOOR, CollisionType.WATER])
+        self.triggers_collision_shape.is_sensor = True
         self.collision_grid.add_new_shape_to_grid(self.triggers_collision_shape)
 
+        # the collision grid only passes on the contacts we react to, see the on_..._contact methods
+        self.collision_grid.add_contact_listener(self.triggers_collision_shape,
+                                                 CollisionType.WATER | CollisionType.LADDERS, self.on_trigger_contact)
+        # exit doors only need to know when we start and stop touching them
+        self.collision_grid.add_contact_listener(self.triggers_collision_shape, CollisionType.DOOR,
+                                                 self.on_door_contact, (CollisionPair.BEGIN, CollisionPair.END))
+        self.collision_grid.add_contact_listener(self.collision_shape, CollisionType.AI_PROJECTILES,
+                                                 self.on_projectile_contact)
+        self.collision_grid.add_contact_listener(self.collision_shape,
+                                                 CollisionType.WORLD_JUMP_THROUGH |
+                                                 CollisionType.WORLD_JUMP_THROUGH_EDGE,
+                                                 self.on_jump_through_contact)
+        self.collision_grid.add_contact_listener(self.collision_shape,
+                                                 CollisionType.WORLD_SOLID | CollisionType.WORLD_PLATFORM_EDGE,
+                                                 self.on_solid_contact)
+
         self.velocity = [0.0, 0.0]
 
         self.move_speed = 0.0
@@ -148,6 +166,7 @@ class Player(pygame.sprite.Sprite):
         # world position information
         self.in_climb_position = True
         self.touching_ground = False
+        self.floor_collided_this_frame = False
 
         # weapons
         self.thrown_knife = False
@@ -174,8 +193,7 @@ class Player(pygame.sprite.Sprite):
             facing_vec = [1.0, 0.0]
         else:
             facing_vec = [-1.0, 0.0]
-        self.view_cone = ViewCone(self.world_position, facing_vec, fov=145.0, length=450.0)
-        self.collision_grid.add_new_shape_to_grid(self.view_cone.collision_circle)
+        self.view_cone = ViewCone(self.world_position, facing_vec, self.collision_grid, fov=145.0, length=450.0)
         self.visible_enemies = None
         self.closest_visible_enemy = None
 
@@ -184,6 +202,7 @@ class Player(pygame.sprite.Sprite):
 
         # handling level exit doors
         self.in_exit_door_position = False
+        self.exit_door_contacts = 0
         self.has_exited_level = False
         self.exit_door_hint = ExitDoorHint(self.fonts, self)
 
@@ -259,83 +278,84 @@ class Player(pygame.sprite.Sprite):
         if self.current_health < 0:
             self.current_health = 0
 
+    def on_trigger_contact(self, contact):
+        if contact.other_shape.game_type == CollisionType.WATER:
+            self.speed_multiplier = 0.5
+        elif contact.other_shape.game_type == CollisionType.LADDERS:
+            self.in_climb_position = True
+            self.found_ladder_position = [contact.other_shape.x, contact.other_shape.y]
+
+    def on_door_contact(self, contact):
+        if contact.event == CollisionPair.BEGIN:
+            self.exit_door_contacts += 1
+        elif contact.event == CollisionPair.END:
+            self.exit_door_contacts -= 1
+
+    def on_projectile_contact(self, contact):
+        self.lose_health(10)
+
+    def on_jump_through_contact(self, contact):
+        # moderately complicated handling for platforms that you can jump and climb through
+        # essentially they only act like platforms if you fall down on top of them
+        # I treat them like collision shapes with no handling and then only apply the mtv vector
+        # if a bunch of conditions are met (falling, not climbing or starting a jump & above the platform)
+        mtv_vector = contact.mtv_vector
+        if self.climb_down:
+            self.touching_ground = False
+        else:
+            if mtv_vector is not None and not (
+                    self.action_to_start == "jump") and self.motion_state != "climb":
+                if abs(mtv_vector[1]) > abs(mtv_vector[0]) and mtv_vector[1] < 0 and self.velocity[1] > 0.0:
+                    if abs(mtv_vector[1]) > 0.5:
+                        self.collision_shape.set_position([self.collision_shape.x + mtv_vector[0],
+                                                           self.collision_shape.y + mtv_vector[1]])
+                    self.floor_collided_this_frame = True
+                    self.velocity[1] = 0.0
+                    self.frames_falling = 0
+                    self.touching_ground = True
+                    if self.motion_state == "jump" or self.motion_state == "jump_throw":
+                        self.thrown_knife = False
+
+            elif mtv_vector is None and self.motion_state != "climb":
+                if self.touching_ground:
+                    self.floor_collided_this_frame = True
+
+    def on_solid_contact(self, contact):
+        # see if we have an upwards facing mtv vector
+        mtv_vector = contact.mtv_vector
+        if mtv_vector is not None and not (self.action_to_start == "jump"):
+            if abs(mtv_vector[1]) > abs(mtv_vector[0]) and mtv_vector[1] < 0:
+                self.floor_collided_this_frame = True
+                self.velocity[1] = 0.0
+                self.frames_falling = 0
+                self.touching_ground = True
+                if self.motion_state == "jump" or self.motion_state == "jump_throw":
+                    self.thrown_knife = False
+            # see if we have a sideways facing mtv vector
+            if abs(mtv_vector[0]) - abs(mtv_vector[1]) > 0.1:
+                self.move_speed = 0.0
+                self.motion_state = "idle"
+        elif mtv_vector is None:
+            if self.touching_ground:
+                self.floor_collided_this_frame = True
+
     def update(self, time_delta, gravity, camera):
         # react to collision stuff
         self.in_climb_position = False
         self.speed_multiplier = 1.0
-        floor_collided_this_frame = False
-        in_exit_door_position = False
-        if len(self.triggers_collision_shape.collided_shapes_this_frame) > 0:
-            for shape in self.triggers_collision_shape.collided_shapes_this_frame:
-                if shape.game_type == CollisionType.WATER:
-                    self.speed_multiplier = 0.5
-                elif shape.game_type == CollisionType.LADDERS:
-                    self.in_climb_position = True
-                    self.found_ladder_position = [shape.x, shape.y]
-
-                elif shape.game_type == CollisionType.DOOR:
-                    in_exit_door_position = True
-                    if not self.in_exit_door_position:
-                        self.in_exit_door_position = True
-                        self.add_exit_door_hint()
-
-        if len(self.collision_shape.collided_shapes_this_frame) > 0:
-            for shape in self.collision_shape.collided_shapes_this_frame:
-                if shape.game_type == CollisionType.AI_PROJECTILES:
-                    self.lose_health(10)
-                if shape.game_type == CollisionType.WORLD_JUMP_THROUGH or\
-                        shape.game_type == CollisionType.WORLD_JUMP_THROUGH_EDGE:
-                    # moderately complicated handling for platforms that you can jump and climb through
-                    # essentially they only act like platforms if you fall down on top of them
-                    # I treat them like collision shapes with no handling and then only apply the mtv vector
-                    # if a bunch of conditions are met (falling, not climbing or starting a jump & above the platform)
-                    mtv_vector = self.collision_shape.get_frame_mtv_vector(shape)
-                    if self.climb_down:
-                        self.touching_ground = False
-                    else:
-                        if mtv_vector is not None and not (
-                                self.action_to_start == "jump") and self.motion_state != "climb":
-                            if abs(mtv_vector[1]) > abs(mtv_vector[0]) and mtv_vector[1] < 0 and self.velocity[1] > 0.0:
-                                if abs(mtv_vector[1]) > 0.5:
-                                    self.collision_shape.set_position([self.collision_shape.x + mtv_vector[0],
-                                                                       self.collision_shape.y + mtv_vector[1]])
-                                floor_collided_this_frame = True
-                                self.velocity[1] = 0.0
-                                self.frames_falling = 0
-                                self.touching_ground = True
-                                if self.motion_state == "jump" or self.motion_state == "jump_throw":
-                                    self.thrown_knife = False
-
-                        elif mtv_vector is None and self.motion_state != "climb":
-                            if self.touching_ground:
-                                floor_collided_this_frame = True
-
-                if shape.game_type == CollisionType.WORLD_SOLID or \
-                        shape.game_type == CollisionType.WORLD_PLATFORM_EDGE:
-                    # see if we have an upwards facing mtv vector
-                    mtv_vector = self.collision_shape.get_frame_mtv_vector(shape)
-                    if mtv_vector is not None and not (self.action_to_start == "jump"):
-                        if abs(mtv_vector[1]) > abs(mtv_vector[0]) and mtv_vector[1] < 0:
-                            floor_collided_this_frame = True
-                            self.velocity[1] = 0.0
-                            self.frames_falling = 0
-                            self.touching_ground = True
-                            if self.motion_state == "jump" or self.motion_state == "jump_throw":
-                                self.thrown_knife = False
-                        # see if we have a sideways facing mtv vector
-                        if abs(mtv_vector[0]) - abs(mtv_vector[1]) > 0.1:
-                            self.move_speed = 0.0
-                            self.motion_state = "idle"
-                    elif mtv_vector is None:
-                        if self.touching_ground:
-                            floor_collided_this_frame = True
-
-        if not in_exit_door_position:
-            if self.in_exit_door_position:
-                self.in_exit_door_position = False
-                self.remove_exit_door_hint()
-
-        if not floor_collided_this_frame:
+        self.floor_collided_this_frame = False
+        self.collision_grid.dispatch_contact_events(self.triggers_collision_shape)
+        if self.exit_door_contacts > 0:
+            if not self.in_exit_door_position:
+                self.in_exit_door_position = True
+                self.add_exit_door_hint()
+        elif self.in_exit_door_position:
+            self.in_exit_door_position = False
+            self.remove_exit_door_hint()
+
+        self.collision_grid.dispatch_contact_events(self.collision_shape)
+
+        if not self.floor_collided_this_frame:
             if self.touching_ground and self.frames_falling > 10:
                 self.frames_falling = 0
                 self.touching_ground = False
@@ -392,7 +412,7 @@ class Player(pygame.sprite.Sprite):
         if self.motion_state == "climb":
             pass
         else:
-            if not floor_collided_this_frame:
+            if not self.floor_collided_this_frame:
                 self.velocity[1] += gravity * time_delta
 
         self.world_position[0] += self.velocity[0] * time_delta
@@ -448,8 +468,9 @@ class Player(pygame.sprite.Sprite):
         return True
 
     def update_visible_enemies(self):
-        enemies = [sprite for sprite in self.moving_sprites_group.sprites()
-                   if sprite.type == "enemy" and self.in_range_and_in_front(sprite)]
+        enemies = self.get_shape_owners(self.collision_grid.query_circle(self.world_position, self.view_cone.length,
+                                                                         CollisionType.AI))
+        enemies = [sprite for sprite in enemies if sprite.type == "enemy" and self.in_range_and_in_front(sprite)]
 
         if len(enemies) > 0 and self.collision_shape.moved_since_last_collision_test:
             self.view_cone.set_position(pygame.math.Vector2(self.world_position))
@@ -469,6 +490,15 @@ class Player(pygame.sprite.Sprite):
             self.view_cone.clear()
             self.closest_visible_enemy = None
 
+    @staticmethod
+    def get_shape_owners(shapes):
+        # an owner may have more than one shape, but we only want it once
+        owners = {}
+        for shape in shapes:
+            if shape.owner is not None:
+                owners[shape.owner] = None
+        return list(owners)
+
     def find_closest(self, sprites):
         closest_distance = 9999999999999999.0
         closest_sprite = None
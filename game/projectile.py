@@ -3,6 +3,7 @@ import random
 import math
 from game.collision_types import CollisionType
 from collision.collision_shapes import CollisionRect
+from collision.collision_grid import CollisionPair
 from collision.drawable_collision_shapes import DrawableCollisionRect
 
 
@@ -70,8 +71,19 @@ class ThrowingKnife(Projectile):
                                              collision_type,
                                              game_types_to_collide_with)
         self.collision_shape.owner = self
+        # fast enough to go straight through a tile in one step at low frame rates, so we sweep it when it moves
+        self.collision_shape.is_fast = True
         self.collision_grid.add_new_shape_to_grid(self.collision_shape)
 
+        # we only care about the first frame we touch something. Actors destroy us, anything else we stick into.
+        actor_types = (CollisionType.AI | CollisionType.PLAYER |
+                       CollisionType.PLAYER_PROJECTILES | CollisionType.AI_PROJECTILES)
+        self.collision_grid.add_contact_listener(self.collision_shape, actor_types, self.on_actor_contact,
+                                                 (CollisionPair.BEGIN,))
+        self.collision_grid.add_contact_listener(self.collision_shape,
+                                                 self.collision_shape.collision_mask & ~actor_types,
+                                                 self.on_world_contact, (CollisionPair.BEGIN,))
+
         self.collision_shape.set_position(self.world_position)
 
         self.projectile_drawable_rects = projectile_drawable_rects
@@ -88,30 +100,31 @@ class ThrowingKnife(Projectile):
 
         self.should_kill = False
 
+    def on_actor_contact(self, contact):
+        self.should_kill = True
+
+    def on_world_contact(self, contact):
+        if not self.hit_something:
+            self.hit_something = True
+            # A bunch of code here to make sure daggers stick into things in a meaty fashion
+            self.world_position[0] = self.collision_shape.x
+            self.world_position[1] = self.collision_shape.y
+            self.velocity = [0.0, 0.0]
+            embed = random.normalvariate(self.knife_embed_length, self.knife_embed_length/8)
+            self.world_position[0] += self.facing_direction[0] * embed
+            self.world_position[1] += self.facing_direction[1] * embed
+
+            self.collision_shape.set_position(self.world_position)
+
+            self.frozen = True
+
     def update(self, time_delta, gravity, camera):
         self.life_time -= time_delta
         if self.life_time <= 0.0:
             self.should_kill = True
 
         if self.collision_shape is not None:
-            if len(self.collision_shape.collided_shapes_this_frame) > 0:
-                for shape in self.collision_shape.collided_shapes_this_frame:
-                    if shape.game_type == CollisionType.AI or shape.game_type == CollisionType.PLAYER or shape.game_type == CollisionType.PLAYER_PROJECTILES or shape.game_type == CollisionType.AI_PROJECTILES:
-                        self.should_kill = True
-                    else:
-                        if not self.hit_something:
-                            self.hit_something = True
-                            # A bunch of code here to make sure daggers stick into things in a meaty fashion
-                            self.world_position[0] = self.collision_shape.x
-                            self.world_position[1] = self.collision_shape.y
-                            self.velocity = [0.0, 0.0]
-                            embed = random.normalvariate(self.knife_embed_length, self.knife_embed_length/8)
-                            self.world_position[0] += self.facing_direction[0] * embed
-                            self.world_position[1] += self.facing_direction[1] * embed
-
-                            self.collision_shape.set_position(self.world_position)
-
-                            self.frozen = True
+            self.collision_grid.dispatch_contact_events(self.collision_shape)
 
         if not self.frozen:
             vel_length = math.sqrt(self.velocity[0] ** 2 + self.velocity[1] ** 2)
@@ -129,8 +142,10 @@ class ThrowingKnife(Projectile):
             self.world_position[0] += self.velocity[0] * time_delta
             self.world_position[1] += self.velocity[1] * time_delta
 
-            # set the position of the collision shape
-            self.collision_shape.set_position(self.world_position)
+            # set the position of the collision shape, it stops short if it hits something on the way
+            if self.collision_grid.move_shape(self.collision_shape, self.world_position) is not None:
+                self.world_position[0] = self.collision_shape.x
+                self.world_position[1] = self.collision_shape.y
 
         self.update_screen_position(camera)
         self.rect.centerx = int(self.screen_position[0])
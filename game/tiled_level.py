@@ -3,6 +3,10 @@ import csv
 import pygame
 from game.tile import Tile, TileData
 from game.collision_types import CollisionType
+from collision.collision_broadphase import GridBroadphase, SweepAndPruneBroadphase
+from collision.collision_shapes import CollisionRect, Edge
+from collision.collision_occluders import OccluderIndex
+from collision.drawable_collision_shapes import DrawableCollisionRect
 
 from game.enemy_archer import EnemyArcher
 
@@ -55,6 +59,9 @@ class TiledLevel:
 
         # TODO: ideally we would pull all the level setup stats from the header area of the level data file
         self.file_name = "data/test_level_0.csv"
+        # which broadphase the collision grid uses for this level, 'grid' or 'sweep_and_prune'. Can be set
+        # per level with a 'broadphase' line in the level data file.
+        self.broadphase_type = "grid"
 
         self.tile_size = (64, 64)  # size of an individual tile in pixels
         self.level_tile_size = world_grid_dimensions  # number of tiles in a level by x * y
@@ -76,6 +83,28 @@ class TiledLevel:
         self.all_tile_data = {}
         self.load_tile_data()
 
+        # Runs and rectangles of neighbouring tiles of these collision types get merged into single, larger,
+        # collision shapes so there is less for the collision grid and view cones to test against.
+        self.should_merge_tile_colliders = True
+        self.mergeable_collision_types = [CollisionType.WORLD_SOLID]
+        self.merged_tile_colliders = []
+        self.merged_colliders_by_tile = {}  # (layer name, tile x, tile y) to the merged collider covering that tile
+
+        # The outlines of the tiles of these collision types, as the longest straight segments we can make, for view
+        # cones to test against instead of every tile edge. Tile edges that face a neighbouring tile (the ones with
+        # should_skip normals) are left out, so only the outer boundaries remain. The spans tile edges cover are kept
+        # per line, a line being a side ('top', 'right', 'bottom' or 'left') and a position along the other axis, so
+        # an edit only has to re-merge the handful of lines its tiles touch.
+        self.occluder_collision_types = [CollisionType.WORLD_SOLID,
+                                         CollisionType.WORLD_JUMP_THROUGH,
+                                         CollisionType.WORLD_PLATFORM_EDGE,
+                                         CollisionType.WORLD_JUMP_THROUGH_EDGE]
+        self.occluder_index = OccluderIndex(self.tile_size[0])
+        self.occluder_spans_by_line = {}
+        self.occluder_lines_by_tile = {}
+        self.occluder_segments_by_line = {}
+        self.collision_grid.static_occluders = self.occluder_index
+
         self.tile_grid_layers = {}
         self.load_level_tiles()
 
@@ -100,6 +129,11 @@ class TiledLevel:
                     column.append(None)
                 tile_layer["grid"].append(column)
 
+        self.occluder_index.clear()
+        self.occluder_spans_by_line = {}
+        self.occluder_lines_by_tile = {}
+        self.occluder_segments_by_line = {}
+
     def reset_entities(self):
         """ Should put the entities in the level (e.g. enemies)  back to the state they started the level in """
         for entity in self.active_entity_list:
@@ -137,7 +171,12 @@ class TiledLevel:
     def draw_collision_shapes(self, screen, camera):
         for layer in self.tile_grid_layers.values():
             for tile in layer["sprite_group"].sprites():
-                tile.draw_collision_shapes(screen, camera)
+                # tiles that are part of a merged collider have no collision shape of their own in the grid
+                if tile.collision_shape is None or tile.collision_shape.grid_slot_index != -1:
+                    tile.draw_collision_shapes(screen, camera)
+        for merged_collider in self.merged_tile_colliders:
+            merged_collider["drawable"].update_collided_colours()
+            merged_collider["drawable"].draw(screen, camera.position, (camera.half_width, camera.half_height))
 
     def add_ai_spawn_at_screen_pos(self, screen_position, ai_spawn, camera):
         view_top_left_position = (camera.position[0] - camera.half_width,
@@ -182,8 +221,12 @@ class TiledLevel:
         if tile is not None:
             self.tile_grid_layers["layer_" + str(layer)]["sprite_group"].remove(tile)
             self.tile_grid_layers["layer_" + str(layer)]["grid"][tile_x][tile_y] = None
+            if tile.collision_shape is not None:
+                self.collision_grid.remove_static_shape_from_grid(tile.collision_shape)
 
             self.update_tile_collision_normals(tile_x, tile_y, layer)
+            self.update_occluders_around_tile(tile_x, tile_y, layer)
+            self.remerge_tile_colliders_around_tile(tile_x, tile_y, layer)
 
     def set_tile_at_screen_pos(self, camera, screen_position, tile_data_id, angle, layer):
         view_top_left_position = (camera.position[0] - camera.half_width,
@@ -197,6 +240,10 @@ class TiledLevel:
         tile_layer = self.tile_grid_layers["layer_" + str(layer)]
         tile_data = self.all_tile_data[tile_data_id]
 
+        old_tile = tile_layer["grid"][tile_x][tile_y]
+        if old_tile is not None and old_tile.collision_shape is not None:
+            self.collision_grid.remove_static_shape_from_grid(old_tile.collision_shape)
+
         new_tile = Tile(tile_layer["sprite_group"], self.collision_grid, tile_data,
                         [(tile_x * self.tile_size[0]) + half_tile_size[0],
                          (tile_y * self.tile_size[1]) + half_tile_size[1]],
@@ -204,6 +251,8 @@ class TiledLevel:
         tile_layer["grid"][tile_x][tile_y] = new_tile
 
         self.update_tile_collision_normals(tile_x, tile_y, layer)
+        self.update_occluders_around_tile(tile_x, tile_y, layer)
+        self.remerge_tile_colliders_around_tile(tile_x, tile_y, layer)
 
     """ This method is stupidly complicated and probably needs trimming down.
     
@@ -216,14 +265,17 @@ class TiledLevel:
                                      CollisionType.WORLD_PLATFORM_EDGE,
                                      CollisionType.WORLD_JUMP_THROUGH_EDGE]
 
+        # the normals we are about to change decide which tile edges block line of sight
+        self.collision_grid.static_geometry_version += 1
+
         tile_to_update = self.tile_grid_layers["layer_" + str(layer)]["grid"][tile_x][tile_y]
 
         if tile_to_update is not None:
             # initialise to False
-            tile_to_update.collision_shape.normals["left"].should_skip = False
-            tile_to_update.collision_shape.normals["right"].should_skip = False
-            tile_to_update.collision_shape.normals["top"].should_skip = False
-            tile_to_update.collision_shape.normals["bottom"].should_skip = False
+            tile_to_update.collision_shape.set_normal_should_skip("left", False)
+            tile_to_update.collision_shape.set_normal_should_skip("right", False)
+            tile_to_update.collision_shape.set_normal_should_skip("top", False)
+            tile_to_update.collision_shape.set_normal_should_skip("bottom", False)
 
             if tile_to_update.tile_data.collision_type in collision_types_to_adjust:
                 left_tile_x = tile_x - 1
@@ -231,32 +283,32 @@ class TiledLevel:
                     left_tile = self.tile_grid_layers["layer_" + str(layer)]["grid"][left_tile_x][tile_y]
                     if left_tile is not None:
                         if left_tile.tile_data.collision_type in collision_types_to_adjust:
-                            tile_to_update.collision_shape.normals["left"].should_skip = True
-                            left_tile.collision_shape.normals["right"].should_skip = True
+                            tile_to_update.collision_shape.set_normal_should_skip("left", True)
+                            left_tile.collision_shape.set_normal_should_skip("right", True)
 
                 right_tile_x = tile_x + 1
                 if right_tile_x < self.level_tile_size[0]:
                     right_tile = self.tile_grid_layers["layer_" + str(layer)]["grid"][right_tile_x][tile_y]
                     if right_tile is not None:
                         if right_tile.tile_data.collision_type in collision_types_to_adjust:
-                            tile_to_update.collision_shape.normals["right"].should_skip = True
-                            right_tile.collision_shape.normals["left"].should_skip = True
+                            tile_to_update.collision_shape.set_normal_should_skip("right", True)
+                            right_tile.collision_shape.set_normal_should_skip("left", True)
 
                 top_tile_y = tile_y - 1
                 if top_tile_y > 0:
                     top_tile = self.tile_grid_layers["layer_" + str(layer)]["grid"][tile_x][top_tile_y]
                     if top_tile is not None:
                         if top_tile.tile_data.collision_type in collision_types_to_adjust:
-                            tile_to_update.collision_shape.normals["top"].should_skip = True
-                            top_tile.collision_shape.normals["bottom"].should_skip = True
+                            tile_to_update.collision_shape.set_normal_should_skip("top", True)
+                            top_tile.collision_shape.set_normal_should_skip("bottom", True)
 
                 bottom_tile_y = tile_y + 1
                 if bottom_tile_y < self.level_tile_size[1]:
                     bottom_tile = self.tile_grid_layers["layer_" + str(layer)]["grid"][tile_x][bottom_tile_y]
                     if bottom_tile is not None:
                         if bottom_tile.tile_data.collision_type in collision_types_to_adjust:
-                            tile_to_update.collision_shape.normals["bottom"].should_skip = True
-                            bottom_tile.collision_shape.normals["top"].should_skip = True
+                            tile_to_update.collision_shape.set_normal_should_skip("bottom", True)
+                            bottom_tile.collision_shape.set_normal_should_skip("top", True)
 
         elif tile_to_update is None or tile_to_update.tile_data.collision_type not in collision_types_to_adjust:
             left_tile_x = tile_x - 1
@@ -264,32 +316,331 @@ class TiledLevel:
                 left_tile = self.tile_grid_layers["layer_" + str(layer)]["grid"][left_tile_x][tile_y]
                 if left_tile is not None:
                     if left_tile.tile_data.collision_type in collision_types_to_adjust:
-                        left_tile.collision_shape.normals["right"].should_skip = False
+                        left_tile.collision_shape.set_normal_should_skip("right", False)
 
             right_tile_x = tile_x + 1
             if right_tile_x < self.level_tile_size[0]:
                 right_tile = self.tile_grid_layers["layer_" + str(layer)]["grid"][right_tile_x][tile_y]
                 if right_tile is not None:
                     if right_tile.tile_data.collision_type in collision_types_to_adjust:
-                        right_tile.collision_shape.normals["left"].should_skip = False
+                        right_tile.collision_shape.set_normal_should_skip("left", False)
 
             top_tile_y = tile_y - 1
             if top_tile_y > 0:
                 top_tile = self.tile_grid_layers["layer_" + str(layer)]["grid"][tile_x][top_tile_y]
                 if top_tile is not None:
                     if top_tile.tile_data.collision_type in collision_types_to_adjust:
-                        top_tile.collision_shape.normals["bottom"].should_skip = False
+                        top_tile.collision_shape.set_normal_should_skip("bottom", False)
 
             bottom_tile_y = tile_y + 1
             if bottom_tile_y < self.level_tile_size[1]:
                 bottom_tile = self.tile_grid_layers["layer_" + str(layer)]["grid"][tile_x][bottom_tile_y]
                 if bottom_tile is not None:
                     if bottom_tile.tile_data.collision_type in collision_types_to_adjust:
-                        bottom_tile.collision_shape.normals["top"].should_skip = False
+                        bottom_tile.collision_shape.set_normal_should_skip("top", False)
+
+    def build_occluders(self):
+        """
+        Work out the merged occluder outlines of the whole level from scratch.
+        """
+        changed_lines = set()
+        for layer_name, tile_layer in self.tile_grid_layers.items():
+            layer = int(layer_name[len("layer_"):])
+            for tile_x in range(0, self.level_tile_size[0]):
+                for tile_y in range(0, self.level_tile_size[1]):
+                    changed_lines.update(self.update_tile_occluder_spans(tile_x, tile_y, layer))
+        self.merge_occluder_lines(changed_lines)
+
+    def update_occluders_around_tile(self, tile_x, tile_y, layer):
+        """
+        Refresh the occluder outlines after a tile is added, removed or changed. The should_skip normals of its four
+        neighbours may have changed along with it so their spans are refreshed too.
+        """
+        changed_lines = set()
+        for neighbour_x, neighbour_y in ((tile_x, tile_y), (tile_x - 1, tile_y), (tile_x + 1, tile_y),
+                                         (tile_x, tile_y - 1), (tile_x, tile_y + 1)):
+            if 0 <= neighbour_x < self.level_tile_size[0] and 0 <= neighbour_y < self.level_tile_size[1]:
+                changed_lines.update(self.update_tile_occluder_spans(neighbour_x, neighbour_y, layer))
+        self.merge_occluder_lines(changed_lines)
+
+    def update_tile_occluder_spans(self, tile_x, tile_y, layer):
+        """
+        Swap the spans a tile location used to add to the occluder lines for the ones its tile adds now.
+
+        :return: the keys of the lines that changed.
+        """
+        tile_key = (layer, tile_x, tile_y)
+        changed_lines = set(self.occluder_lines_by_tile.pop(tile_key, []))
+        for line_key in changed_lines:
+            del self.occluder_spans_by_line[line_key][tile_key]
+
+        tile = self.tile_grid_layers["layer_" + str(layer)]["grid"][tile_x][tile_y]
+        if (tile is None or tile.collision_shape is None or
+                tile.tile_data.collision_type not in self.occluder_collision_types):
+            return changed_lines
+
+        tile_lines = []
+        tile.collision_shape.update_bounds_if_needed()
+        for edge in tile.collision_shape.edges.values():
+            if tile.collision_shape.normals[edge.name].should_skip:
+                continue
+            if edge.name == "top" or edge.name == "bottom":
+                line_key = (edge.name, round(edge.a.y, 3))
+                span = (min(edge.a.x, edge.b.x), max(edge.a.x, edge.b.x))
+            else:
+                line_key = (edge.name, round(edge.a.x, 3))
+                span = (min(edge.a.y, edge.b.y), max(edge.a.y, edge.b.y))
+            if line_key not in self.occluder_spans_by_line:
+                self.occluder_spans_by_line[line_key] = {}
+            self.occluder_spans_by_line[line_key][tile_key] = span
+            tile_lines.append(line_key)
+            changed_lines.add(line_key)
+        self.occluder_lines_by_tile[tile_key] = tile_lines
+        return changed_lines
+
+    def merge_occluder_lines(self, line_keys):
+        """
+        Replace the occluder segments along some lines with new ones, made by joining up the spans on each line
+        that touch or overlap.
+        """
+        for line_key in line_keys:
+            for segment in self.occluder_segments_by_line.pop(line_key, []):
+                self.occluder_index.remove_segment(segment)
+
+            spans = sorted(self.occluder_spans_by_line.get(line_key, {}).values())
+            if len(spans) == 0:
+                self.occluder_spans_by_line.pop(line_key, None)
+                continue
+
+            merged_spans = [list(spans[0])]
+            for span_start, span_end in spans[1:]:
+                if span_start <= merged_spans[-1][1] + 0.001:
+                    merged_spans[-1][1] = max(merged_spans[-1][1], span_end)
+                else:
+                    merged_spans.append([span_start, span_end])
+
+            side, position = line_key
+            segments = []
+            for span_start, span_end in merged_spans:
+                # wound clockwise around the solid side, the same way a CollisionRect's edges are
+                if side == "top":
+                    a_end, b_end = (span_start, position), (span_end, position)
+                elif side == "right":
+                    a_end, b_end = (position, span_start), (position, span_end)
+                elif side == "bottom":
+                    a_end, b_end = (span_end, position), (span_start, position)
+                else:
+                    a_end, b_end = (position, span_end), (position, span_start)
+                segment = Edge(side, pygame.math.Vector2(a_end), pygame.math.Vector2(b_end))
+                self.occluder_index.add_segment(segment)
+                segments.append(segment)
+            self.occluder_segments_by_line[line_key] = segments
+
+    def set_broadphase_type(self, broadphase_type):
+        if broadphase_type == self.broadphase_type:
+            return
+        if broadphase_type == "sweep_and_prune":
+            self.collision_grid.set_broadphase(SweepAndPruneBroadphase())
+        elif broadphase_type == "grid":
+            multi_cell_insertion = getattr(self.collision_grid.broadphase, "multi_cell_insertion", False)
+            self.collision_grid.set_broadphase(GridBroadphase(self.collision_grid.grid_square_pixel_size,
+                                                              multi_cell_insertion))
+        else:
+            raise ValueError("Unknown broadphase type: " + broadphase_type)
+        self.broadphase_type = broadphase_type
+
+    def get_mergeable_tile_collider(self, tile_grid, tile_x, tile_y):
+        """
+        The collision type and world space collision rect of the tile at a grid position, if it is a tile we
+        can merge with its neighbours.
+        """
+        tile = tile_grid[tile_x][tile_y]
+        if (tile is None or tile.collision_shape is None or
+                tile.tile_data.collision_type not in self.mergeable_collision_types or
+                len(tile.tile_data.collision_shapes) != 1 or tile.tile_data.collision_shapes[0][0] != "rect"):
+            return None
+        tile_rect = tile.tile_data.collision_shapes[0][2].move(tile_x * self.tile_size[0],
+                                                               tile_y * self.tile_size[1])
+        return tile.tile_data.collision_type, tile_rect
+
+    @staticmethod
+    def is_tile_position_free_to_merge(tile_position, merged_tile_positions, area_tile_positions):
+        return (tile_position not in merged_tile_positions and
+                (area_tile_positions is None or tile_position in area_tile_positions))
+
+    def get_mergeable_tile_run(self, tile_grid, start_tile_x, end_tile_x, tile_y, merged_tile_positions,
+                               area_tile_positions=None):
+        """
+        The collision type and world space rect covered by a horizontal run of tiles, if every tile in the run can
+        be merged with its neighbours into one rectangle.
+        """
+        run_type = None
+        run_rect = None
+        for tile_x in range(start_tile_x, end_tile_x + 1):
+            if not self.is_tile_position_free_to_merge((tile_x, tile_y), merged_tile_positions, area_tile_positions):
+                return None
+            tile_collider = self.get_mergeable_tile_collider(tile_grid, tile_x, tile_y)
+            if tile_collider is None:
+                return None
+            tile_type, tile_rect = tile_collider
+            if run_rect is None:
+                run_type = tile_type
+                run_rect = tile_rect
+            elif (tile_type == run_type and tile_rect.left == run_rect.right and
+                    tile_rect.top == run_rect.top and tile_rect.height == run_rect.height):
+                run_rect.width += tile_rect.width
+            else:
+                return None
+        return run_type, run_rect
+
+    def merge_tile_colliders(self):
+        """
+        Greedily merge the collision shapes of neighbouring tiles of the same mergeable type, across the whole level.
+        The tiles' own collision shapes are taken out of the collision grid while they are part of a merged shape.
+
+        Called after loading. Edits only re-merge the area around the edited tile, see
+        remerge_tile_colliders_around_tile().
+        """
+        self.unmerge_tile_colliders()
+        if not self.should_merge_tile_colliders or not self.collision_grid.broadphase.supports_large_static_shapes:
+            return
+        for layer_name in self.tile_grid_layers:
+            self.merge_tile_colliders_in_area(layer_name, None)
+
+    def remerge_tile_colliders_around_tile(self, tile_x, tile_y, layer):
+        """
+        Bring the merged colliders up to date after a tile is added, removed or changed. Only the merged colliders
+        that cover the tile, or the neighbours along its row and column (whose normals the edit may have changed),
+        are taken apart, and the merge is redone over just the tiles they covered and those neighbours.
+        """
+        if not self.should_merge_tile_colliders or not self.collision_grid.broadphase.supports_large_static_shapes:
+            return
+        layer_name = "layer_" + str(layer)
+        area_tile_positions = set()
+        for neighbour_x, neighbour_y in ((tile_x, tile_y), (tile_x - 1, tile_y), (tile_x + 1, tile_y),
+                                         (tile_x, tile_y - 1), (tile_x, tile_y + 1)):
+            if 0 <= neighbour_x < self.level_tile_size[0] and 0 <= neighbour_y < self.level_tile_size[1]:
+                area_tile_positions.add((neighbour_x, neighbour_y))
+                merged_collider = self.merged_colliders_by_tile.get((layer_name, neighbour_x, neighbour_y))
+                if merged_collider is not None:
+                    area_tile_positions.update(merged_collider["tile_positions"])
+                    self.unmerge_tile_collider(merged_collider)
+                    self.merged_tile_colliders.remove(merged_collider)
+        self.merge_tile_colliders_in_area(layer_name, area_tile_positions)
+
+    def merge_tile_colliders_in_area(self, layer_name, area_tile_positions):
+        """
+        Greedily merge tile colliders on one layer. We take the longest run we can along a row, then grow it down as
+        many rows as have a matching run beneath.
+
+        :param layer_name: the tile layer to merge.
+        :param area_tile_positions: a set of the (x, y) tile positions that may be merged, none of which should be
+                                    part of a merged collider already; or None to merge the whole layer.
+        """
+        tile_grid = self.tile_grid_layers[layer_name]["grid"]
+        if area_tile_positions is None:
+            start_positions = [(tile_x, tile_y) for tile_y in range(0, self.level_tile_size[1])
+                               for tile_x in range(0, self.level_tile_size[0])]
+        else:
+            start_positions = sorted(area_tile_positions,
+                                     key=lambda tile_position: (tile_position[1], tile_position[0]))
+
+        merged_tile_positions = set()
+        for tile_x, tile_y in start_positions:
+            run = self.get_mergeable_tile_run(tile_grid, tile_x, tile_x, tile_y, merged_tile_positions,
+                                              area_tile_positions)
+            if run is None:
+                continue
+
+            # grow the run a tile at a time, rather than re-checking the whole run for each tile we add
+            collision_type, merged_rect = run
+            end_tile_x = tile_x
+            while end_tile_x + 1 < self.level_tile_size[0]:
+                next_tile_run = self.get_mergeable_tile_run(tile_grid, end_tile_x + 1, end_tile_x + 1, tile_y,
+                                                            merged_tile_positions, area_tile_positions)
+                if (next_tile_run is None or next_tile_run[0] != collision_type or
+                        next_tile_run[1].left != merged_rect.right or next_tile_run[1].top != merged_rect.top or
+                        next_tile_run[1].height != merged_rect.height):
+                    break
+                merged_rect.width += next_tile_run[1].width
+                end_tile_x += 1
+
+            end_tile_y = tile_y
+            while end_tile_y + 1 < self.level_tile_size[1]:
+                run_below = self.get_mergeable_tile_run(tile_grid, tile_x, end_tile_x, end_tile_y + 1,
+                                                        merged_tile_positions, area_tile_positions)
+                if (run_below is None or run_below[0] != collision_type or
+                        run_below[1].left != merged_rect.left or run_below[1].width != merged_rect.width or
+                        run_below[1].top != merged_rect.bottom):
+                    break
+                merged_rect.height += run_below[1].height
+                end_tile_y += 1
+
+            tile_positions = []
+            for merged_tile_y in range(tile_y, end_tile_y + 1):
+                for merged_tile_x in range(tile_x, end_tile_x + 1):
+                    tile_positions.append((merged_tile_x, merged_tile_y))
+                    merged_tile_positions.add((merged_tile_x, merged_tile_y))
+
+            if len(tile_positions) > 1:
+                self.add_merged_tile_collider(layer_name, tile_grid, tile_positions, collision_type, merged_rect)
+
+    def add_merged_tile_collider(self, layer_name, tile_grid, tile_positions, collision_type, merged_rect):
+        tiles = [tile_grid[tile_x][tile_y] for tile_x, tile_y in tile_positions]
+        for tile in tiles:
+            self.collision_grid.remove_static_shape_from_grid(tile.collision_shape)
+
+        first_tile_shape = tiles[0].collision_shape
+        merged_shape = CollisionRect(merged_rect, 0, dict(first_tile_shape.handlers_by_colliding_game_type),
+                                     collision_type, list(first_tile_shape.game_types_to_collide))
+        merged_shape.fit_aabb_to_rect()
+
+        # a side of the merged shape only skips collision reactions if every tile along that side did
+        start_tile_x, start_tile_y = tile_positions[0]
+        end_tile_x, end_tile_y = tile_positions[-1]
+        side_tile_positions = {"top": [(tile_x, start_tile_y) for tile_x in range(start_tile_x, end_tile_x + 1)],
+                               "bottom": [(tile_x, end_tile_y) for tile_x in range(start_tile_x, end_tile_x + 1)],
+                               "left": [(start_tile_x, tile_y) for tile_y in range(start_tile_y, end_tile_y + 1)],
+                               "right": [(end_tile_x, tile_y) for tile_y in range(start_tile_y, end_tile_y + 1)]}
+        for side, positions in side_tile_positions.items():
+            merged_shape.set_normal_should_skip(side, all(
+                tile_grid[tile_x][tile_y].collision_shape.normals[side].should_skip for tile_x, tile_y in positions))
+
+        self.collision_grid.add_static_grid_aligned_shape_to_grid(merged_shape)
+        merged_shape.owner = tiles[0]
+        merged_collider = {"shape": merged_shape,
+                           "layer_name": layer_name,
+                           "tile_grid": tile_grid,
+                           "tile_positions": tile_positions,
+                           "tiles": tiles,
+                           "drawable": DrawableCollisionRect(merged_shape)}
+        self.merged_tile_colliders.append(merged_collider)
+        for tile_x, tile_y in tile_positions:
+            self.merged_colliders_by_tile[(layer_name, tile_x, tile_y)] = merged_collider
+
+    def unmerge_tile_collider(self, merged_collider):
+        """
+        Take a merged collider out of the collision grid and put back the collision shapes of the tiles it covered.
+        Leaves removing it from merged_tile_colliders to the caller.
+        """
+        self.collision_grid.remove_static_shape_from_grid(merged_collider["shape"])
+        tile_grid = merged_collider["tile_grid"]
+        for tile, tile_position in zip(merged_collider["tiles"], merged_collider["tile_positions"]):
+            del self.merged_colliders_by_tile[(merged_collider["layer_name"], tile_position[0], tile_position[1])]
+            # tiles that have since been removed from the level stay out of the collision grid
+            if tile_grid[tile_position[0]][tile_position[1]] is tile:
+                self.collision_grid.add_static_grid_aligned_shape_to_grid(tile.collision_shape)
+
+    def unmerge_tile_colliders(self):
+        for merged_collider in self.merged_tile_colliders:
+            self.unmerge_tile_collider(merged_collider)
+        self.merged_tile_colliders[:] = []
 
     def save_tiles(self):
         with open(self.file_name, "w", newline='') as tileFile:
             writer = csv.writer(tileFile)
+            if self.broadphase_type != "grid":
+                writer.writerow(["broadphase", self.broadphase_type])
             for tile_layer in self.tile_grid_layers.values():
                 for tile_x in range(0, self.level_tile_size[0]):
                     for tile_y in range(0, self.level_tile_size[1]):
@@ -310,7 +661,10 @@ class TiledLevel:
                 for line in reader:
                     line_type = line[0]
 
-                    if line_type == "tile":
+                    if line_type == "broadphase":
+                        self.set_broadphase_type(line[1])
+
+                    elif line_type == "tile":
                         tile_id = line[1]
                         tile_x_pos = float(line[2])
                         tile_y_pos = float(line[3])
@@ -341,3 +695,6 @@ class TiledLevel:
                             new_entity_placement = AISpawn([tile_x_pos, tile_y_pos],
                                                            type_id, sub_type_id, self.ai_spawn_data)
                             self.entity_placements.append(new_entity_placement)
+
+            self.build_occluders()
+            self.merge_tile_colliders()
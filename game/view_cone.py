@@ -1,34 +1,61 @@
 import pygame
 import random
 import math
-import functools
+import bisect
+from collections import OrderedDict
 from pygame.math import Vector2
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from collision.collision_handling import CollisionNoHandler
-from collision.collision_shapes import CollisionRect, CollisionCircle, BaseCollisionShape, Edge
-from collision.drawable_collision_shapes import DrawableCollisionRect, DrawableCollisionCircle
+from collision.collision_shapes import CollisionRect, BaseCollisionShape, Edge
+from collision.drawable_collision_shapes import DrawableCollisionRect
 from game.collision_types import CollisionType
-from collision.collision_funcs import collide_circle_with_rotated_rectangle
+from collision.collision_grid import CollisionGrid
 
 
 class AnglePointSet:
     def __init__(self):
         self.points = []
         self.epsilon = 0.075
+        # the point groups hashed by their primary point's coordinates, rounded down to a multiple of epsilon. Any
+        # point within epsilon of a new one has to be in one of the nine cells around it, so that's all add() checks.
+        self.point_groups_by_cell = {}
+
+    def get_cell(self, point):
+        return int(math.floor(point.x / self.epsilon)), int(math.floor(point.y / self.epsilon))
 
     def add_aux(self, index, aux_point):
         self.points[index].append(aux_point)
 
     def add(self, new_point):
-        already_have_point = False
-        for point_group in self.points:
-            point = point_group[0]
-            if abs(new_point.x - point.x) < self.epsilon and abs(new_point.y - point.y) < self.epsilon:
-                already_have_point = True
-        if not already_have_point:
-            self.points.append([new_point])
+        cell_x, cell_y = self.get_cell(new_point)
+        for neighbour_x in (cell_x - 1, cell_x, cell_x + 1):
+            for neighbour_y in (cell_y - 1, cell_y, cell_y + 1):
+                for point_group in self.point_groups_by_cell.get((neighbour_x, neighbour_y), ()):
+                    point = point_group[0]
+                    if abs(new_point.x - point.x) < self.epsilon and abs(new_point.y - point.y) < self.epsilon:
+                        return len(self.points) - 1
+
+        point_group = [new_point]
+        self.points.append(point_group)
+        if (cell_x, cell_y) not in self.point_groups_by_cell:
+            self.point_groups_by_cell[(cell_x, cell_y)] = []
+        self.point_groups_by_cell[(cell_x, cell_y)].append(point_group)
         return len(self.points) - 1
 
+    def remove_points(self, points_to_remove):
+        self.points = [point_group for point_group in self.points if point_group[0] not in points_to_remove]
+        self.point_groups_by_cell = {}
+        for point_group in self.points:
+            cell = self.get_cell(point_group[0])
+            if cell not in self.point_groups_by_cell:
+                self.point_groups_by_cell[cell] = []
+            self.point_groups_by_cell[cell].append(point_group)
+
 
 class ViewCone:
     class PointInConeStatus:
@@ -42,7 +69,7 @@ class ViewCone:
         PARALLEL = 1,
         INTERSECT = 2
 
-    def __init__(self, origin_centre_pos, facing_direction, fov=90.0, length=1000.0):
+    def __init__(self, origin_centre_pos, facing_direction, collision_grid, fov=90.0, length=1000.0):
 
         self.facing_direction = Vector2(facing_direction[:])
         self.origin_centre_position = Vector2(origin_centre_pos[:])
@@ -53,23 +80,16 @@ class ViewCone:
 
         self.epsilon = 0.075  # to handle floating point inaccuracy at small values (I think)
         self.arc_epsilon = 1.5  # to handle small gaps between arc points
+        # how far, in radians, to widen the range of angles each edge covers when sweeping rays across them
+        self.sweep_angle_margin = 1e-3
         self.halfAuxRayTilt = 8.72664625995e-3 # half degree in radians
         self.half_aux_ray_tilt_cos = math.cos(self.halfAuxRayTilt)  # 0.999961923064
         self.half_aux_ray_tilt_sin = math.sin(self.halfAuxRayTilt)  # 8.72653549837e-3
 
-        self.collision_circle = CollisionCircle(self.origin_centre_position.x,
-                                                self.origin_centre_position.y,
-                                                self.length,
-                                                {CollisionType.WORLD_SOLID: CollisionNoHandler(),
-                                                 CollisionType.WORLD_JUMP_THROUGH: CollisionNoHandler(),
-                                                 CollisionType.WORLD_PLATFORM_EDGE: CollisionNoHandler(),
-                                                 CollisionType.WORLD_JUMP_THROUGH_EDGE: CollisionNoHandler()},
-                                                CollisionType.VIEW_CONE,
-                                                [CollisionType.WORLD_SOLID,
-                                                 CollisionType.WORLD_JUMP_THROUGH,
-                                                 CollisionType.WORLD_PLATFORM_EDGE,
-                                                 CollisionType.WORLD_JUMP_THROUGH_EDGE]
-                                                )
+        # the world geometry that blocks our view, looked up from the collision grid each time we update
+        self.collision_grid = collision_grid
+        self.blocking_game_types = (CollisionType.WORLD_SOLID | CollisionType.WORLD_JUMP_THROUGH |
+                                    CollisionType.WORLD_PLATFORM_EDGE | CollisionType.WORLD_JUMP_THROUGH_EDGE)
 
         self.neg_cos_fov = math.cos(-self.field_of_view / 2)
         self.neg_sin_fov = math.sin(-self.field_of_view / 2)
@@ -84,6 +104,15 @@ class ViewCone:
         self.ctrl_points = []
         self.blocking_edges = []
 
+        # The results of recent updates, keyed on our pose and the version of the static geometry they were worked out
+        # from, most recently used last. Cones that stand still, or patrol back and forth, keep seeing the same
+        # things so they can skip straight to the answer. Positions are rounded to the nearest pose_quantum pixels
+        # and facings to the nearest facing_quantum when making keys.
+        self.results_by_pose = OrderedDict()
+        self.max_cached_poses = 16
+        self.pose_quantum = 1.0
+        self.facing_quantum = 0.001
+
         self.perp_facing_vec = None
         self.cone_extent_facings = None
         self.on_cone_changed_direction()
@@ -129,7 +158,6 @@ class ViewCone:
             self.origin_centre_position.x = position.x
             self.origin_centre_position.y = position.y
             self.on_cone_moved()
-            self.collision_circle.set_position((self.origin_centre_position.x, self.origin_centre_position.y))
 
     def is_point_in_sector(self, point_to_test):
         """
@@ -218,6 +246,7 @@ class ViewCone:
         return True
 
     def check_polygon(self, polygon, angle_points, blocking_edges):
+        polygon.update_bounds_if_needed()
         edges_list = [edge for edge in polygon.edges.values()
                       if self.edge_within_radius(edge) and self.is_active_facing_edge(polygon, edge)]
         n = len(edges_list)
@@ -227,108 +256,130 @@ class ViewCone:
             prev_edge = None
         for i in range(0, len(edges_list)):
             edge = edges_list[i]
+            # for the last edge, send undefined as nextEdge to
+            # addAnglePointWithAux; it should never get used since
+            # both endpoints of the last edge would be handled by now
+            # due to edges 0 and n − 2
+            if i < len(edges_list) - 1:
+                next_edge = edges_list[i + 1]
+            else:
+                next_edge = None
+            self.check_edge(edge, prev_edge, next_edge, angle_points, blocking_edges)
+            prev_edge = edge
 
-            point_a_status = self.is_point_in_sector(edge.a)
-            point_b_status = self.is_point_in_sector(edge.b)
-            if point_a_status == ViewCone.PointInConeStatus.BEHIND and point_b_status == ViewCone.PointInConeStatus.BEHIND:
-                continue
+    def check_occluders(self, occluders, angle_points, blocking_edges):
+        """
+        Like check_polygon, but for the merged outline segments in an OccluderIndex. Each segment's neighbours come
+        from the index, rather than from the shape it belongs to, so the corners where two outline segments meet
+        get the right auxiliary rays.
 
-            if point_a_status == ViewCone.PointInConeStatus.WITHIN and point_b_status == ViewCone.PointInConeStatus.WITHIN:
+        :param occluders: an OccluderIndex.
+        """
+        view_rect = pygame.Rect(0, 0, int(self.length * 2) + 2, int(self.length * 2) + 2)
+        view_rect.center = (int(self.origin_centre_position.x), int(self.origin_centre_position.y))
+        for edge in occluders.get_segments_in_aabb(view_rect):
+            if self.edge_within_radius(edge):
+                self.check_edge(edge, occluders.get_previous_segment(edge), occluders.get_next_segment(edge),
+                                angle_points, blocking_edges)
 
-                self.add_angle_point_with_aux(edge.a, prev_edge, edge, angle_points)
+    def check_edge(self, edge, prev_edge, next_edge, angle_points, blocking_edges):
+        point_a_status = self.is_point_in_sector(edge.a)
+        point_b_status = self.is_point_in_sector(edge.b)
+        if point_a_status == ViewCone.PointInConeStatus.BEHIND and point_b_status == ViewCone.PointInConeStatus.BEHIND:
+            return
 
-                # for the last edge, send undefined as nextEdge to
-                # addAnglePointWithAux; it should never get used since
-                # both endpoints of the last edge would be handled by now
-                # due to edges 0 and n − 2
-                if i < len(edges_list) - 1:
-                    self.add_angle_point_with_aux(edge.b, edge, edges_list[i + 1], angle_points)
-                else:
-                    self.add_angle_point_with_aux(edge.b, edge, None, angle_points)
+        if point_a_status == ViewCone.PointInConeStatus.WITHIN and point_b_status == ViewCone.PointInConeStatus.WITHIN:
+
+            self.add_angle_point_with_aux_for_edge_a(edge, prev_edge, angle_points)
+            self.add_angle_point_with_aux(edge.b, edge, next_edge, angle_points)
+            blocking_edges.append(edge)
+
+        else:
+            """
+            ANGLE POINTS
+            Either one or both the points are outside the sector; add
+            the one which is inside. Perform edge – arc intersection
+            test, if this edge has a possibility of intersecting the
+            arc, add resultant intersection point(s) to angle_points.
+
+            BLOCKING EDGE
+            If one of the points is inside, then the edge is blocking,
+            add it without any checks. If one or both are out, and the
+            edge cuts the sector's arc then too the edge is blocking,
+            add it to blocking_edges. If both are out and edge doesn't
+            cut the arc, check if it cuts one of the sector's edges and
+            add to blocking_edges if it does.
+            """
+            blocking = False
+            if point_a_status == ViewCone.PointInConeStatus.WITHIN:
+                self.add_angle_point_with_aux_for_edge_a(edge, prev_edge, angle_points)
+                blocking = True
+            if point_b_status == ViewCone.PointInConeStatus.WITHIN:
+                self.add_angle_point_with_aux(edge.b, edge, next_edge, angle_points)
+                blocking = True
+
+            edge_may_intersect_arc = (point_a_status == ViewCone.PointInConeStatus.OUTSIDE or
+                                      point_b_status == ViewCone.PointInConeStatus.OUTSIDE)
+
+            test_seg_seg_xsect = True
+            if edge_may_intersect_arc:
+                # perform line segment – sector arc intersection test to
+                # check if there're more angle points i.e. if the edge
+                # intersects the sector's arc then the intersection points
+                # would also become angle points.
+                arc_xsect_result = self.line_seg_arc_x_sect(edge)
+                if arc_xsect_result is not None:
+                    if arc_xsect_result['config'] == ViewCone.PointInConeStatus.WITHIN:
+                        # just add intersection point to Set without any
+                        # auxiliarys as it's an intersection angle point
+                        for point in arc_xsect_result['points']:
+                            angle_points.add(point)
+                        blocking = True
+
+                    # edge – edge intersection test is not needed when the
+                    # intersection point(s) are within or behind; the
+                    # within case is ignored since it's already blocking
+                    # and hence won't reach the lineSegLineSegXsect code
+                    test_seg_seg_xsect = arc_xsect_result['config'] != ViewCone.PointInConeStatus.BEHIND
+
+            # If there was an angle point added due to this edge, then it
+            # is blocking; add and continue to avoid further processing.
+            if blocking:
+                blocking_edges.append(edge)
+            elif test_seg_seg_xsect and \
+                    any([fov_edge for fov_edge in self.fov_edges
+                         if self.edges_intersect(fov_edge, edge)]):
                 blocking_edges.append(edge)
 
-            else:
                 """
-                ANGLE POINTS
-                Either one or both the points are outside the sector; add
-                the one which is inside. Perform edge – arc intersection
-                test, if this edge has a possibility of intersecting the
-                arc, add resultant intersection point(s) to angle_points.
-
-                BLOCKING EDGE
-                If one of the points is inside, then the edge is blocking,
-                add it without any checks. If one or both are out, and the
-                edge cuts the sector's arc then too the edge is blocking,
-                add it to blocking_edges. If both are out and edge doesn't
-                cut the arc, check if it cuts one of the sector's edges and
-                add to blocking_edges if it does.
+                If any angle point(s) would occur because of this edge, they
+                would have been found by now and the edge would have been
+                tagged as a blocking one. Even if no angle points were found
+                due to this edge it still may be a blocking, or not. Perform
+                a couple of segment – segment intersection tests with the
+                sector's edges to check if the edge is indeed blocking. This
+                is worth the expenditure incurred; say we have 10 angle
+                points, for every redundant, non-blocking edge added without
+                such a check means we waste time in performing 10 futile
+                line segment intersection tests. Prune them early on by
+                performing the tests beforehand.
+
+                Perform segment – segment testing if testSegSegXsect is
+                true; this will be so if the arc intersection was never
+                performed (say when both points are in FrontSemicircle and
+                their edge occluding vision) or if the intersection points
+                aren't behind the sector; there can be cases where not both
+                points are behind (if so they'd have gotten pruned by now),
+                but the intersection points are behind, prune them.
                 """
-                blocking = False
-                if point_a_status == ViewCone.PointInConeStatus.WITHIN:
-                    self.add_angle_point_with_aux(edge.a, prev_edge, edge, angle_points)
-                    blocking = True
-                if point_b_status == ViewCone.PointInConeStatus.WITHIN:
-                    if i < len(edges_list) - 1:
-                        self.add_angle_point_with_aux(edge.b, edge, edges_list[i+1], angle_points)
-                    else:
-                        self.add_angle_point_with_aux(edge.b, edge, None, angle_points)
-                    blocking = True
-
-                edge_may_intersect_arc = point_a_status == ViewCone.PointInConeStatus.OUTSIDE or point_b_status == ViewCone.PointInConeStatus.OUTSIDE
-
-                test_seg_seg_xsect = True
-                if edge_may_intersect_arc:
-                    # perform line segment – sector arc intersection test to
-                    # check if there're more angle points i.e. if the edge
-                    # intersects the sector's arc then the intersection points
-                    # would also become angle points.
-                    arc_xsect_result = self.line_seg_arc_x_sect(edge)
-                    if arc_xsect_result is not None:
-                        if arc_xsect_result['config'] == ViewCone.PointInConeStatus.WITHIN:
-                            # just add intersection point to Set without any
-                            # auxiliarys as it's an intersection angle point
-                            for point in arc_xsect_result['points']:
-                                angle_points.add(point)
-                            blocking = True
-
-                        # edge – edge intersection test is not needed when the
-                        # intersection point(s) are within or behind; the
-                        # within case is ignored since it's already blocking
-                        # and hence won't reach the lineSegLineSegXsect code
-                        test_seg_seg_xsect = arc_xsect_result['config'] != ViewCone.PointInConeStatus.BEHIND
-
-                # If there was an angle point added due to this edge, then it
-                # is blocking; add and continue to avoid further processing.
-                if blocking:
-                    blocking_edges.append(edge)
-                elif test_seg_seg_xsect and \
-                        any([fov_edge for fov_edge in self.fov_edges
-                             if self.edges_intersect(fov_edge, edge)]):
-                    blocking_edges.append(edge)
 
-                    """
-                    If any angle point(s) would occur because of this edge, they
-                    would have been found by now and the edge would have been
-                    tagged as a blocking one. Even if no angle points were found
-                    due to this edge it still may be a blocking, or not. Perform
-                    a couple of segment – segment intersection tests with the
-                    sector's edges to check if the edge is indeed blocking. This
-                    is worth the expenditure incurred; say we have 10 angle
-                    points, for every redundant, non-blocking edge added without
-                    such a check means we waste time in performing 10 futile
-                    line segment intersection tests. Prune them early on by
-                    performing the tests beforehand.
-    
-                    Perform segment – segment testing if testSegSegXsect is
-                    true; this will be so if the arc intersection was never
-                    performed (say when both points are in FrontSemicircle and
-                    their edge occluding vision) or if the intersection points
-                    aren't behind the sector; there can be cases where not both
-                    points are behind (if so they'd have gotten pruned by now),
-                    but the intersection points are behind, prune them.
-                    """
 
-            prev_edge = edge
+    def add_angle_point_with_aux_for_edge_a(self, edge, prev_edge, angle_points):
+        if prev_edge is None:
+            # nothing joins on to this end of the edge, so it's a free end like the last edge's b end
+            self.add_angle_point_with_aux(edge.a, edge, None, angle_points)
+        else:
+            self.add_angle_point_with_aux(edge.a, prev_edge, edge, angle_points)
 
     def is_zero(self, vec):
         return (abs(vec.x) + abs(vec.y)) <= self.epsilon
@@ -577,23 +628,24 @@ class ViewCone:
                 j += 1
         return rays
 
-    def angular_points_sorter(self, a, b):
-        a_v = a[0] - self.origin_centre_position
-        b_v = b[0] - self.origin_centre_position
-        # sort expects a negative value when a should come before b; since
-        # cross2d gives a negative value when the rotation from a to b is
-        # counter-clockwise we use it as-is; see comment in isPointInSector
-        return a_v.cross(b_v)
-
-    def aux_angular_points_sorter(self, a, b):
-        a_v = a - self.origin_centre_position
-        b_v = b - self.origin_centre_position
-        # sort expects a negative value when a should come before b; since
-        # cross2d gives a negative value when the rotation from a to b is
-        # counter-clockwise we use it as-is; see comment in isPointInSector
-        return a_v.cross(b_v)
-
-    def sort_angular_points(self, angle_points, blocking_edges):
+    def get_pseudo_angle(self, point):
+        """
+        A stand in for a point's sweep angle (see get_sweep_angle()) that goes up and down with it, between -2 and
+        2, but is cheaper to work out as it needs no trigonometry. Good for sort keys.
+        """
+        offset_x = point.x - self.origin_centre_position.x
+        offset_y = point.y - self.origin_centre_position.y
+        along = (self.facing_direction.x * offset_x) + (self.facing_direction.y * offset_y)
+        across = (self.facing_direction.y * offset_x) - (self.facing_direction.x * offset_y)
+        total = abs(along) + abs(across)
+        if total == 0.0:
+            return 0.0
+        return math.copysign(1.0 - (along / total), across)
+
+    def get_point_group_pseudo_angle(self, point_group):
+        return self.get_pseudo_angle(point_group[0])
+
+    def strip_seam_points(self, angle_points, blocking_edges):
         # need to determine if two co-planar edges share a point so we can strip it
         points_to_remove = []
         for edge in blocking_edges:
@@ -612,15 +664,18 @@ class ViewCone:
                             shared_point = edge.b
                         if shared_point is not None:
                             points_to_remove.append(shared_point)
-        angle_points.points = [angle_points.points[i] for i in range(0, len(angle_points.points)) if
-                               angle_points.points[i][0] not in points_to_remove]
-        angle_points.points.sort(key=functools.cmp_to_key(self.angular_points_sorter))
+        angle_points.remove_points(points_to_remove)
+
+    def sort_angular_points(self, angle_points):
+        # sorted in the order the cone sweeps round from its first extent to its second, with each point's
+        # auxiliary points sorted the same way amongst themselves
+        angle_points.points.sort(key=self.get_point_group_pseudo_angle)
 
         final_angle_points = []
         for point_group in angle_points.points:
-            point_group.sort(key=functools.cmp_to_key(self.aux_angular_points_sorter))
-            for point in point_group:
-                final_angle_points.append(point)
+            if len(point_group) > 1:
+                point_group.sort(key=self.get_pseudo_angle)
+            final_angle_points.extend(point_group)
         return final_angle_points
 
     @staticmethod
@@ -631,29 +686,148 @@ class ViewCone:
         ctrl_point = centre + (ctrl_point * scale)
         return ctrl_point
 
+    def get_sweep_angle(self, vector):
+        """
+        The angle of a vector from our facing direction, in radians between -pi and pi. It goes up in the same
+        order that sort_angular_points puts angle points in, so our rays sweep from the lowest angle to the highest.
+        """
+        return -math.atan2((self.facing_direction.x * vector[1]) - (self.facing_direction.y * vector[0]),
+                           (self.facing_direction.x * vector[0]) + (self.facing_direction.y * vector[1]))
+
+    def get_edge_sweep_intervals(self, edge):
+        """
+        The ranges of sweep angles that rays can hit an edge in, widened a little so rays that just touch an end
+        point of the edge still get tested against it.
+
+        :return: a list of [lowest angle, highest angle] ranges. Usually one, but two for an edge that crosses the
+                 direction straight behind us, where the angles wrap around from pi to -pi.
+        """
+        origin = self.origin_centre_position
+        a_offset = (edge.a.x - origin.x, edge.a.y - origin.y)
+        b_offset = (edge.b.x - origin.x, edge.b.y - origin.y)
+        if (a_offset[0] ** 2 + a_offset[1] ** 2 <= self.epsilon or
+                b_offset[0] ** 2 + b_offset[1] ** 2 <= self.epsilon):
+            # the edge starts right on top of us so it could be anywhere around us
+            return [[-math.pi, math.pi]]
+        a_angle = self.get_sweep_angle(a_offset)
+        b_angle = self.get_sweep_angle(b_offset)
+        low_angle = min(a_angle, b_angle)
+        high_angle = max(a_angle, b_angle)
+        if high_angle - low_angle > math.pi:
+            return [[-math.pi, low_angle + self.sweep_angle_margin], [high_angle - self.sweep_angle_margin, math.pi]]
+        return [[low_angle - self.sweep_angle_margin, high_angle + self.sweep_angle_margin]]
+
+    def get_edge_distance_squared(self, edge):
+        """
+        The squared distance from our origin to the closest point on an edge; no ray can hit the edge any closer.
+        """
+        if edge.length_squared <= 0.0:
+            return edge.a.distance_squared_to(self.origin_centre_position)
+        t = (((self.origin_centre_position.x - edge.a.x) * edge.vec.x) +
+             ((self.origin_centre_position.y - edge.a.y) * edge.vec.y)) / edge.length_squared
+        t = min(max(t, 0.0), 1.0)
+        closest_x = edge.a.x + (edge.vec.x * t)
+        closest_y = edge.a.y + (edge.vec.y * t)
+        return (closest_x - self.origin_centre_position.x) ** 2 + (closest_y - self.origin_centre_position.y) ** 2
+
+    def ray_hit_edge(self, ray_end_x, ray_end_y, edge):
+        """
+        The same test as line_seg_line_seg_x_sect() with a ray as the first line and should_compute_point set, but
+        working on plain floats, so shooting lots of rays doesn't allocate a result dictionary and a handful of
+        vectors for every edge we test.
+
+        :return: (t along the ray, hit x, hit y) or None if the ray misses the edge.
+        """
+        origin_x = self.origin_centre_position.x
+        origin_y = self.origin_centre_position.y
+        ray_vec_x = ray_end_x - origin_x
+        ray_vec_y = ray_end_y - origin_y
+        edge_vec_x = edge.b.x - edge.a.x
+        edge_vec_y = edge.b.y - edge.a.y
+        f = (edge_vec_x * -ray_vec_y) + (edge_vec_y * ray_vec_x)
+        if abs(f) <= self.epsilon:
+            # parallel, only a hit if the edge lies along the ray
+            to_edge_x = edge.a.x - origin_x
+            to_edge_y = edge.a.y - origin_y
+            if abs((to_edge_x * ray_vec_y) - (to_edge_y * ray_vec_x)) > self.epsilon:
+                return None
+            alpha = (((origin_x - edge.a.x) * edge_vec_x) + ((origin_y - edge.a.y) * edge_vec_y)) / edge.length_squared
+            if 0 <= alpha <= 1:
+                return 0, origin_x, origin_y
+            if alpha < 0:
+                ray_length_squared = (ray_vec_x * ray_vec_x) + (ray_vec_y * ray_vec_y)
+                return (((to_edge_x * ray_vec_x) + (to_edge_y * ray_vec_y)) / ray_length_squared,
+                        edge.a.x, edge.a.y)
+            return None
+
+        c_x = origin_x - edge.a.x
+        c_y = origin_y - edge.a.y
+        e = (c_x * -ray_vec_y) + (c_y * ray_vec_x)
+        if (f > 0 and 0 <= e <= f) or (f < 0 and 0 >= e >= f):
+            d = (c_x * -edge_vec_y) + (c_y * edge_vec_x)
+            if (f > 0 and d >= 0) or (f < 0 and d <= 0):
+                s = d / f
+                return s, origin_x + (ray_vec_x * s), origin_y + (ray_vec_y * s)
+        return None
+
     def shoot_rays(self, rays, blocking_edges):
-        line_1_is_ray = True
-        should_compute_point = True
+        """
+        Find where each ray first hits a blocking edge, or the arc of the cone if it hits nothing before that.
+
+        Rather than test every ray against every edge, we sweep across the rays in order keeping a set of 'active'
+        edges, the ones whose range of angles the sweep is currently inside. Each edge comes into the set when the
+        sweep reaches its first angle and leaves it after its last. The active set is kept in order of how close
+        each edge gets to us, so each ray tests the nearest edges first and can stop as soon as the next edge is
+        further away than the best hit so far.
+
+        :param rays: vectors from our origin, in the order make_rays() gives them.
+        :param blocking_edges: the edges that can block the rays.
+        :return: {'hit_points': [...], 'ctrl_points': [...]} with a hit point for each ray and a control point for
+                 each hit point that needs an arc drawing to it from the previous one (or None if it doesn't).
+        """
         n = len(rays)
         hit_points = [None for _ in range(0, n)]
         ctrl_points = [None for _ in range(0, n)]
-        # rays is an array of vectors only, however the intersection functions
-        # work on edges i.e. it also needs the end points and square length; hence
-        # this_ray would act as the ray with additional edge data
-        prev_point_on_arc = False
-        prev_unit_ray = Vector2()
-        for i in range(0, n):
-            #  set edge data on this_ray specific to the ray currently shot
-            this_ray = Edge("ray", self.origin_centre_position, self.origin_centre_position + rays[i])
-            hit_point = Vector2()
+
+        edge_distances_squared = [self.get_edge_distance_squared(edge) for edge in blocking_edges]
+        start_events = []
+        end_events = []
+        for edge_index in range(0, len(blocking_edges)):
+            for low_angle, high_angle in self.get_edge_sweep_intervals(blocking_edges[edge_index]):
+                start_events.append((low_angle, edge_index))
+                end_events.append((high_angle, edge_index))
+        start_events.sort()
+        end_events.sort()
+        next_start_event = 0
+        next_end_event = 0
+        active_edges = []  # sorted (distance squared, edge index) pairs
+
+        # the auxiliary rays can be a little out of order with the rays around them, so sweep through them in order
+        # of their angles and put the hits back in ray order
+        ray_angles = [self.get_sweep_angle(ray) for ray in rays]
+        ray_hits = [None for _ in range(0, n)]
+        for i in sorted(range(0, n), key=ray_angles.__getitem__):
+            while next_start_event < len(start_events) and start_events[next_start_event][0] <= ray_angles[i]:
+                edge_index = start_events[next_start_event][1]
+                bisect.insort(active_edges, (edge_distances_squared[edge_index], edge_index))
+                next_start_event += 1
+            while next_end_event < len(end_events) and end_events[next_end_event][0] < ray_angles[i]:
+                edge_index = end_events[next_end_event][1]
+                del active_edges[bisect.bisect_left(active_edges, (edge_distances_squared[edge_index], edge_index))]
+                next_end_event += 1
+
+            ray_end_x = self.origin_centre_position.x + rays[i].x
+            ray_end_y = self.origin_centre_position.y + rays[i].y
             t = None
-            blocker = None
-            hit_dist_2 = None
-            for j in range(0, len(blocking_edges)):
-                res = self.line_seg_line_seg_x_sect(this_ray, blocking_edges[j], should_compute_point, line_1_is_ray)
-                # both parallel and intersecting cases are valid for inspection;
-                # both have the parameter and point defined
-                if (res['t'] is not None) and ((t is None) or (res['t'] < t)):
+            hit = None
+            for edge_distance_squared, edge_index in active_edges:
+                if t is not None and edge_distance_squared > hit[0] + self.epsilon:
+                    break  # this edge, and all the ones after it, are further away than our hit
+                res = self.ray_hit_edge(ray_end_x, ray_end_y, blocking_edges[edge_index])
+                if res is None:
+                    continue
+                # when two edges are hit at the same point, prefer the one that comes first in blocking_edges
+                if (t is None) or (res[0] < t) or (res[0] == t and edge_index < hit[3]):
                     # This is needed when the observer is exactly at a polygon's
                     # vertex, from where both worlds (outside and inside the
                     # polygon/building) are visible as the observer is standing at
@@ -663,11 +837,24 @@ class ViewCone:
                     # However, the value of t can vary depending on the length of
                     # the ray, hence using the distance between the points as a
                     # better measure of proximity
-                    hit_dist_2 = res['point'].distance_squared_to(self.origin_centre_position)
+                    hit_dist_2 = ((res[1] - self.origin_centre_position.x) ** 2 +
+                                  (res[2] - self.origin_centre_position.y) ** 2)
                     if hit_dist_2 > self.epsilon:
-                        t = res['t']
-                        hit_point = Vector2(res['point'])
-                        blocker = blocking_edges[j]
+                        t = res[0]
+                        hit = (hit_dist_2, res[1], res[2], edge_index)
+            ray_hits[i] = hit
+
+        prev_point_on_arc = False
+        prev_unit_ray = Vector2()
+        for i in range(0, n):
+            if ray_hits[i] is not None:
+                hit_dist_2, hit_x, hit_y, blocker_index = ray_hits[i]
+                hit_point = Vector2(hit_x, hit_y)
+                blocker = blocking_edges[blocker_index]
+            else:
+                hit_dist_2 = None
+                hit_point = Vector2()
+                blocker = None
             """
             the ray could've hit
             
@@ -690,7 +877,7 @@ class ViewCone:
             is chosen over atan2 since it's usually faster:
             http://stackoverflow.com/a/9318108.
             """
-            point_on_arc = (t is None) or ((hit_dist_2 + self.epsilon - self.length_squared) >= 0)
+            point_on_arc = (hit_dist_2 is None) or ((hit_dist_2 + self.epsilon - self.length_squared) >= 0)
             if point_on_arc:
                 unit_ray = rays[i].normalize()
                 # for cases (i), (ii.b) and (ii.c) set the hit point; this would
@@ -752,6 +939,57 @@ class ViewCone:
             return not any([True for edge in self.blocking_edges if self.los_blocked_test(ray, edge)])
         return False
 
+    def are_subjects_visible(self, points):
+        """
+        is_subject_visible() for lots of points at once. With NumPy around every point is tested against every
+        blocking edge in one go, using the same sums as line_seg_line_seg_x_sect(), so the answers match exactly.
+
+        :param points: an N x 2 array (or anything NumPy can turn into one) of world positions.
+        :return: a NumPy array of N booleans, True where the point is visible. A plain list of them if NumPy is
+                 not installed.
+        """
+        if numpy is None:
+            return [self.is_subject_visible(Vector2(point[0], point[1])) for point in points]
+
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+        origin_x = self.origin_centre_position.x
+        origin_y = self.origin_centre_position.y
+        ray_vec_x = points[:, 0] - origin_x
+        ray_vec_y = points[:, 1] - origin_y
+
+        # is_point_in_sector() == WITHIN
+        visible = (self.facing_direction.x * ray_vec_x) + (self.facing_direction.y * ray_vec_y) >= 0
+        visible &= ((ray_vec_x * ray_vec_x) + (ray_vec_y * ray_vec_y)) - self.length_squared <= self.epsilon
+        cross_1 = (self.cone_extent_facings[0].x * ray_vec_y) - (self.cone_extent_facings[0].y * ray_vec_x)
+        cross_2 = (self.cone_extent_facings[1].x * ray_vec_y) - (self.cone_extent_facings[1].y * ray_vec_x)
+        visible &= ((cross_1 < 0) & (cross_2 > 0)) | ((cross_1 > 0) & (cross_2 < 0))
+        if len(self.blocking_edges) == 0 or not visible.any():
+            return visible
+
+        # los_blocked_test() of every remaining ray against every blocking edge, points down the rows and edges
+        # across the columns
+        edge_ends = numpy.array([[edge.a.x, edge.a.y, edge.b.x, edge.b.y] for edge in self.blocking_edges])
+        rows = numpy.flatnonzero(visible)
+        ray_vec_x = ray_vec_x[rows, None]
+        ray_vec_y = ray_vec_y[rows, None]
+        edge_vec_x = edge_ends[None, :, 2] - edge_ends[None, :, 0]
+        edge_vec_y = edge_ends[None, :, 3] - edge_ends[None, :, 1]
+        c_x = origin_x - edge_ends[None, :, 0]
+        c_y = origin_y - edge_ends[None, :, 1]
+        f = (edge_vec_x * -ray_vec_y) + (edge_vec_y * ray_vec_x)
+        e = (c_x * -ray_vec_y) + (c_y * ray_vec_x)
+        d = (c_x * -edge_vec_y) + (c_y * edge_vec_x)
+        intersects = (numpy.abs(f) > self.epsilon) & (
+            ((f > 0) & (0 <= e) & (e <= f) & (0 <= d) & (d <= f)) |
+            ((f < 0) & (0 >= e) & (e >= f) & (0 >= d) & (d >= f)))
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            s = d / f
+        hit_offset_x = (origin_x + (ray_vec_x * s)) - origin_x
+        hit_offset_y = (origin_y + (ray_vec_y * s)) - origin_y
+        blocked = intersects & ((hit_offset_x * hit_offset_x) + (hit_offset_y * hit_offset_y) > self.epsilon)
+        visible[rows] = ~blocked.any(axis=1)
+        return visible
+
     def update(self):
         """
         Based on method established here:
@@ -760,17 +998,38 @@ class ViewCone:
         :return:
         """
         #tick_1 = self.timing_clock.tick()
-        # each loop we first grab the edges that are attached to world objects in our cone length/radius
+        pose_key = self.get_pose_key()
+        cached_result = self.results_by_pose.get(pose_key)
+        if cached_result is not None:
+            self.results_by_pose.move_to_end(pose_key)
+            self.angle_points_array, self.rays, self.hit_points, self.ctrl_points, self.blocking_edges = cached_result
+            return
+
+        # each loop we first grab the edges that are attached to world objects in our cone
         # then we cull down only to the edges whose closest point is in our radius
-        if len(self.collision_circle.collided_shapes_this_frame) != 0:
+        # When the grid has a static occluder index we can go straight to its merged outline segments, which already
+        # leave out the seams between neighbouring shapes.
+        occluders = self.collision_grid.static_occluders
+        if occluders is not None:
+            nearby_shapes = []
+            has_blockers = len(occluders.segments_by_bucket) != 0
+        else:
+            nearby_shapes = self.collision_grid.query_sector(self.origin_centre_position, self.facing_direction,
+                                                             self.field_of_view, self.length, self.blocking_game_types)
+            has_blockers = len(nearby_shapes) != 0
+        if has_blockers:
             blocking_edges = []
             angle_points = AnglePointSet()
 
-            for shape in self.collision_circle.collided_shapes_this_frame:
-                if shape.type == BaseCollisionShape.RECT:
-                    self.check_polygon(shape, angle_points, blocking_edges)
+            if occluders is not None:
+                self.check_occluders(occluders, angle_points, blocking_edges)
+            else:
+                for shape in nearby_shapes:
+                    if shape.type == BaseCollisionShape.RECT:
+                        self.check_polygon(shape, angle_points, blocking_edges)
+                self.strip_seam_points(angle_points, blocking_edges)
 
-            sorted_angle_points = self.sort_angular_points(angle_points, blocking_edges)
+            sorted_angle_points = self.sort_angular_points(angle_points)
 
             angle_points_array = [Vector2(self.end_positions[0])]
             angle_points_array.extend(sorted_angle_points)
@@ -785,11 +1044,23 @@ class ViewCone:
             self.ctrl_points = result['ctrl_points']
             self.blocking_edges = blocking_edges
 
+            self.results_by_pose[pose_key] = (self.angle_points_array, self.rays, self.hit_points, self.ctrl_points,
+                                              self.blocking_edges)
+            if len(self.results_by_pose) > self.max_cached_poses:
+                self.results_by_pose.popitem(last=False)
+
         #tick_2 = self.timing_clock.tick()
 
         #if tick_2 > 7:
         #   print("view_cone_timing:", tick_2, "ms")
 
+    def get_pose_key(self):
+        return (round(self.origin_centre_position.x / self.pose_quantum),
+                round(self.origin_centre_position.y / self.pose_quantum),
+                round(self.facing_direction.x / self.facing_quantum),
+                round(self.facing_direction.y / self.facing_quantum),
+                self.collision_grid.static_geometry_version)
+
     def clear(self):
         self.angle_points_array = []
         self.rays = []
@@ -837,7 +1108,8 @@ def test_cone():
     background.fill(pygame.Color("#000000"))
 
     running = True
-    view_cone = ViewCone([400, 300], [1.0, 0.0], fov=60, length=200)
+    collision_grid = CollisionGrid(64, multi_cell_insertion=True)
+    view_cone = ViewCone([400, 300], [1.0, 0.0], collision_grid, fov=60, length=200)
 
     test_rect = CollisionRect(pygame.Rect((310, 400), (30, 30)), 0,
                               {CollisionType.VIEW_CONE: CollisionNoHandler()},
@@ -853,15 +1125,16 @@ def test_cone():
                                )
     drawable_test_rect_2 = DrawableCollisionRect(test_rect_2)
 
-    drawable_test_circle = DrawableCollisionCircle(view_cone.collision_circle)
-
-    test_rect.normals["right"].should_skip = True
-    test_rect_2.normals["left"].should_skip = True
+    test_rect.set_normal_should_skip("right", True)
+    test_rect_2.set_normal_should_skip("left", True)
+    collision_grid.add_static_grid_aligned_shape_to_grid(test_rect)
+    collision_grid.add_static_grid_aligned_shape_to_grid(test_rect_2)
 
     test_points = []
     for _ in range(0, 1000):
         test_points.append(pygame.math.Vector2(float(random.randint(10, 790)),
                                                float(random.randint(10, 590))))
+    test_point_positions = [[point.x, point.y] for point in test_points]
 
     clock = pygame.time.Clock()
     while running:
@@ -888,32 +1161,17 @@ def test_cone():
 
         view_cone.update()
 
-        for point in test_points:
-            if view_cone.is_subject_visible(point):
+        visible_points = view_cone.are_subjects_visible(test_point_positions)
+        for point, is_visible in zip(test_points, visible_points):
+            if is_visible:
                 pygame.draw.line(screen, pygame.Color("#0000FF"), point, [point.x + 1, point.y + 1], 2)
             else:
                 pygame.draw.line(screen, pygame.Color("#FF0000"), point, [point.x + 1, point.y + 1], 2)
 
-        if collide_circle_with_rotated_rectangle(view_cone.collision_circle, test_rect):
-            test_rect.add_frame_collided_shape(view_cone.collision_circle)
-            view_cone.collision_circle.add_frame_collided_shape(test_rect)
-        else:
-            test_rect.clear_frame_collided_shapes()
-            view_cone.collision_circle.clear_frame_collided_shapes()
-
-        if collide_circle_with_rotated_rectangle(view_cone.collision_circle, test_rect_2):
-            test_rect_2.add_frame_collided_shape(view_cone.collision_circle)
-            view_cone.collision_circle.add_frame_collided_shape(test_rect_2)
-        else:
-            test_rect_2.clear_frame_collided_shapes()
-            view_cone.collision_circle.clear_frame_collided_shapes()
-
         drawable_test_rect.update_collided_colours()
         drawable_test_rect_2.update_collided_colours()
-        drawable_test_circle.update_collided_colours()
         drawable_test_rect.draw(screen)
         drawable_test_rect_2.draw(screen)
-        # drawable_test_circle.draw(screen)
         view_cone.draw(screen)
         pygame.display.flip()
 
@@ -926,10 +1184,11 @@ def test_line_seg_intersection():
     background.fill(pygame.Color("#000000"))
 
     running = True
-    view_cone = ViewCone([400, 300], [1.0, 0.0], fov=60, length=200)
+    collision_grid = CollisionGrid(64, multi_cell_insertion=True)
+    view_cone = ViewCone([400, 300], [1.0, 0.0], collision_grid, fov=60, length=200)
 
-    line_1 = Edge("line_1", Vector2(400.0, 200.0), Vector2(400.0, 400.0), 200.0)
-    line_2 = Edge("line_1", Vector2(300.0, 300.0), Vector2(500.0, 300.0), 200.0)
+    line_1 = Edge("line_1", Vector2(400.0, 200.0), Vector2(400.0, 400.0))
+    line_2 = Edge("line_2", Vector2(300.0, 300.0), Vector2(500.0, 300.0))
 
     clock = pygame.time.Clock()
     while running:
@@ -945,12 +1204,12 @@ def test_line_seg_intersection():
                                     mouse_pos[1] - view_cone.origin_centre_position[1]]
                     length = math.sqrt(vec_to_mouse[0] ** 2 + vec_to_mouse[1] ** 2)
                     if length > 0.0:
-                        vec_to_mouse_norm = [vec_to_mouse[0] / length, vec_to_mouse[1] / length]
+                        vec_to_mouse_norm = Vector2(vec_to_mouse[0] / length, vec_to_mouse[1] / length)
 
                         view_cone.set_facing_direction(vec_to_mouse_norm)
 
                 if event.button == 3:
-                    view_cone.set_position(pygame.mouse.get_pos())
+                    view_cone.set_position(Vector2(pygame.mouse.get_pos()))
 
         result = view_cone.line_seg_line_seg_x_sect(line_1, line_2, True)
         print(result['point'])
@@ -48,8 +48,7 @@ class VaniaGame:
 
         world_filling_number_of_grid_squares = [int(world_size[0]/grid_square_size),
                                                 int(world_size[1]/grid_square_size)]
-        self.collision_grid = CollisionGrid(world_filling_number_of_grid_squares,
-                                            grid_square_size)
+        self.collision_grid = CollisionGrid(grid_square_size, multi_cell_insertion=True)
 
         self.moving_sprites_group = pygame.sprite.Group()
         self.ui_sprites_group = pygame.sprite.Group()